@@ -0,0 +1,170 @@
+'''
+オフラインのベンチマーク（外部サービスは excel_sheet_matching_agent.fakes の偽物に置き換える）
+
+    python -m benchmarks.run --scales 10 100 --output data/benchmarks/latest.json
+    python -m benchmarks.run --scales 10 100 --baseline benchmarks/baseline.json
+
+synthetic.py で examples/ のサンプルの scale 倍のデータを作り、各処理の時間（repeat 回の最小値）を測って JSON に書く。
+--baseline を指定すると、基準より tolerance の割合以上（かつ min_delta 秒以上）遅くなった処理があれば終了コード 1 で終わる。
+'''
+from openpyxl import load_workbook
+
+from pathlib import Path
+from typing import Callable, Optional
+import argparse
+import json
+import logging
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from excel_sheet_matching_agent.analyze_local_pdf import analyze_local_pdf
+from excel_sheet_matching_agent.fakes import FakeDocumentIntelligenceClient, FakeMatchingLLM
+from excel_sheet_matching_agent.instrumentation import peak_rss_bytes
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.layout_store import open_layout
+from excel_sheet_matching_agent.load_xlsx import extract_data, extract_tables
+from excel_sheet_matching_agent.load_xlsx_llm import sheet2str
+from excel_sheet_matching_agent.markup import mark_labels, markup_excel_pdf, markup_source_pdf
+from excel_sheet_matching_agent.matching import match
+
+from .synthetic import SHEET_NAME, SyntheticCase, make_case
+
+
+DEFAULT_SCALES = [10, 100]
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MIN_DELTA = 0.01
+
+
+def measure(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_case(case: SyntheticCase, work_dir: Path, repeat: int = 3, llm_latency: float = 0.0) -> dict[str, float]:
+    """1 つの合成データで各処理を測る（処理名 → 秒）"""
+    out_dir = work_dir / "out"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    timings: dict[str, float] = {}
+    runs = 0
+
+    def analyze():
+        # 毎回空のキャッシュから（API 呼び出し後の変換・保存・配置の時間）
+        nonlocal runs
+        runs += 1
+        client = FakeDocumentIntelligenceClient(layouts={case.source_pdf_path.stem: case.json_path})
+        analyze_local_pdf(case.source_pdf_path, work_dir / f"analyzed_{runs}", cache=LayoutCache(work_dir / f"cache_{runs}"), client=client)  # type: ignore
+    timings["analyze_local_pdf"] = measure(analyze, repeat)
+
+    timings["extract_data"] = measure(lambda: extract_data(case.excel_path, SHEET_NAME), repeat)
+    timings["extract_tables"] = measure(lambda: extract_tables(case.excel_path, [SHEET_NAME]), repeat)
+    inputs = extract_data(case.excel_path, SHEET_NAME).input
+
+    wb = load_workbook(case.excel_path)
+    timings["sheet2str"] = measure(lambda: sheet2str(wb[SHEET_NAME]), repeat)
+    wb.close()
+
+    sources = [case.markdown_path], [case.json_path]
+    timings["match"] = measure(lambda: match(FakeMatchingLLM(latency=llm_latency), inputs, *sources), repeat)  # type: ignore
+    timings["match_llm"] = measure(
+        lambda: match(FakeMatchingLLM(latency=llm_latency), inputs, *sources, use_prematch=False), repeat  # type: ignore
+    )
+    results = match(FakeMatchingLLM(), inputs, *sources, use_prematch=False)  # type: ignore
+    labels = mark_labels(len(inputs))
+
+    layout = open_layout(case.json_path)
+    try:
+        timings["markup_source_pdf"] = measure(
+            lambda: markup_source_pdf(case.source_pdf_path, out_dir / "source_markup.pdf", results, layout, labels), repeat
+        )
+    finally:
+        layout.close()
+    matches = [r.match for r in results]
+    timings["markup_excel_pdf"] = measure(
+        lambda: markup_excel_pdf(case.excel_path, case.excel_pdf_path, out_dir / "excel_markup.pdf", inputs, matches, labels),
+        repeat,
+    )
+    return timings
+
+
+def run(
+        scales: list[int],
+        work_dir: Optional[Path] = None,
+        repeat: int = 3,
+        llm_latency: float = 0.0,
+        seed: int = 0,
+    ) -> dict:
+    """scales の各倍率で測った結果（`{scale}x/{処理名}` → 秒）と実行環境"""
+    owns_work_dir = work_dir is None
+    work_dir = work_dir or Path(tempfile.mkdtemp(prefix="esma-bench-"))
+    results: dict[str, float] = {}
+    try:
+        for scale in scales:
+            case_dir = work_dir / f"x{scale}"
+            case = make_case(case_dir, scale, seed=seed)
+            for name, seconds in run_case(case, case_dir, repeat, llm_latency).items():
+                results[f"{scale}x/{name}"] = seconds
+                print(f"{scale:>5}x {name:<20} {seconds * 1000:10.1f} ms", flush=True)
+    finally:
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform(), "machine": platform.machine()},
+        "repeat": repeat,
+        "llm_latency": llm_latency,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "results": results,
+    }
+
+
+def compare(
+        current: dict,
+        baseline: dict,
+        tolerance: float = DEFAULT_TOLERANCE,
+        min_delta: float = DEFAULT_MIN_DELTA,
+    ) -> list[str]:
+    """基準より遅くなった処理の説明（両方にある処理だけを比べる）"""
+    regressions = []
+    for name, base in baseline["results"].items():
+        now = current["results"].get(name)
+        if now is None:
+            continue
+        if now > base * (1 + tolerance) and now - base > min_delta:
+            regressions.append(f"{name}: {base * 1000:.1f} ms -> {now * 1000:.1f} ms ({now / base:.2f}x)")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="multiples of the example size")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (the minimum is kept)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake LLM waits per call")
+    parser.add_argument("--work-dir", type=Path, help="keep the generated data here")
+    parser.add_argument("--output", type=Path, default=Path("./data/benchmarks/latest.json"))
+    parser.add_argument("--baseline", type=Path, help="fail if slower than this result file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA, help="ignore slowdowns below this (seconds)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    current = run(args.scales, args.work_dir, args.repeat, args.llm_latency)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(current, indent=2), encoding="utf-8")
+    print(f"results: {args.output}")
+
+    if args.baseline is None:
+        return 0
+    regressions = compare(current, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance, args.min_delta)
+    for regression in regressions:
+        print(f"  regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
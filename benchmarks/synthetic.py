@@ -0,0 +1,204 @@
+'''
+ベンチマーク用の合成データ（計算シート・出典PDFとその prebuilt-layout の解析結果・Excel印刷PDF）
+
+examples/ のサンプル（入力セル 4 + 計算セル 2 の 6 行、出典 1 ページ）を 1 倍として、scale 倍の大きさで作る。
+乱数は seed で固定するので、同じ引数なら同じデータになる。
+'''
+import fitz
+from openpyxl import Workbook
+
+from pathlib import Path
+from typing import NamedTuple, Optional
+import json
+import random
+
+
+SHEET_NAME = "シート1"
+EXAMPLE_ROWS = 6
+LINES_PER_PAGE = 40
+UNITS = ["Bq/cm3", "cm3", "Sv/Bq*m2", "m", "kg", "mSv"]
+FILLER = "本資料は性能評価のために生成した文書であり、記載の数値に意味はない。"
+
+# 出典PDFのレイアウト（A4、inch）
+PAGE_WIDTH, PAGE_HEIGHT = 8.2778, 11.6944
+MARGIN = 1.0
+LINE_HEIGHT = 0.25
+FONT_NAME = "japan"
+FONT_SIZE = 10
+
+
+class SyntheticRow(NamedTuple):
+    row: int
+    label: str
+    value: float
+    unit: str
+    formula: Optional[str]  # 計算セルなら数式
+
+
+class SyntheticCase(NamedTuple):
+    excel_path: Path
+    excel_pdf_path: Path
+    source_pdf_path: Path
+    markdown_path: Path
+    json_path: Path
+    rows: list[SyntheticRow]
+
+
+def make_rows(rows: int, density: float = 1.0, formula_ratio: float = 1 / 3, seed: int = 0) -> list[SyntheticRow]:
+    """
+    rows 行のうち density の割合の行に値を置き、そのうち formula_ratio の割合を計算セルにする。
+    計算セルは直前の入力セルの 2 倍。
+    """
+    rng = random.Random(seed)
+    result: list[SyntheticRow] = []
+    previous: Optional[SyntheticRow] = None
+    for row in range(2, rows + 2):
+        if rng.random() >= density:
+            continue
+        label = f"項目{row - 1}"
+        unit = rng.choice(UNITS)
+        if previous is not None and rng.random() < formula_ratio:
+            result.append(SyntheticRow(row, label, previous.value * 2, previous.unit, f"=B{previous.row}*2"))
+            continue
+        # 文書中で値が一意になるように、行番号を値に含める
+        previous = SyntheticRow(row, label, (rng.randint(1, 999) * 10**6 + row) / 100, unit, None)
+        result.append(previous)
+    return result
+
+
+def write_workbook(path: Path, rows: list[SyntheticRow]):
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None
+    ws.title = SHEET_NAME
+    for r in rows:
+        ws.cell(r.row, 1, r.label)
+        ws.cell(r.row, 2, r.formula if r.formula else r.value)
+        ws.cell(r.row, 3, r.unit)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb.save(path)
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _words(text: str) -> list[tuple[int, int]]:
+    """Document Intelligence と同じく、日本語は 1 文字ずつ・英数字は空白までを 1 単語にする"""
+    words = []
+    i = 0
+    while i < len(text):
+        if text[i] == " ":
+            i += 1
+            continue
+        j = i + 1
+        if text[i].isascii():
+            while j < len(text) and text[j].isascii() and text[j] != " ":
+                j += 1
+        words.append((i, j))
+        i = j
+    return words
+
+
+def _rect(x0: float, y0: float, x1: float, y1: float) -> list[float]:
+    return [round(v, 4) for v in (x0, y0, x1, y0, x1, y1, x0, y1)]
+
+
+def source_lines(rows: list[SyntheticRow], filler_every: int = 4) -> list[str]:
+    lines = []
+    for i, r in enumerate(r for r in rows if r.formula is None):
+        if filler_every and i % filler_every == 0:
+            lines.append(FILLER)
+        lines.append(f"{r.label}は {_format(r.value)} {r.unit} とする。")
+    return lines
+
+
+def write_source(pdf_path: Path, json_path: Path, markdown_path: Path, lines: list[str]):
+    """
+    lines を 1 ページ LINES_PER_PAGE 行で PDF に書き、同じ位置の単語・行を持つ prebuilt-layout の json と markdown を作る。
+    """
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    doc = fitz.open()
+    content = ""
+    layout_pages, paragraphs = [], []
+    for page_number, page_lines in enumerate(pages, start=1):
+        if page_number > 1:
+            content += "\n<!-- PageBreak -->\n"
+        page = doc.new_page(width=PAGE_WIDTH * 72, height=PAGE_HEIGHT * 72)
+        page_start = len(content)
+        words, layout_lines = [], []
+        for i, line in enumerate(page_lines):
+            if i:
+                content += "\n"
+            offset = len(content)
+            content += line
+            top = MARGIN + i * LINE_HEIGHT
+            bottom = top + FONT_SIZE / 72
+            page.insert_text((MARGIN * 72, bottom * 72), line, fontname=FONT_NAME, fontsize=FONT_SIZE)
+            for start, end in _words(line):
+                x0 = MARGIN + fitz.get_text_length(line[:start], fontname=FONT_NAME, fontsize=FONT_SIZE) / 72
+                x1 = MARGIN + fitz.get_text_length(line[:end], fontname=FONT_NAME, fontsize=FONT_SIZE) / 72
+                words.append({
+                    "content": line[start:end], "polygon": _rect(x0, top, x1, bottom), "confidence": 0.99,
+                    "span": {"offset": offset + start, "length": end - start},
+                })
+            x1 = MARGIN + fitz.get_text_length(line, fontname=FONT_NAME, fontsize=FONT_SIZE) / 72
+            polygon = _rect(MARGIN, top, x1, bottom)
+            spans = [{"offset": offset, "length": len(line)}]
+            layout_lines.append({"content": line, "polygon": polygon, "spans": spans})
+            paragraphs.append({
+                "content": line, "spans": spans,
+                "boundingRegions": [{"pageNumber": page_number, "polygon": polygon}],
+            })
+        layout_pages.append({
+            "pageNumber": page_number, "angle": 0, "width": PAGE_WIDTH, "height": PAGE_HEIGHT, "unit": "inch",
+            "words": words, "lines": layout_lines, "spans": [{"offset": page_start, "length": len(content) - page_start}],
+        })
+    for path in (pdf_path, json_path, markdown_path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(pdf_path)
+    doc.close()
+    layout = {
+        "apiVersion": "2024-11-30", "modelId": "prebuilt-layout", "stringIndexType": "textElements",
+        "content": content, "contentFormat": "markdown", "pages": layout_pages, "paragraphs": paragraphs,
+    }
+    json_path.write_text(json.dumps(layout, ensure_ascii=False), encoding="utf-8")
+    markdown_path.write_text(content, encoding="utf-8")
+
+
+def write_excel_pdf(path: Path, rows: list[SyntheticRow], rows_per_page: int = 50):
+    """計算シートを印刷したPDF（ラベル・値・単位の 3 列）"""
+    doc = fitz.open()
+    for start in range(0, max(len(rows), 1), rows_per_page):
+        page = doc.new_page()
+        for i, r in enumerate(rows[start:start + rows_per_page]):
+            y = 72 + i * 14
+            for x, text in ((72, r.label), (200, _format(r.value)), (320, r.unit)):
+                page.insert_text((x, y), text, fontname=FONT_NAME, fontsize=FONT_SIZE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(path)
+    doc.close()
+
+
+def make_case(
+        out_dir: Path,
+        scale: int = 1,
+        density: float = 1.0,
+        formula_ratio: float = 1 / 3,
+        seed: int = 0,
+    ) -> SyntheticCase:
+    """examples/ のサンプルの scale 倍の計算シート・出典PDF・解析結果・Excel印刷PDFを out_dir に作る"""
+    rows = make_rows(EXAMPLE_ROWS * scale, density, formula_ratio, seed)
+    stem = f"synthetic_x{scale}"
+    case = SyntheticCase(
+        excel_path=out_dir / f"{stem}.xlsx",
+        excel_pdf_path=out_dir / f"{stem}_{SHEET_NAME}.pdf",
+        source_pdf_path=out_dir / f"{stem}_source.pdf",
+        markdown_path=out_dir / "markdown" / f"{stem}_source.md",
+        json_path=out_dir / "json" / f"{stem}_source.json",
+        rows=rows,
+    )
+    write_workbook(case.excel_path, rows)
+    write_excel_pdf(case.excel_pdf_path, rows)
+    write_source(case.source_pdf_path, case.json_path, case.markdown_path, source_lines(rows))
+    return case
@@ -15,25 +15,19 @@ excel_pdf_path = Path("examples/計算シートサンプル_シート1.pdf")
 sheet_name = "シート1"
 source_pdfs = [Path("examples/出典サンプル.pdf")]
 
-# prebuild-layout
-analyzed_markdown_paths = []
-analyzed_json_paths = []
-for source_pdf in source_pdfs:
-    md, js = esma.analyze_local_pdf(source_pdf)
-    analyzed_markdown_paths.append(md)
-    analyzed_json_paths.append(js)
-
-# load Inputs/Outputs from Excel sheet
-inputs = esma.extract_data(excel_path, sheet_name).input
-
-# matching
+# prebuild-layout → load Inputs/Outputs from Excel sheet → matching → markup
+# 解析と Excel の読み込みは並行に、照合は出典の解析が終わりしだい始める。
+# 途中で止まっても、同じチェックポイントで再実行すれば終わった解析・照合は繰り返さない
 llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash-lite", temperature=0)
 # llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-matching_results = esma.match(llm, inputs, analyzed_markdown_paths)
-for (inp, result) in zip(inputs, matching_results):
+checkpoint_path = Path("data/checkpoints") / f"{excel_path.stem}_{sheet_name}.json"
+
+
+def show(inp, result):
     print("-"*10)
     print(inp)
     print(result)
 
-# markup
-esma.markup(excel_path, excel_pdf_path, inputs, matching_results, source_pdfs, analyzed_json_paths)
+
+matching_results = esma.run_pipeline(llm, excel_path, excel_pdf_path, sheet_name, source_pdfs, checkpoint_path,
+                                     on_result=show, verdict_cache=esma.VerdictCache())
@@ -1,4 +1,62 @@
-from .markup import markup
-from .analyze_local_pdf import analyze_local_pdf
-from .load_xlsx import extract_data
-from .matching import match
+'''
+公開APIは初回アクセス時に import する（PyMuPDF, openpyxl, Azure SDK, langchain の読み込みを必要になるまで遅らせる）
+'''
+from typing import TYPE_CHECKING
+import importlib
+import sys
+import types
+
+if TYPE_CHECKING:
+    from .markup import cell_labels, markup
+    from .analyze_local_pdf import analyze_local_pdf, analyze_many, analyze_many_async
+    from .load_xlsx import extract_data, extract_tables, iter_workbook
+    from .matching import amatch, impacted_outputs, match, resolve_targets
+    from .formula_graph import load_graph
+    from .manifest import amatch_incremental, match_incremental
+    from .pipeline import arun_pipeline, run_pipeline
+    from .verdict_cache import VerdictCache
+
+_LAZY_ATTRS = {
+    "markup": ".markup",
+    "cell_labels": ".markup",
+    "analyze_local_pdf": ".analyze_local_pdf",
+    "analyze_many": ".analyze_local_pdf",
+    "analyze_many_async": ".analyze_local_pdf",
+    "extract_data": ".load_xlsx",
+    "extract_tables": ".load_xlsx",
+    "iter_workbook": ".load_xlsx",
+    "match": ".matching",
+    "amatch": ".matching",
+    "impacted_outputs": ".matching",
+    "resolve_targets": ".matching",
+    "load_graph": ".formula_graph",
+    "match_incremental": ".manifest",
+    "amatch_incremental": ".manifest",
+    "run_pipeline": ".pipeline",
+    "arun_pipeline": ".pipeline",
+    "VerdictCache": ".verdict_cache",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name: str):
+        if name not in _LAZY_ATTRS:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+        super().__setattr__(name, value)
+        return value
+
+    def __setattr__(self, name: str, value):
+        # `markup`, `analyze_local_pdf` はサブモジュールと同名なので、
+        # サブモジュールの import で関数が上書きされないようにする
+        if name in _LAZY_ATTRS and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_LAZY_ATTRS))
+
+
+sys.modules[__name__].__class__ = _LazyModule
@@ -1,84 +1,537 @@
 '''
 This script will:
 - save results in `data/document_intelligence`
-  * markdown files: `data/document_intelligence/markdown`
-  * json files: `data/document_intelligence/json`
+  * markdown files: `data/document_intelligence/markdown/{stem}.{path digest}.md`
+  * json files: `data/document_intelligence/json/{stem}.{path digest}.json`
+    （path digest は PDF の絶対パスのハッシュ。別のフォルダの同名の PDF で上書きしないように）
+  * 前の名前（`{stem}.md` / `{stem}.json`。同梱の `出典サンプル.*` など）の解析結果があれば、キャッシュにないときに使う
+    （同名の別の PDF をその output_dir で解析したことがあれば使わない。使うのは 1 つの PDF の中身にだけ, see `_adopt_legacy`）
+  * layout store: `data/document_intelligence/json/{stem}.{path digest}.layout` (json の列指向版, see `layout_store.py`)
+  * cache: `data/document_intelligence/cache` (PDFの中身で引くキャッシュ, see `layout_cache.py`)
+- shard_pages / pages を指定すると、PDF をページごとのシャードに分けて並行に解析し、結果を 1 つにまとめる
+  （シャードごとにキャッシュするので、失敗や改訂で解析し直すのはそのシャードだけ, see `sharding.py`）
+- use_text_layer=True なら、テキストレイヤーのあるページは PyMuPDF で手元で解析し、
+  スキャンしたページだけを Document Intelligence に送る（see `text_layer.py`）
 
 # 追加
 多言語対応OCRでは、どうしても中国語の簡体字や繁体字が混ざってしまう
 紛れ込んでしまう中国語の漢字を日本語の漢字に変換する
 '''
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
 from azure.ai.documentintelligence import DocumentIntelligenceClient
+from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
+from azure.ai.documentintelligence.models import AnalyzeResult
 from dotenv import load_dotenv
 from opencc import OpenCC
 
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import version
+import asyncio
+import functools
+import glob
+import hashlib
 import json
 from pathlib import Path
+from typing import Optional, TextIO
 import os
 import logging
+import shutil
+import threading
+import time
+import uuid
+
+from . import instrumentation
+from .layout_cache import JSON_NAME, MARKDOWN_NAME, CacheEntry, LayoutCache, get_cache, materialize
+from .layout_store import build_layout_store, is_fresh, replace_tree, store_path
+from .sharding import DEFAULT_SHARD_PAGES, Shard, merge_layouts, page_range, split_pdf
+from .text_layer import extract_layout, text_layer_runs
 
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-# DocumentIntelligenceClient の作成
-client = DocumentIntelligenceClient(
-    endpoint=os.environ["AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"],
-    credential=AzureKeyCredential(os.environ["AZURE_DOCUMENT_INTELLIGENCE_API_KEY"])
-)
+# PyMuPDF は複数スレッドから同時に使えないので、PyMuPDF を使う処理はこのロックを持って行う
+# （ここでのテキストレイヤーの解析・シャードへの分割のほか、server.py・pipeline.py のマークアップも同じロックを使う）
+fitz_lock = threading.Lock()
 
-# OpenCCのセットアップ
-cc_s2t = OpenCC('s2t')    # 簡体字 → 繁体字
-cc_t2jp = OpenCC('t2jp')  # 繁体字 → 日本語の漢字
+@functools.cache
+def get_client() -> DocumentIntelligenceClient:
+    # DocumentIntelligenceClient の作成（初回利用時。import 時には環境変数を要求しない）
+    return DocumentIntelligenceClient(
+        endpoint=os.environ["AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"],
+        credential=AzureKeyCredential(os.environ["AZURE_DOCUMENT_INTELLIGENCE_API_KEY"])
+    )
 
-def cc(text: str) -> str:
+MODEL_ID = "prebuilt-layout"
+OUTPUT_FORMAT = "markdown"
+# 変換内容を変えたら上げる（キャッシュキーに含まれる）
+CONVERTER_VERSION = f"opencc-{version('opencc')}/s2t+t2jp/2"
+
+@functools.cache
+def get_converters() -> tuple[OpenCC, OpenCC]:
+    # OpenCCのセットアップ（辞書の読み込みが重いので初回利用時）
+    cc_s2t = OpenCC('s2t')    # 簡体字 → 繁体字
+    cc_t2jp = OpenCC('t2jp')  # 繁体字 → 日本語の漢字
+    return cc_s2t, cc_t2jp
+
+def _convert(text: str) -> str:
+    cc_s2t, cc_t2jp = get_converters()
     # 1. 簡体字 → 繁体字
     converted = cc_s2t.convert(text)
     # 2. 繁体字 → 日本語漢字
     converted = cc_t2jp.convert(converted)
     return converted
 
-def analyze_local_pdf(image_path: Path, output_dir: Path = Path("./data/document_intelligence"), dryrun: bool = False) -> tuple[Path, Path]:
-    logger.info(f"calling prebuilt-layout API: {image_path}")
+# 単語・行など短い文字列は同じものが繰り返し出てくるので、変換結果を覚えておく
+_MEMO_MAX_LENGTH = 64
+_convert_memo = functools.lru_cache(maxsize=1 << 16)(_convert)
 
-    # path
-    output_markdown_path = output_dir / "markdown" / f"{image_path.stem}.md"
-    output_json_path = output_dir / "json" / f"{image_path.stem}.json"
-    if output_markdown_path.exists() and output_json_path.exists():
-        logger.info(f"analyzed result already exists, skipping: {output_markdown_path}")
-        return output_markdown_path, output_json_path
-
-    output_markdown_path.parent.mkdir(parents=True, exist_ok=True)
-    output_json_path.parent.mkdir(parents=True, exist_ok=True)
-
-    if dryrun:
-        logger.info(f"will be saved in {output_markdown_path}")
-        return output_markdown_path, output_json_path
-    
-    # 分析実行：output_content_format を Markdown に指定
-    with open(image_path, "rb") as f:
-        poller = client.begin_analyze_document(
-            "prebuilt-layout",  # レイアウト解析モデル
-            f,
-            output_content_format="markdown"
-        )
-    
-    # 長時間実行される場合は poller.result() で待機
-    result = poller.result()
-
-    # Markdown 形式の文字列（人が読めるフォーマット）が result.content に入っています
-    markdown_output = result.content
-    with output_markdown_path.open("w", encoding="utf-8") as mf:
-        mf.write(cc(markdown_output))
-    
-    # 解析結果の全体データを辞書形式に変換して JSON ファイルとして保存
-    with output_json_path.open("w", encoding="utf-8") as jf:
-        text = json.dumps(result.as_dict(), ensure_ascii=False)
-        jf.write(cc(text))  # 中国語漢字変換
-    
+def cc(text: str) -> str:
+    if len(text) <= _MEMO_MAX_LENGTH:
+        return _convert_memo(text)
+    return _convert(text)
+
+# 変換するのはこのキーの文字列だけ（ポリゴン・span・ID などはそのまま）
+# 行・単語・段落・表のセル・キャプションなどのテキストはすべて "content"
+TEXT_KEYS = frozenset({"content"})
+
+def convert_text_fields(value):
+    if isinstance(value, dict):
+        return {
+            k: cc(v) if k in TEXT_KEYS and isinstance(v, str) else convert_text_fields(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [convert_text_fields(v) for v in value]
+    return value
+
+def _as_data(value):
+    return value.as_dict() if hasattr(value, "as_dict") else value
+
+def write_converted_json(result: AnalyzeResult, f: TextIO, content: Optional[str] = None):
+    """
+    result を JSON で f に書く。ページ・段落などの配列は 1 要素ずつ変換して書き出すので、
+    result.as_dict() 全体や、JSON 全体の文字列のコピーは作らない。
+    content に変換済みの result.content を渡せば、それを使う。
+    """
+    f.write("{")
+    for i, key in enumerate(result.keys()):
+        if i:
+            f.write(", ")
+        f.write(f"{json.dumps(key)}: ")
+        value = result[key]
+        if key == "content" and content is not None:
+            json.dump(content, f, ensure_ascii=False)
+        elif isinstance(value, list):
+            f.write("[")
+            for j, item in enumerate(value):
+                if j:
+                    f.write(", ")
+                json.dump(convert_text_fields(_as_data(item)), f, ensure_ascii=False)
+            f.write("]")
+        else:
+            json.dump(convert_text_fields(_as_data(value)), f, ensure_ascii=False)
+    f.write("}")
+
+class AdaptiveBackoff:
+    """
+    429 (Too Many Requests) に合わせて送信間隔を調整する。
+    全ワーカーで共有し、スロットリングされたら間隔を倍に、成功したら半分にする。
+    """
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0, max_retries: int = 8):
+        self.initial = initial
+        self.maximum = maximum
+        self.max_retries = max_retries
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> float:
+        with self._lock:
+            self.delay = min(self.maximum, max(self.initial, self.delay * 2, retry_after or 0.0))
+            return self.delay
+
+    def on_success(self):
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > self.initial else 0.0
+
+
+def _retry_after(e: HttpResponseError) -> Optional[float]:
+    if e.response is None:
+        return None
+    try:
+        return float(e.response.headers.get("Retry-After"))  # type: ignore
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_throttled(e: HttpResponseError) -> bool:
+    return e.status_code == 429
+
+
+def _begin_analyze(client, image_path: Path, backoff: AdaptiveBackoff):
+    for attempt in range(backoff.max_retries + 1):
+        if backoff.delay:
+            time.sleep(backoff.delay)
+        try:
+            # 分析実行：output_content_format を Markdown に指定
+            with open(image_path, "rb") as f:
+                poller = client.begin_analyze_document(
+                    MODEL_ID,  # レイアウト解析モデル
+                    f,
+                    output_content_format=OUTPUT_FORMAT
+                )
+        except HttpResponseError as e:
+            if not _is_throttled(e) or attempt == backoff.max_retries:
+                raise
+            delay = backoff.on_throttled(_retry_after(e))
+            logger.warning(f"throttled (429), retrying in {delay:.1f}s: {image_path}")
+            continue
+        backoff.on_success()
+        return poller
+    raise AssertionError("unreachable")
+
+
+async def _begin_analyze_async(client, image_path: Path, backoff: AdaptiveBackoff):
+    for attempt in range(backoff.max_retries + 1):
+        if backoff.delay:
+            await asyncio.sleep(backoff.delay)
+        try:
+            with open(image_path, "rb") as f:
+                poller = await client.begin_analyze_document(
+                    MODEL_ID,
+                    f,
+                    output_content_format=OUTPUT_FORMAT
+                )
+        except HttpResponseError as e:
+            if not _is_throttled(e) or attempt == backoff.max_retries:
+                raise
+            delay = backoff.on_throttled(_retry_after(e))
+            logger.warning(f"throttled (429), retrying in {delay:.1f}s: {image_path}")
+            continue
+        backoff.on_success()
+        return poller
+    raise AssertionError("unreachable")
+
+
+@instrumentation.timed("analyze.save")
+def _save_result(cache: LayoutCache, key: str, image_path: Path, result: AnalyzeResult) -> CacheEntry:
+    with cache.writer(key, source=str(image_path), model_id=MODEL_ID, converter_version=CONVERTER_VERSION) as staging:
+        # Markdown 形式の文字列（人が読めるフォーマット）が result.content に入っています
+        markdown_output = cc(result.content or "")  # 中国語漢字変換
+        with (staging / MARKDOWN_NAME).open("w", encoding="utf-8") as mf:
+            mf.write(markdown_output)
+
+        # 解析結果の全体データを JSON ファイルとして保存（テキストのフィールドだけ変換し、ページごとに書き出す）
+        with (staging / JSON_NAME).open("w", encoding="utf-8") as jf:
+            write_converted_json(result, jf, content=markdown_output)
+        build_layout_store(staging / JSON_NAME)
+    return cache.entry(key)
+
+
+def _output_paths(image_path: Path, output_dir: Path) -> tuple[Path, Path]:
+    # 同じ名前で別のフォルダの PDF が同じファイルに書かないように、絶対パスのハッシュを付ける
+    name = f"{image_path.stem}.{hashlib.sha1(str(image_path.resolve()).encode('utf-8')).hexdigest()[:10]}"
+    output_markdown_path = output_dir / "markdown" / f"{name}.md"
+    output_json_path = output_dir / "json" / f"{name}.json"
+    return output_markdown_path, output_json_path
+
+
+@instrumentation.timed("analyze.materialize")
+def _materialize(cache: LayoutCache, entry: CacheEntry, image_path: Path, output_dir: Path) -> tuple[Path, Path]:
+    # キャッシュから `markdown/`, `json/` に配置する（同名の別PDFでも常に今のPDFの結果になる）
+    output_markdown_path, output_json_path = _output_paths(image_path, output_dir)
+    materialize(entry.markdown_path, output_markdown_path)
+    materialize(entry.json_path, output_json_path)
+    entry_store = store_path(entry.json_path)
+    if entry_store.exists() and not is_fresh(output_json_path):
+        staging = output_json_path.with_name(f".{output_json_path.stem}.{uuid.uuid4().hex}")
+        shutil.copytree(entry_store, staging)
+        replace_tree(staging, store_path(output_json_path))
+    logger.info(f"layout cache: {cache.stats}")
+    return output_markdown_path, output_json_path
+
+
+def _load_layouts(shards: list[Shard], entries: list[CacheEntry]) -> list[tuple[Shard, dict]]:
+    return [(shard, json.loads(entry.json_path.read_text(encoding="utf-8"))) for shard, entry in zip(shards, entries)]
+
+
+def _write_merged(parts: list[tuple[Shard, dict]], image_path: Path, output_dir: Path) -> tuple[Path, Path]:
+    """シャードの解析結果をページ順にまとめて `markdown/`, `json/` に書く"""
+    merged = merge_layouts(sorted(parts, key=lambda part: part[0].first_page))
+    output_markdown_path, output_json_path = _output_paths(image_path, output_dir)
+    for path, text in ((output_markdown_path, merged["content"]), (output_json_path, json.dumps(merged, ensure_ascii=False))):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+    build_layout_store(output_json_path)
+    logger.info(f"merged {len(parts)} shards: {image_path}")
     return output_markdown_path, output_json_path
 
+
+def _legacy_paths(image_path: Path, output_dir: Path) -> tuple[Path, Path]:
+    # パスのハッシュを付ける前の名前
+    return output_dir / "markdown" / f"{image_path.stem}.md", output_dir / "json" / f"{image_path.stem}.json"
+
+
+def _adopt_legacy(cache: LayoutCache, key: str, image_path: Path, output_dir: Path) -> Optional[CacheEntry]:
+    """
+    前の名前の解析結果があれば、キャッシュに入れて返す。どの PDF の結果かは名前でしか分からないので、
+    - 同名の別の PDF（別のフォルダ）の結果がすでに output_dir にあれば使わない
+    - 使うのは最初に使った PDF の中身（キャッシュのキー）にだけ。改訂した PDF は解析し直す
+    """
+    legacy_markdown_path, legacy_json_path = _legacy_paths(image_path, output_dir)
+    if not (legacy_markdown_path.exists() and legacy_json_path.exists()):
+        return None
+    own_markdown_path, _ = _output_paths(image_path, output_dir)
+    if any(p != own_markdown_path for p in legacy_markdown_path.parent.glob(f"{glob.escape(image_path.stem)}.*.md")):
+        logger.info(f"not using {legacy_json_path}: another PDF with the same name was analyzed")
+        return None
+    claim = cache.root / "legacy" / hashlib.sha1(str(legacy_json_path.resolve()).encode("utf-8")).hexdigest()
+    if claim.exists() and claim.read_text(encoding="utf-8") != key:
+        logger.info(f"not using {legacy_json_path}: it was used for another version of the PDF")
+        return None
+    with cache.writer(key, source=str(image_path), model_id=MODEL_ID, converter_version=CONVERTER_VERSION,
+                      legacy=str(legacy_json_path)) as staging:
+        shutil.copyfile(legacy_markdown_path, staging / MARKDOWN_NAME)
+        shutil.copyfile(legacy_json_path, staging / JSON_NAME)
+        build_layout_store(staging / JSON_NAME)
+    claim.parent.mkdir(parents=True, exist_ok=True)
+    claim.write_text(key, encoding="utf-8")
+    logger.info(f"using the analyzed result saved under the old name: {legacy_json_path}")
+    return cache.entry(key)
+
+
+def _cached_entry(
+        cache: LayoutCache,
+        image_path: Path,
+        output_dir: Optional[Path] = None,
+    ) -> tuple[str, Optional[CacheEntry]]:
+    """
+    （キャッシュのキー, キャッシュにある解析結果（なければ None））。
+    output_dir を渡すと、キャッシュになければ前の名前の解析結果を探す（PDF 全体のときだけ。シャードには渡さない）。
+    """
+    key = cache.key(image_path, MODEL_ID, OUTPUT_FORMAT, CONVERTER_VERSION)
+    entry = cache.get(key)
+    instrumentation.count("layout_cache_misses" if entry is None else "layout_cache_hits")
+    if entry is not None:
+        logger.info(f"analyzed result found in cache, skipping: {image_path} ({key[:12]})")
+    elif output_dir is not None:
+        entry = _adopt_legacy(cache, key, image_path, output_dir)
+    return key, entry
+
+
+def _analyze_entry(
+        cache: LayoutCache,
+        image_path: Path,
+        client: Optional[DocumentIntelligenceClient],
+        backoff: AdaptiveBackoff,
+        output_dir: Optional[Path] = None,
+    ) -> CacheEntry:
+    key, entry = _cached_entry(cache, image_path, output_dir)
+    if entry is not None:
+        return entry
+    poller = _begin_analyze(client or get_client(), image_path, backoff)
+    # 長時間実行される場合は poller.result() で待機
+    with instrumentation.stage("analyze.poll"):
+        result = poller.result()
+    return _save_result(cache, key, image_path, result)
+
+
+def _split_by_text_layer(
+        image_path: Path,
+        runs: list[tuple[bool, int, int]],
+        shard_dir: Path,
+        shard_pages: int,
+        pages: Optional[tuple[int, int]],
+    ) -> tuple[list[tuple[Shard, dict]], list[Shard]]:
+    """
+    テキストレイヤーのあるページはここで解析し、（その結果, Document Intelligence に送るシャード）を返す。
+    runs は text_layer_runs の結果。
+    """
+    first, last = page_range(runs[-1][2], pages)
+    local, scanned = [], []
+    for is_local, start, end in runs:
+        start, end = max(start, first), min(end, last)
+        if start > end:
+            continue
+        if is_local:
+            local.append((Shard(start, end - start + 1, image_path), extract_layout(image_path, (start, end))))
+        else:
+            scanned += split_pdf(image_path, shard_dir, shard_pages, (start, end))
+    instrumentation.count("text_layer_pages", sum(shard.page_count for shard, _ in local))
+    logger.info(f"text layer: {len(local)} local runs, {len(scanned)} shards to analyze: {image_path}")
+    return local, scanned
+
+
+def _has_local_pages(runs: list[tuple[bool, int, int]]) -> bool:
+    return any(is_local for is_local, _, _ in runs)
+
+
+def _split(
+        image_path: Path,
+        shard_dir: Path,
+        shard_pages: Optional[int],
+        pages: Optional[tuple[int, int]],
+        use_text_layer: bool,
+    ) -> Optional[tuple[list[tuple[Shard, dict]], list[Shard]]]:
+    """
+    PDF を解析する単位に分けて、（手元で解析した結果, Document Intelligence に送るシャード）を返す。
+    テキストレイヤーを使わず、シャードにも分けないときは None（PDF をそのまま送る）。
+    テキストレイヤーの解析・分割はどちらも PyMuPDF を使うので、fitz_lock を持って行う。
+    """
+    with fitz_lock:
+        runs = text_layer_runs(image_path) if use_text_layer else []
+        if _has_local_pages(runs):
+            return _split_by_text_layer(image_path, runs, shard_dir, shard_pages or DEFAULT_SHARD_PAGES, pages)
+        if shard_pages or pages:
+            return [], split_pdf(image_path, shard_dir, shard_pages or DEFAULT_SHARD_PAGES, pages)
+    return None
+
+
+@instrumentation.timed("analyze")
+def analyze_local_pdf(
+        image_path: Path,
+        output_dir: Path = Path("./data/document_intelligence"),
+        dryrun: bool = False,
+        cache: Optional[LayoutCache] = None,
+        client: Optional[DocumentIntelligenceClient] = None,
+        backoff: Optional[AdaptiveBackoff] = None,
+        shard_pages: Optional[int] = None,
+        pages: Optional[tuple[int, int]] = None,
+        max_shard_concurrency: int = 4,
+        use_text_layer: bool = False,
+    ) -> tuple[Path, Path]:
+    """
+    shard_pages（ページ数）か pages（1 始まり・両端を含むページ範囲）を指定すると、
+    PDF をシャードに分けて最大 max_shard_concurrency 件ずつ並行に解析する。
+    use_text_layer=True なら、テキストレイヤーのあるページは API を呼ばずに PyMuPDF で解析する
+    （中国語漢字の変換はしない。表は取り出さない）。
+    dryrun=True なら分けずに、PDF 全体の解析結果がキャッシュにあればそれを置き、なければ出力先のパスだけを返す。
+    """
+    logger.info(f"calling prebuilt-layout API: {image_path}")
+
+    if cache is None:
+        cache = get_cache(output_dir / "cache")
+    backoff = backoff or AdaptiveBackoff()
+    shard_dir = output_dir / "shards" / uuid.uuid4().hex
+    try:
+        split = None if dryrun else _split(image_path, shard_dir, shard_pages, pages, use_text_layer)
+        if split is None:
+            if dryrun:
+                _, entry = _cached_entry(cache, image_path, output_dir)
+            else:
+                entry = _analyze_entry(cache, image_path, client, backoff, output_dir)
+            if entry is None:
+                output_markdown_path, output_json_path = _output_paths(image_path, output_dir)
+                logger.info(f"will be saved in {output_markdown_path}")
+                return output_markdown_path, output_json_path
+            return _materialize(cache, entry, image_path, output_dir)
+
+        local, shards = split
+        entries = []
+        if shards:
+            client = client or get_client()
+            with ThreadPoolExecutor(max_workers=max_shard_concurrency) as executor:
+                entries = list(executor.map(lambda shard: _analyze_entry(cache, shard.path, client, backoff), shards))
+        return _write_merged(local + _load_layouts(shards, entries), image_path, output_dir)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def analyze_many(
+        image_paths: list[Path],
+        max_concurrency: int = 4,
+        output_dir: Path = Path("./data/document_intelligence"),
+        cache: Optional[LayoutCache] = None,
+        client: Optional[DocumentIntelligenceClient] = None,
+        backoff: Optional[AdaptiveBackoff] = None,
+        shard_pages: Optional[int] = None,
+        use_text_layer: bool = False,
+    ) -> list[tuple[Path, Path]]:
+    """
+    複数のPDFを最大 max_concurrency 件ずつ並行に解析する。結果は入力順。
+    """
+    backoff = backoff or AdaptiveBackoff()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(
+            lambda path: analyze_local_pdf(
+                path, output_dir, cache=cache, client=client, backoff=backoff, shard_pages=shard_pages,
+                use_text_layer=use_text_layer,
+            ),
+            image_paths
+        ))
+
+
+@instrumentation.timed("analyze")
+async def analyze_many_async(
+        image_paths: list[Path],
+        max_concurrency: int = 4,
+        output_dir: Path = Path("./data/document_intelligence"),
+        cache: Optional[LayoutCache] = None,
+        client: Optional[AsyncDocumentIntelligenceClient] = None,
+        backoff: Optional[AdaptiveBackoff] = None,
+        return_exceptions: bool = False,
+        shard_pages: Optional[int] = None,
+        pages: Optional[tuple[int, int]] = None,
+        use_text_layer: bool = False,
+    ) -> list[tuple[Path, Path]]:
+    """
+    analyze_many の asyncio 版。client は `azure.ai.documentintelligence.aio` のクライアント。
+    return_exceptions=True なら、失敗したPDFの位置には例外を入れて返す（asyncio.gather と同じ）。
+    shard_pages / pages を指定すると各PDFをシャードに分け、シャードも max_concurrency 件ずつ並行に解析する。
+    use_text_layer は analyze_local_pdf と同じ。
+    """
+    if cache is None:
+        cache = get_cache(output_dir / "cache")
+    owns_client = client is None
+    clients: list[AsyncDocumentIntelligenceClient] = [client] if client is not None else []
+
+    def get_async_client() -> AsyncDocumentIntelligenceClient:
+        # API を呼ぶときに作る（すべてのページを手元で解析できれば環境変数はいらない）
+        if not clients:
+            clients.append(AsyncDocumentIntelligenceClient(
+                endpoint=os.environ["AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"],
+                credential=AzureKeyCredential(os.environ["AZURE_DOCUMENT_INTELLIGENCE_API_KEY"])
+            ))
+        return clients[0]
+
+    backoff = backoff or AdaptiveBackoff()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def analyze_entry(image_path: Path, legacy_dir: Optional[Path] = None) -> CacheEntry:
+        async with semaphore:
+            logger.info(f"calling prebuilt-layout API: {image_path}")
+            key, entry = await asyncio.to_thread(_cached_entry, cache, image_path, legacy_dir)
+            if entry is not None:
+                return entry
+            poller = await _begin_analyze_async(get_async_client(), image_path, backoff)
+            with instrumentation.stage("analyze.poll"):
+                result = await poller.result()
+            return await asyncio.to_thread(_save_result, cache, key, image_path, result)
+
+    async def analyze(image_path: Path) -> tuple[Path, Path]:
+        # 分け方・キャッシュ・まとめ方は analyze_local_pdf と同じ（API の呼び出しだけ asyncio）
+        shard_dir = output_dir / "shards" / uuid.uuid4().hex
+        try:
+            split = await asyncio.to_thread(_split, image_path, shard_dir, shard_pages, pages, use_text_layer)
+            if split is None:
+                entry = await analyze_entry(image_path, output_dir)
+                return await asyncio.to_thread(_materialize, cache, entry, image_path, output_dir)
+            local, shards = split
+            entries = await asyncio.gather(*(analyze_entry(shard.path) for shard in shards))
+            parts = local + await asyncio.to_thread(_load_layouts, shards, list(entries))
+            return await asyncio.to_thread(_write_merged, parts, image_path, output_dir)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+    try:
+        return await asyncio.gather(*(analyze(path) for path in image_paths), return_exceptions=return_exceptions)  # type: ignore
+    finally:
+        if owns_client and clients:
+            await clients[0].close()
+
 if __name__ == "__main__":
     import sys
     analyze_local_pdf(Path(sys.argv[1]), dryrun=False)
\ No newline at end of file
@@ -0,0 +1,192 @@
+'''
+セル（入力セル・計算セル）の列指向の表
+
+数万〜数十万セルのシートでは、セルごとに pydantic のモデルを検証して作るコストとオブジェクトのメモリが効いてくるので、
+読み込み（load_xlsx.extract_tables）はこの表に直接書く。
+- シート・行・列・metadata は 1 つの構造化配列（CELL_DTYPE）。シート名と metadata は intern した番号
+- 入力セルの値は float64 の列と、int だったかの列。計算セルの数式は文字列のリスト
+- 表は ExcelCellInputData / ExcelCellFormulaData の Sequence としても読める（要素は読むたびに作るモデル）。
+  extract_data の ExcelSheetData は list ではなくこの表をそのまま持つので、何度も回すところでは一度 list にする
+'''
+import numpy as np
+from openpyxl.utils.cell import get_column_letter
+
+from abc import abstractmethod
+from array import array
+from typing import Generic, Hashable, Iterator, Sequence, TypeVar
+
+from .models import ExcelCellFormulaData, ExcelCellInputData
+
+
+CELL_DTYPE = np.dtype([("sheet", "<i4"), ("row", "<i4"), ("column", "<i4"), ("metadata", "<i4")])
+
+K = TypeVar("K", bound=Hashable)
+M = TypeVar("M", ExcelCellInputData, ExcelCellFormulaData)
+
+
+class Interner(Generic[K]):
+    """値 → 番号。同じ値は同じ番号（とオブジェクト）になる"""
+    def __init__(self):
+        self.values: list[K] = []
+        self._ids: dict[K, int] = {}
+
+    def __call__(self, value: K) -> int:
+        i = self._ids.get(value)
+        if i is None:
+            i = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class _CellTable(Sequence[M]):
+    def __init__(self, cells: np.ndarray, sheets: list[str], metadata: list[tuple[str, ...]]):
+        assert cells.dtype == CELL_DTYPE
+        self.cells = cells
+        self.sheets = sheets
+        self.metadata = metadata
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def __getitem__(self, i):  # type: ignore
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._model(i)
+
+    def __eq__(self, other) -> bool:
+        # list と同じく要素ごとに比べる（list とも比べられる）
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore
+
+    @abstractmethod
+    def _model(self, i: int) -> M:
+        ...
+
+    def _fields(self, i: int) -> dict:
+        row = self.cells[i]
+        return self._make_fields(int(row["sheet"]), int(row["row"]), int(row["column"]), int(row["metadata"]))
+
+    def _make_fields(self, sheet: int, row: int, column: int, metadata: int) -> dict:
+        return {
+            "sheet": self.sheets[sheet],
+            "cell": f"{get_column_letter(column)}{row}",
+            "metadata": list(self.metadata[metadata]),
+        }
+
+    def _iter_fields(self) -> Iterator[dict]:
+        # 要素ごとに numpy の配列を引くと遅いので、列ごとに list にしてから回す
+        columns = (self.cells[name].tolist() for name in CELL_DTYPE.names)  # type: ignore
+        for sheet, row, column, metadata in zip(*columns):
+            yield self._make_fields(sheet, row, column, metadata)
+
+    def coordinate(self, i: int) -> str:
+        return self._fields(i)["cell"]
+
+    @property
+    def nbytes(self) -> int:
+        """配列の分のバイト数（intern した文字列は含まない）"""
+        return self.cells.nbytes
+
+
+class InputTable(_CellTable[ExcelCellInputData]):
+    def __init__(
+            self,
+            cells: np.ndarray,
+            sheets: list[str],
+            metadata: list[tuple[str, ...]],
+            values: np.ndarray,
+            is_int: np.ndarray,
+        ):
+        super().__init__(cells, sheets, metadata)
+        assert len(values) == len(is_int) == len(cells)
+        self.values = values
+        self.is_int = is_int
+
+    def value(self, i: int) -> int | float:
+        return int(self.values[i]) if self.is_int[i] else float(self.values[i])
+
+    def _model(self, i: int) -> ExcelCellInputData:
+        return ExcelCellInputData(**self._fields(i), value=self.value(i))
+
+    def __iter__(self) -> Iterator[ExcelCellInputData]:
+        for fields, value, is_int in zip(self._iter_fields(), self.values.tolist(), self.is_int.tolist()):
+            yield ExcelCellInputData(**fields, value=int(value) if is_int else value)
+
+    @property
+    def nbytes(self) -> int:
+        return super().nbytes + self.values.nbytes + self.is_int.nbytes
+
+
+class FormulaTable(_CellTable[ExcelCellFormulaData]):
+    def __init__(self, cells: np.ndarray, sheets: list[str], metadata: list[tuple[str, ...]], formulas: list[str]):
+        super().__init__(cells, sheets, metadata)
+        assert len(formulas) == len(cells)
+        self.formulas = formulas
+
+    def _model(self, i: int) -> ExcelCellFormulaData:
+        return ExcelCellFormulaData(**self._fields(i), value=self.formulas[i])
+
+    def __iter__(self) -> Iterator[ExcelCellFormulaData]:
+        for fields, formula in zip(self._iter_fields(), self.formulas):
+            yield ExcelCellFormulaData(**fields, value=formula)
+
+
+class _Columns:
+    def __init__(self):
+        self.sheet = array("i")
+        self.row = array("i")
+        self.column = array("i")
+        self.metadata = array("i")
+
+    def add(self, sheet: int, row: int, column: int, metadata: int):
+        self.sheet.append(sheet)
+        self.row.append(row)
+        self.column.append(column)
+        self.metadata.append(metadata)
+
+    def to_array(self) -> np.ndarray:
+        cells = np.empty(len(self.sheet), dtype=CELL_DTYPE)
+        for name in CELL_DTYPE.names:  # type: ignore
+            cells[name] = np.array(getattr(self, name), dtype=np.int32)
+        return cells
+
+
+class CellTableBuilder:
+    """セルを 1 つずつ足して InputTable / FormulaTable を作る（シート名と metadata は 2 つの表で共有）"""
+    def __init__(self):
+        self.sheets: Interner[str] = Interner()
+        self.metadata: Interner[tuple[str, ...]] = Interner()
+        self._inputs = _Columns()
+        self._values = array("d")
+        self._is_int = array("b")
+        self._formulas = _Columns()
+        self._formula_texts: list[str] = []
+
+    def add_input(self, sheet: str, row: int, column: int, value: int | float, metadata: tuple[str, ...]):
+        self._inputs.add(self.sheets(sheet), row, column, self.metadata(metadata))
+        self._values.append(value)
+        self._is_int.append(isinstance(value, int))
+
+    def add_formula(self, sheet: str, row: int, column: int, formula: str, metadata: tuple[str, ...]):
+        self._formulas.add(self.sheets(sheet), row, column, self.metadata(metadata))
+        self._formula_texts.append(formula)
+
+    def build(self) -> tuple[InputTable, FormulaTable]:
+        sheets, metadata = self.sheets.values, self.metadata.values
+        inputs = InputTable(
+            self._inputs.to_array(), sheets, metadata,
+            np.array(self._values, dtype=np.float64),
+            np.array(self._is_int, dtype=bool),
+        )
+        formulas = FormulaTable(self._formulas.to_array(), sheets, metadata, self._formula_texts)
+        return inputs, formulas
@@ -0,0 +1,233 @@
+'''
+ブック・シート・出典PDFの組（ジョブ）をまとめて処理するバッチ CLI
+
+    python -m excel_sheet_matching_agent.cli jobs.csv --output-dir data/batch
+
+ジョブ一覧は CSV（列: name, excel_path, excel_pdf_path, sheet_name, source_pdfs。source_pdfs は ";" 区切り）
+または同じキーを持つオブジェクトの配列の JSON。name は省略可（`{ブック名}_{シート名}`）。
+
+- CPU を使う Excel の読み込みとマークアップは、コア数分のプロセスプールで並列に実行する
+  （計測中なら、子プロセスでの計測も結果と一緒に受け取って合わせる）
+- I/O 待ちの prebuilt-layout 解析と LLM 照合は、1 つのイベントループで並行に実行する
+- 失敗したジョブは記録して次へ進み、最後に `{output_dir}/summary.json` に結果をまとめる
+- --report / --metrics を付けると、段階ごとの計測結果を JSON / Prometheus のテキスト形式で書く
+'''
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Literal, Optional
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+
+from . import instrumentation
+from .analyze_local_pdf import analyze_many_async
+from .layout_cache import LayoutCache
+from .load_xlsx import extract_data
+from .manifest import amatch_incremental
+from .markup import markup
+from .models import ExcelSheetData, MatchingResult
+from .verdict_cache import VerdictCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job(BaseModel):
+    name: str = ""
+    excel_path: Path
+    excel_pdf_path: Path
+    sheet_name: str
+    source_pdfs: list[Path]
+
+    def model_post_init(self, __context):
+        if not self.name:
+            self.name = f"{self.excel_path.stem}_{self.sheet_name}"
+
+
+class JobResult(BaseModel):
+    name: str
+    status: Literal["ok", "failed"]
+    error: Optional[str] = None
+    stage: Optional[str] = None
+    inputs: int = 0
+    matched: int = 0
+    elapsed: float = 0.0
+
+
+def load_jobs(path: Path) -> list[Job]:
+    if path.suffix.lower() == ".json":
+        jobs = [Job.model_validate(item) for item in json.loads(path.read_text(encoding="utf-8"))]
+    else:
+        with path.open(newline="", encoding="utf-8") as f:
+            jobs = [
+                Job.model_validate({**row, "source_pdfs": [p.strip() for p in row["source_pdfs"].split(";") if p.strip()]})
+                for row in csv.DictReader(f)
+            ]
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"job names must be unique: {path}")
+    return jobs
+
+
+def _extract(job: Job) -> ExcelSheetData:
+    return extract_data(job.excel_path, job.sheet_name)
+
+
+def _markup(job: Job, data: ExcelSheetData, results: list[MatchingResult], json_paths: list[Path], output_dir: Path):
+    # ジョブ単位ですでにプロセスを分けているので、ジョブの中では順に実行する
+    markup(job.excel_path, job.excel_pdf_path, data.input, results, job.source_pdfs, json_paths,
+           output_dir=output_dir, max_workers=1)
+
+
+async def _run_in_executor(executor: Executor, fn, *args):
+    """executor で fn を実行する。プロセスプールなら、子での計測をこのプロセスの計測に合わせる"""
+    record = instrumentation.get_recorder() is not None and isinstance(executor, ProcessPoolExecutor)
+    result, recorded = await asyncio.get_running_loop().run_in_executor(
+        executor, instrumentation.run_recorded, record, fn, *args
+    )
+    instrumentation.merge(recorded)
+    return result
+
+
+async def run_batch(
+        jobs: list[Job],
+        llm,
+        output_dir: Path,
+        executor: Optional[Executor] = None,
+        max_analysis_concurrency: int = 4,
+        max_llm_jobs: int = 4,
+        shard_pages: Optional[int] = None,
+        use_text_layer: bool = False,
+        analysis_output_dir: Path = Path("./data/document_intelligence"),
+        layout_cache: Optional[LayoutCache] = None,
+        client=None,
+        verdict_cache: Optional[VerdictCache] = None,
+        **match_kwargs,
+    ) -> list[JobResult]:
+    """
+    全ジョブを処理して、ジョブの順に結果を返す。1 つのジョブの失敗は他のジョブに影響しない。
+    """
+    owns_executor = executor is None
+    executor = executor or ProcessPoolExecutor(max_workers=os.cpu_count())
+    started = time.perf_counter()
+    try:
+        # Excel の読み込みは解析と並行してプロセスプールで始める
+        extractions = [asyncio.ensure_future(_run_in_executor(executor, _extract, job)) for job in jobs]
+
+        # 出典PDFはジョブをまたいで 1 回だけ解析する
+        source_pdfs = list(dict.fromkeys(pdf for job in jobs for pdf in job.source_pdfs))
+        analyzed = await analyze_many_async(
+            source_pdfs, max_analysis_concurrency, analysis_output_dir,
+            cache=layout_cache, client=client, return_exceptions=True, shard_pages=shard_pages,
+            use_text_layer=use_text_layer,
+        )
+        analyses = dict(zip(source_pdfs, analyzed))
+        llm_semaphore = asyncio.Semaphore(max_llm_jobs)
+
+        async def run(job: Job, extraction: asyncio.Future) -> JobResult:
+            stage = "extract"
+            try:
+                with instrumentation.stage("batch.extract"):
+                    data: ExcelSheetData = await extraction
+                stage = "analyze"
+                for pdf in job.source_pdfs:
+                    if isinstance(analyses[pdf], BaseException):
+                        raise analyses[pdf]  # type: ignore
+                markdown_paths = [analyses[pdf][0] for pdf in job.source_pdfs]  # type: ignore
+                json_paths = [analyses[pdf][1] for pdf in job.source_pdfs]  # type: ignore
+
+                stage = "match"
+                job_dir = output_dir / job.name
+                async with llm_semaphore:
+                    results = await amatch_incremental(
+                        llm, data.input, markdown_paths, job_dir / "manifest.json", json_paths,
+                        verdict_cache=verdict_cache, **match_kwargs,
+                    )
+
+                stage = "markup"
+                with instrumentation.stage("batch.markup"):
+                    await _run_in_executor(executor, _markup, job, data, results, json_paths, job_dir)
+            except Exception as e:
+                logger.exception(f"job failed at {stage}: {job.name}")
+                return JobResult(
+                    name=job.name, status="failed", stage=stage, error=f"{type(e).__name__}: {e}",
+                    elapsed=time.perf_counter() - started,
+                )
+            return JobResult(
+                name=job.name, status="ok", inputs=len(data.input), matched=sum(r.match for r in results),
+                elapsed=time.perf_counter() - started,
+            )
+
+        return list(await asyncio.gather(*(run(job, extraction) for job, extraction in zip(jobs, extractions))))
+    finally:
+        if owns_executor:
+            executor.shutdown()
+
+
+def write_summary(path: Path, results: list[JobResult]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    summary = {
+        "jobs": len(results),
+        "ok": sum(r.status == "ok" for r in results),
+        "failed": sum(r.status == "failed" for r in results),
+        "results": [r.model_dump() for r in results],
+    }
+    path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m excel_sheet_matching_agent.cli")
+    parser.add_argument("jobs", type=Path, help="jobs manifest (.csv or .json)")
+    parser.add_argument("--output-dir", type=Path, default=Path("./data/batch"))
+    parser.add_argument("--model", default="google_genai:gemini-2.0-flash-lite", help="provider:model for init_chat_model")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes for extraction/markup")
+    parser.add_argument("--analysis-concurrency", type=int, default=4)
+    parser.add_argument("--llm-jobs", type=int, default=4, help="jobs matched concurrently")
+    parser.add_argument("--shard-pages", type=int, help="analyze source PDFs in shards of this many pages")
+    parser.add_argument("--use-text-layer", action="store_true", help="extract born-digital pages locally instead of calling the API")
+    parser.add_argument("--no-verdict-cache", action="store_true")
+    parser.add_argument("--report", type=Path, help="write a JSON run report (stage timings, tokens, cache hits)")
+    parser.add_argument("--metrics", type=Path, help="write the same metrics in Prometheus text format")
+    args = parser.parse_args(argv)
+
+    from langchain.chat_models import init_chat_model
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    jobs = load_jobs(args.jobs)
+    llm = init_chat_model(args.model, temperature=0)
+    verdict_cache = None if args.no_verdict_cache else VerdictCache()
+    recorder = instrumentation.enable() if args.report or args.metrics else None
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = asyncio.run(run_batch(
+            jobs, llm, args.output_dir, executor,
+            max_analysis_concurrency=args.analysis_concurrency,
+            max_llm_jobs=args.llm_jobs,
+            shard_pages=args.shard_pages,
+            use_text_layer=args.use_text_layer,
+            verdict_cache=verdict_cache,
+        ))
+    summary_path = args.output_dir / "summary.json"
+    write_summary(summary_path, results)
+    if recorder is not None:
+        if args.report:
+            recorder.write_report(args.report)
+        if args.metrics:
+            args.metrics.parent.mkdir(parents=True, exist_ok=True)
+            args.metrics.write_text(recorder.prometheus_text(), encoding="utf-8")
+    failed = [r for r in results if r.status == "failed"]
+    print(f"{len(results) - len(failed)}/{len(results)} jobs succeeded, summary: {summary_path}")
+    for r in failed:
+        print(f"  failed: {r.name} ({r.stage}) {r.error}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+'''
+オフラインでのテスト・ベンチマーク用のフェイク
+
+- FakeDocumentIntelligenceClient: `begin_analyze_document` だけを持つ DocumentIntelligenceClient の代わり
+- FakeAsyncDocumentIntelligenceClient: 上記の asyncio 版
+- FakeMatchingLLM: 照合プロンプトのセルごとに決まった判定を返す LLM の代わり
+'''
+from azure.ai.documentintelligence.models import AnalyzeResult
+from azure.core.exceptions import HttpResponseError
+from langchain_core.runnables import RunnableLambda
+
+from pathlib import Path
+from typing import IO, Callable, Optional
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+
+from .models import MatchingBatchResult, MatchingResult
+
+
+def default_result_factory(model_id: str, data: bytes) -> AnalyzeResult:
+    """PDFのハッシュだけを書いた最小の解析結果"""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    content = f"# {digest}\n"
+    return AnalyzeResult({
+        "apiVersion": "2024-11-30",
+        "modelId": model_id,
+        "stringIndexType": "textElements",
+        "content": content,
+        "contentFormat": "markdown",
+        "pages": [],
+    })
+
+
+class FakeDocumentIntelligenceClient:
+    """
+    latency 秒後に結果を返すフェイク。
+    throttle_first 回目までの呼び出しは 429 を返す。
+    layouts（PDFのファイル名の stem → 解析結果の json）を渡すと、result_factory の代わりにその json を返す。
+    calls は呼び出しの回数、analyzed は受け付けたPDFの stem（順に）。
+    """
+    def __init__(
+        self,
+        latency: float = 0.0,
+        throttle_first: int = 0,
+        result_factory: Callable[[str, bytes], AnalyzeResult] = default_result_factory,
+        layouts: Optional[dict[str, Path]] = None,
+    ):
+        self.latency = latency
+        self.throttle_first = throttle_first
+        self.result_factory = result_factory
+        self.layouts = layouts
+        self.calls = 0
+        self.analyzed: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _begin(self, model_id: str, body: IO[bytes]) -> Callable[[], AnalyzeResult]:
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.throttle_first:
+                e = HttpResponseError(message="Too Many Requests")
+                e.status_code = 429
+                raise e
+            stem = Path(getattr(body, "name", "")).stem
+            self.analyzed.append(stem)
+        if self.layouts is not None:
+            layout = self.layouts[stem]
+            return lambda: AnalyzeResult(json.loads(layout.read_text(encoding="utf-8")))
+        data = body.read()
+        return lambda: self.result_factory(model_id, data)
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def begin_analyze_document(self, model_id: str, body: IO[bytes], **kwargs) -> "_FakePoller":
+        return _FakePoller(self, self._begin(model_id, body))
+
+
+class _FakePoller:
+    def __init__(self, client: FakeDocumentIntelligenceClient, make_result: Callable[[], AnalyzeResult]):
+        self.client = client
+        self.make_result = make_result
+
+    def result(self) -> AnalyzeResult:
+        self.client._enter()
+        try:
+            time.sleep(self.client.latency)
+        finally:
+            self.client._exit()
+        return self.make_result()
+
+
+class FakeAsyncDocumentIntelligenceClient(FakeDocumentIntelligenceClient):
+    async def begin_analyze_document(self, model_id: str, body: IO[bytes], **kwargs) -> "_FakeAsyncPoller":  # type: ignore
+        return _FakeAsyncPoller(self, self._begin(model_id, body))
+
+    async def close(self):
+        pass
+
+
+class _FakeAsyncPoller(_FakePoller):
+    async def result(self) -> AnalyzeResult:  # type: ignore
+        self.client._enter()
+        try:
+            await asyncio.sleep(self.client.latency)
+        finally:
+            self.client._exit()
+        return self.make_result()
+
+
+_INPUT_RE = re.compile(r"- Cell: (\S+)\n\s*Value: (\S+)")
+_DOCUMENT_RE = re.compile(r"### Source Document\n```\n(.*?)\n```", re.DOTALL)
+
+
+def _value_text(value: str) -> str:
+    f = float(value)
+    return str(int(f)) if f.is_integer() else str(f)
+
+
+def value_in_document(cell: str, value: str, document: str) -> bool:
+    """値の文字列（1.0 は 1）が文書に含まれていれば一致"""
+    return value in document
+
+
+class FakeMatchingLLM:
+    """
+    照合プロンプトの各セルについて verdict(セル, 値の文字列, 文書) で一致を決める偽の LLM（省略時は value_in_document）。
+    latency 秒だけ待ってから返す（1 回の問い合わせごと）。calls に問い合わせたセルの一覧を記録する。
+    """
+    def __init__(
+        self,
+        verdict: Callable[[str, str, str], bool] = value_in_document,
+        latency: float = 0.0,
+        model_name: str = "fake-matching-llm",
+    ):
+        self.verdict = verdict
+        self.latency = latency
+        self.model_name = model_name
+        self.temperature = 0
+        self.calls: list[list[str]] = []
+
+    def _answer(self, prompt) -> MatchingBatchResult:
+        text = prompt.to_string()
+        document = _DOCUMENT_RE.search(text)
+        document_text = document.group(1) if document else text
+        cells = _INPUT_RE.findall(text)
+        self.calls.append([cell for cell, _ in cells])
+        results = []
+        for cell, value in cells:
+            value_text = _value_text(value)
+            found = self.verdict(cell, value_text, document_text)
+            results.append(MatchingResult(
+                cell=cell, match=found, reason="found in the document" if found else "not found",
+                matched_text=value_text if found else None,
+            ))
+        return MatchingBatchResult(results=results)
+
+    def with_structured_output(self, schema):
+        def invoke(prompt) -> MatchingBatchResult:
+            time.sleep(self.latency)
+            return self._answer(prompt)
+
+        async def ainvoke(prompt) -> MatchingBatchResult:
+            await asyncio.sleep(self.latency)
+            return self._answer(prompt)
+        return RunnableLambda(invoke, afunc=ainvoke)
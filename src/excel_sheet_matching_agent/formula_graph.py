@@ -0,0 +1,171 @@
+'''
+計算セルの数式から作るセル単位の依存グラフ
+
+数式を openpyxl の Tokenizer で分解し、参照（セル・範囲・別シート・名前付き範囲）を取り出す。
+指定した出力セルの（推移的な）参照元だけを照合したり、一致しなかった入力がどの出力に影響するかを調べるのに使う。
+'''
+from openpyxl import load_workbook
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils.cell import range_boundaries
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+import logging
+import re
+
+from .load_xlsx import iter_workbook
+from .models import ExcelCellFormulaData, ExcelCellInputData
+
+
+logger = logging.getLogger(__name__)
+
+CellKey = tuple[str, str]  # (シート名, "B2")
+
+_SHEET_REF_RE = re.compile(r"^(?:(?P<sheet>'(?:[^']|'')+'|[^!']+)!)?(?P<ref>[^!]+)$")
+
+
+class RangeRef(NamedTuple):
+    sheet: str
+    min_col: Optional[int]  # None は行全体（1:3 など）
+    min_row: Optional[int]  # None は列全体（A:A など）
+    max_col: Optional[int]
+    max_row: Optional[int]
+
+    def contains(self, column: int, row: int) -> bool:
+        return (
+            (self.min_col is None or self.min_col <= column <= self.max_col)  # type: ignore
+            and (self.min_row is None or self.min_row <= row <= self.max_row)  # type: ignore
+        )
+
+
+def cell_key(text: str, default_sheet: str) -> CellKey:
+    """"Sheet!B2" / "'My Sheet'!$B$2" / "B2" をキーにする"""
+    m = _SHEET_REF_RE.match(text.strip())
+    if m is None:
+        raise ValueError(f"invalid cell reference: {text}")
+    sheet = m.group("sheet")
+    sheet = sheet[1:-1].replace("''", "'") if sheet and sheet.startswith("'") else sheet
+    return sheet or default_sheet, m.group("ref").replace("$", "").upper()
+
+
+def _split_cell(cell: str) -> tuple[int, int]:
+    min_col, min_row, _, _ = range_boundaries(cell)
+    return min_col, min_row  # type: ignore
+
+
+def parse_ref(text: str, default_sheet: str, names: dict[str, list[RangeRef]]) -> list[RangeRef]:
+    """数式中の参照 1 つを範囲にする。名前付き範囲は names で引く。解釈できなければ空"""
+    m = _SHEET_REF_RE.match(text.strip())
+    if m is None:
+        return []
+    sheet, ref = cell_key(text, default_sheet)
+    try:
+        return [RangeRef(sheet, *range_boundaries(ref))]
+    except ValueError:
+        pass
+    # 名前付き範囲（シートに限定した名前を優先）
+    name = m.group("ref").lower()
+    return names.get(f"{sheet}!{name}".lower()) or names.get(name) or []
+
+
+def formula_refs(formula: str, sheet: str, names: dict[str, list[RangeRef]]) -> list[RangeRef]:
+    refs = []
+    try:
+        tokens = Tokenizer(formula).items
+    except Exception:
+        logger.warning(f"cannot parse formula in {sheet}: {formula}")
+        return refs
+    for token in tokens:
+        if token.type == Token.OPERAND and token.subtype == Token.RANGE:
+            refs += parse_ref(token.value, sheet, names)
+    return refs
+
+
+class DependencyGraph:
+    """
+    計算セル → 数式が参照する範囲。範囲は既知のセル（入力セル・計算セル）に展開して辿る。
+    """
+    def __init__(self, cells: Iterable[CellKey], precedents: dict[CellKey, list[RangeRef]]):
+        self.precedents = precedents
+        self._by_sheet: dict[str, list[tuple[int, int, CellKey]]] = defaultdict(list)
+        for key in set(cells) | set(precedents):
+            column, row = _split_cell(key[1])
+            self._by_sheet[key[0]].append((column, row, key))
+        self._expanded: dict[RangeRef, list[CellKey]] = {}
+
+    def cells_in(self, ref: RangeRef) -> list[CellKey]:
+        if ref not in self._expanded:
+            self._expanded[ref] = [key for column, row, key in self._by_sheet.get(ref.sheet, []) if ref.contains(column, row)]
+        return self._expanded[ref]
+
+    def direct_precedents(self, key: CellKey) -> set[CellKey]:
+        return {cell for ref in self.precedents.get(key, []) for cell in self.cells_in(ref)}
+
+    def transitive_precedents(self, targets: Iterable[CellKey]) -> set[CellKey]:
+        """targets の計算に使われるすべてのセル（targets 自身は含まない）"""
+        seen: set[CellKey] = set()
+        stack = list(targets)
+        while stack:
+            for cell in self.direct_precedents(stack.pop()):
+                if cell not in seen:
+                    seen.add(cell)
+                    stack.append(cell)
+        return seen
+
+    def impacted(self, inputs: Iterable[CellKey], targets: Iterable[CellKey]) -> dict[CellKey, list[CellKey]]:
+        """入力セルごとに、その値を使っている targets"""
+        inputs = list(inputs)
+        impacted: dict[CellKey, list[CellKey]] = {key: [] for key in inputs}
+        for target in targets:
+            precedents = self.transitive_precedents([target])
+            for key in inputs:
+                if key in precedents:
+                    impacted[key].append(target)
+        return impacted
+
+
+def _defined_names(wb) -> dict[str, list[RangeRef]]:
+    names: dict[str, list[RangeRef]] = {}
+
+    def add(name: str, defined_name):
+        refs = []
+        try:
+            for sheet, ref in defined_name.destinations:
+                refs += [RangeRef(sheet, *range_boundaries(ref.replace("$", "")))]
+        except (ValueError, TypeError):
+            return  # 定数や数式の名前
+        names[name.lower()] = refs
+
+    for name, defined_name in wb.defined_names.items():
+        add(name, defined_name)
+    for ws in wb.worksheets:
+        for name, defined_name in getattr(ws, "defined_names", {}).items():
+            add(f"{ws.title}!{name}", defined_name)
+    return names
+
+
+def build_graph(
+        formulas: Iterable[ExcelCellFormulaData],
+        inputs: Iterable[ExcelCellInputData] = (),
+        names: Optional[dict[str, list[RangeRef]]] = None,
+    ) -> DependencyGraph:
+    names = names or {}
+    precedents = {
+        (formula.sheet, formula.cell): formula_refs(formula.value, formula.sheet, names)
+        for formula in formulas
+    }
+    return DependencyGraph(((inp.sheet, inp.cell) for inp in inputs), precedents)
+
+
+def load_graph(sheet_path: Path, sheet_names: Optional[Iterable[str]] = None) -> DependencyGraph:
+    """ブックの（指定したシートの）入力セル・計算セルと名前付き範囲から依存グラフを作る"""
+    wb = load_workbook(sheet_path, read_only=True)
+    try:
+        names = _defined_names(wb)
+    finally:
+        wb.close()
+    inputs, formulas = [], []
+    for cell in iter_workbook(sheet_path, sheet_names):
+        (formulas if isinstance(cell, ExcelCellFormulaData) else inputs).append(cell)
+    return build_graph(formulas, inputs, names)
@@ -0,0 +1,91 @@
+'''
+出典の照合用インデックス（prematch の TokenTable・retrieval の RetrievalIndex）のメモリ上の LRU キャッシュ
+
+キーは出典の markdown/json のパスと、ファイルのサイズ・更新時刻。解析し直した出典は別のキーになる。
+常駐プロセス（server.py）で同じ出典を何度も照合するときに、json の読み込みとインデックスの作成を省く。
+'''
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Hashable, Optional, TypeVar
+import logging
+import threading
+
+from . import instrumentation
+from .prematch import TokenTable, build_token_table
+from .retrieval import RetrievalIndex, build_index
+
+
+DEFAULT_MAX_ENTRIES = 32
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def file_key(path: Optional[Path]) -> Hashable:
+    """パスと、ファイルのサイズ・更新時刻（ないファイルは None）"""
+    if path is None or not path.exists():
+        return (str(path), None)
+    stat = path.stat()
+    return (str(path), stat.st_size, stat.st_mtime_ns)
+
+
+def sources_key(analyzed_markdown_paths: list[Path], analyzed_json_paths: Optional[list[Path]] = None) -> Hashable:
+    json_paths = analyzed_json_paths if analyzed_json_paths is not None else [None] * len(analyzed_markdown_paths)
+    return tuple((file_key(md), file_key(js)) for md, js in zip(analyzed_markdown_paths, json_paths))
+
+
+class LRUCache:
+    """
+    最近使った max_entries 件までを持つキャッシュ（スレッドセーフ）。
+    計測（instrumentation）には `{name}_hits` / `{name}_misses` を数える。
+    """
+    def __init__(self, name: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, object] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: Hashable, build: Callable[[], T]) -> T:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                instrumentation.count(f"{self.name}_hits")
+                return self._entries[key]  # type: ignore
+        # 作るのは時間がかかるのでロックの外で（同時に同じものを作ることはある）
+        value = build()
+        with self._lock:
+            self.misses += 1
+            instrumentation.count(f"{self.name}_misses")
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                logger.debug(f"evicted the oldest entry from {self.name}")
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+class IndexCache(LRUCache):
+    """出典の組ごとの TokenTable / RetrievalIndex"""
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        super().__init__("index_cache", max_entries)
+
+    def token_table(self, analyzed_markdown_paths: list[Path], analyzed_json_paths: Optional[list[Path]] = None) -> TokenTable:
+        key = ("token_table", sources_key(analyzed_markdown_paths, analyzed_json_paths))
+        return self.get_or_build(key, lambda: build_token_table(analyzed_markdown_paths, analyzed_json_paths))
+
+    def retrieval_index(self, analyzed_markdown_paths: list[Path], analyzed_json_paths: Optional[list[Path]] = None) -> RetrievalIndex:
+        key = ("retrieval_index", sources_key(analyzed_markdown_paths, analyzed_json_paths))
+        return self.get_or_build(key, lambda: build_index(analyzed_markdown_paths, analyzed_json_paths))
@@ -0,0 +1,286 @@
+'''
+処理段階ごとの計測（経過時間・CPU時間・最大RSS・LLM のトークン数とレイテンシ・キャッシュのヒット率）
+
+既定では無効で、無効のときは stage() などは何もしない（ほぼコストなし）。
+
+    from excel_sheet_matching_agent import instrumentation
+
+    with instrumentation.recording() as recorder:
+        ...  # analyze_local_pdf, extract_data, match, markup
+    recorder.write_report(Path("data/run_report.json"))
+    Path("data/metrics.prom").write_text(recorder.prometheus_text())
+
+プロセスプールで動く処理の中の計測は、そのままでは子プロセスに残って失われる。
+バッチ CLI の抽出・マークアップは run_recorded で子の計測を結果と一緒に返し、親で merge する。
+markup の並列化（markup(max_workers=...)）は、呼び出し側のプロセスの stage でまとめて測る。
+
+CPU 時間は stage の前後のプロセス全体の CPU 時間（time.process_time）の差なので、
+並行に動く stage（別スレッドや asyncio のタスク）が重なると、その間の CPU 時間はそれぞれの stage に数えられる
+（stage の cpu_seconds の合計はプロセスの CPU 時間を超えうる）。CPU 時間は重ならない stage どうしでだけ比べる。
+最大RSS は resource モジュールのない環境（Windows）では None。
+'''
+from langchain_core.callbacks import BaseCallbackHandler
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+
+class StageStats:
+    __slots__ = ("calls", "wall", "cpu", "max_wall")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max_wall = 0.0
+
+    def as_dict(self) -> dict:
+        return {"calls": self.calls, "wall_seconds": self.wall, "cpu_seconds": self.cpu, "max_wall_seconds": self.max_wall}
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KiB、macOS はバイト
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _quantile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages: dict[str, StageStats] = {}
+        self.counters: dict[str, float] = {}
+        self.observations: dict[str, list[float]] = {}
+
+    def add_stage(self, name: str, wall: float, cpu: float):
+        with self._lock:
+            stats = self.stages.setdefault(name, StageStats())
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.max_wall = max(stats.max_wall, wall)
+
+    def snapshot(self) -> dict:
+        """別のプロセスに返して merge できる（pickle できる）計測の中身"""
+        with self._lock:
+            return {
+                "stages": {name: (s.calls, s.wall, s.cpu, s.max_wall) for name, s in self.stages.items()},
+                "counters": dict(self.counters),
+                "observations": {name: list(values) for name, values in self.observations.items()},
+            }
+
+    def merge(self, snapshot: dict):
+        """snapshot() の中身を足す"""
+        with self._lock:
+            for name, (calls, wall, cpu, max_wall) in snapshot["stages"].items():
+                stats = self.stages.setdefault(name, StageStats())
+                stats.calls += calls
+                stats.wall += wall
+                stats.cpu += cpu
+                stats.max_wall = max(stats.max_wall, max_wall)
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, values in snapshot["observations"].items():
+                self.observations.setdefault(name, []).extend(values)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.observations.setdefault(name, []).append(value)
+
+    def hit_rates(self) -> dict[str, float]:
+        """`{name}_hits` と `{name}_misses` の組からヒット率を出す"""
+        rates = {}
+        for key, hits in self.counters.items():
+            if key.endswith("_hits"):
+                name = key[:-len("_hits")]
+                total = hits + self.counters.get(f"{name}_misses", 0)
+                rates[name] = hits / total if total else 0.0
+        return rates
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started,
+                "elapsed_seconds": time.time() - self.started,
+                "peak_rss_bytes": peak_rss_bytes(),
+                "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+                "counters": dict(self.counters),
+                "hit_rates": self.hit_rates(),
+                "observations": {
+                    name: {
+                        "count": len(values),
+                        "sum": sum(values),
+                        "min": min(values),
+                        "max": max(values),
+                        "p50": _quantile(values, 0.5),
+                        "p95": _quantile(values, 0.95),
+                    }
+                    for name, values in self.observations.items() if values
+                },
+            }
+
+    def write_report(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(), ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def prometheus_text(self, prefix: str = "esma") -> str:
+        report = self.report()
+        lines = [
+            f"# TYPE {prefix}_stage_wall_seconds counter",
+            *(f'{prefix}_stage_wall_seconds{{stage="{name}"}} {s["wall_seconds"]}' for name, s in report["stages"].items()),
+            f"# TYPE {prefix}_stage_cpu_seconds counter",
+            *(f'{prefix}_stage_cpu_seconds{{stage="{name}"}} {s["cpu_seconds"]}' for name, s in report["stages"].items()),
+            f"# TYPE {prefix}_stage_calls counter",
+            *(f'{prefix}_stage_calls{{stage="{name}"}} {s["calls"]}' for name, s in report["stages"].items()),
+        ]
+        if report["peak_rss_bytes"] is not None:
+            lines += [f"# TYPE {prefix}_peak_rss_bytes gauge", f"{prefix}_peak_rss_bytes {report['peak_rss_bytes']}"]
+        for name, value in report["counters"].items():
+            lines += [f"# TYPE {prefix}_{name} counter", f"{prefix}_{name} {value}"]
+        for name, rate in report["hit_rates"].items():
+            lines += [f"# TYPE {prefix}_{name}_hit_rate gauge", f"{prefix}_{name}_hit_rate {rate}"]
+        for name, summary in report["observations"].items():
+            lines += [
+                f"# TYPE {prefix}_{name} summary",
+                f'{prefix}_{name}{{quantile="0.5"}} {summary["p50"]}',
+                f'{prefix}_{name}{{quantile="0.95"}} {summary["p95"]}',
+                f"{prefix}_{name}_sum {summary['sum']}",
+                f"{prefix}_{name}_count {summary['count']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+_recorder: Optional[Recorder] = None
+
+
+def get_recorder() -> Optional[Recorder]:
+    return _recorder
+
+
+def enable() -> Recorder:
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+@contextmanager
+def recording() -> Iterator[Recorder]:
+    """with ブロックの間だけ計測する"""
+    global _recorder
+    previous = _recorder
+    recorder = enable()
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        recorder.add_stage(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def timed(name: str):
+    """関数（async 関数も可）の呼び出しを stage として測るデコレータ"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_recorded(record: bool, fn, *args) -> tuple[Any, Optional[dict]]:
+    """
+    プロセスプールの子で fn(*args) を呼び、(結果, 子での計測の snapshot) を返す（record=False なら計測しない）。
+    親は merge(snapshot) で自分の計測に足す。計測はプロセス全体で 1 つなので、スレッドプールでは使わない。
+    """
+    if not record:
+        return fn(*args), None
+    with recording() as recorder:
+        result = fn(*args)
+    return result, recorder.snapshot()
+
+
+def merge(snapshot: Optional[dict]):
+    if _recorder is not None and snapshot is not None:
+        _recorder.merge(snapshot)
+
+
+def count(name: str, value: float = 1):
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def observe(name: str, value: float):
+    if _recorder is not None:
+        _recorder.observe(name, value)
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """LLM 呼び出しのトークン数を数える（with_structured_output の後ろでも取れるように callback で受ける）"""
+    def on_llm_end(self, response, **kwargs: Any):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        if not (input_tokens or output_tokens):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            input_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+        count("llm_calls")
+        count("llm_prompt_tokens", input_tokens)
+        count("llm_completion_tokens", output_tokens)
+
+
+def llm_config() -> Optional[dict]:
+    """計測中なら、LLM のトークン数を数える callback を付けた RunnableConfig"""
+    if _recorder is None:
+        return None
+    return {"callbacks": [TokenUsageCallback()]}
@@ -0,0 +1,214 @@
+'''
+prebuilt-layout の解析結果キャッシュ
+
+キャッシュキーは PDF のバイト列・モデルID・出力形式・OpenCC 変換のバージョンから作る。
+ファイル名ではなく中身で引くので、同名の別PDFが結果を共有したり、改訂したPDFが再解析されない、ということが起きない。
+
+- エントリは `{root}/entries/{key}/` に置く（`content.md`, `result.json`, `meta.json`）
+- 書き込みは `{root}/tmp/` で作ってからディレクトリごと rename するので、並行実行でも壊れたエントリは見えない
+- 容量・経過時間の上限を超えたエントリは、最終アクセスの古い順に削除する
+'''
+from pydantic import BaseModel
+
+from contextlib import contextmanager
+from functools import cache
+from pathlib import Path
+from typing import Iterator, Optional
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+
+MARKDOWN_NAME = "content.md"
+JSON_NAME = "result.json"
+META_NAME = "meta.json"
+
+DEFAULT_MAX_BYTES = 10 * 1024**3     # 10 GiB
+DEFAULT_MAX_AGE = 90 * 24 * 60 * 60  # 90日
+
+logger = logging.getLogger(__name__)
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CacheEntry(BaseModel):
+    key: str
+    path: Path
+
+    @property
+    def markdown_path(self) -> Path:
+        return self.path / MARKDOWN_NAME
+
+    @property
+    def json_path(self) -> Path:
+        return self.path / JSON_NAME
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+class LayoutCache:
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+        max_age: Optional[float] = DEFAULT_MAX_AGE,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = CacheStats()
+        self.entries_dir = root / "entries"
+        self.tmp_dir = root / "tmp"
+
+    def key(self, pdf_path: Path, model_id: str, output_format: str, converter_version: str) -> str:
+        return self.key_for_digest(file_digest(pdf_path), model_id, output_format, converter_version)
+
+    @staticmethod
+    def key_for_digest(pdf_digest: str, model_id: str, output_format: str, converter_version: str) -> str:
+        h = hashlib.sha256()
+        for part in (pdf_digest, model_id, output_format, converter_version):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.entries_dir / key
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        path = self._entry_path(key)
+        meta = path / META_NAME
+        if not meta.exists():
+            self.stats.misses += 1
+            return None
+        if self.max_age is not None and time.time() - meta.stat().st_mtime > self.max_age:
+            logger.info(f"cache entry expired: {key}")
+            self._remove(path)
+            self.stats.evictions += 1
+            self.stats.misses += 1
+            return None
+        # LRU のために最終アクセス時刻を更新
+        try:
+            os.utime(meta)
+        except FileNotFoundError:
+            # 別プロセスに削除された
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return CacheEntry(key=key, path=path)
+
+    def entry(self, key: str) -> CacheEntry:
+        """統計を更新せずにエントリを返す（書き込み直後用）"""
+        return CacheEntry(key=key, path=self._entry_path(key))
+
+    @contextmanager
+    def writer(self, key: str, **meta) -> Iterator[Path]:
+        """
+        エントリを書き込むための一時ディレクトリを返す。
+        with ブロックを正常に抜けたときだけエントリとして公開する。
+        """
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        staging = self.tmp_dir / f"{key}.{uuid.uuid4().hex}"
+        staging.mkdir()
+        try:
+            yield staging
+            (staging / META_NAME).write_text(json.dumps({
+                "key": key,
+                "created_at": time.time(),
+                "size": _dir_size(staging),
+                **meta,
+            }, ensure_ascii=False), encoding="utf-8")
+            try:
+                os.rename(staging, self._entry_path(key))
+            except OSError:
+                # 他のプロセスが同じキーを先に書き込んだ（内容は同じはず）
+                logger.debug(f"cache entry already exists: {key}")
+            else:
+                self.stats.writes += 1
+        finally:
+            if staging.exists():
+                shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def _remove(self, path: Path):
+        # rename してから消すことで、削除途中のエントリが読まれないようにする
+        trash = self.tmp_dir / f"trash.{uuid.uuid4().hex}"
+        try:
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+            os.rename(path, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _scan(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.entries_dir.exists():
+            return entries
+        for path in self.entries_dir.iterdir():
+            meta = path / META_NAME
+            try:
+                atime = meta.stat().st_mtime
+                size = json.loads(meta.read_text(encoding="utf-8"))["size"]
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((atime, size, path))
+        return entries
+
+    def evict(self) -> int:
+        """容量・経過時間の上限を超えた分を削除し、削除したエントリ数を返す"""
+        entries = sorted(self._scan())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for atime, size, path in entries:
+            expired = self.max_age is not None and now - atime > self.max_age
+            oversize = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or oversize):
+                continue
+            logger.info(f"evicting cache entry: {path.name}")
+            self._remove(path)
+            total -= size
+            removed += 1
+        self.stats.evictions += removed
+        return removed
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._scan())
+
+
+@cache
+def get_cache(root: Path) -> LayoutCache:
+    """プロセス内で同じ root のキャッシュ（と統計）を共有する"""
+    return LayoutCache(root)
+
+
+def materialize(src: Path, dst: Path):
+    """キャッシュのファイルを dst にアトミックにコピーする（更新時刻も引き継ぐ）"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}")
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
@@ -0,0 +1,307 @@
+'''
+prebuilt-layout の解析結果（json）の、列指向でメモリマップできる保存形式
+
+`json/{stem}.json` の隣に `json/{stem}.layout/` を作る。
+- pages.npy / lines.npy / words.npy: ページ・行・単語の表（ポリゴンは float32、span は int32）
+- text.bin: 文書全体の content と、行・単語の content をつなげた UTF-8
+- meta.json: 版と、元にした json のサイズ・更新時刻
+
+表は mmap で開き、ページの行・単語はアクセスしたページの分だけ作る。
+ページ・行・単語は AnalyzeResult と同じ属性名で読めるので、markup や照合からはそのまま使える。
+'''
+import numpy as np
+
+from functools import cached_property
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional, Sequence
+import errno
+import json
+import logging
+import mmap
+import os
+import shutil
+import uuid
+
+from . import instrumentation
+
+
+STORE_VERSION = 1
+STORE_SUFFIX = ".layout"
+META_NAME = "meta.json"
+OPEN_ATTEMPTS = 5  # 開いている途中で置き換えられたときに開き直す回数
+
+PAGE_DTYPE = np.dtype([
+    ("page_number", "<i4"), ("width", "<f4"), ("height", "<f4"), ("angle", "<f4"), ("unit", "<i4"),
+    ("span_start", "<i4"), ("span_count", "<i4"),
+    ("line_start", "<i4"), ("line_count", "<i4"),
+    ("word_start", "<i4"), ("word_count", "<i4"),
+])
+SPAN_DTYPE = np.dtype([("offset", "<i4"), ("length", "<i4")])
+LINE_DTYPE = np.dtype([
+    ("polygon", "<f4", (8,)), ("span_start", "<i4"), ("span_count", "<i4"), ("text_start", "<i8"), ("text_length", "<i4"),
+])
+WORD_DTYPE = np.dtype([
+    ("polygon", "<f4", (8,)), ("offset", "<i4"), ("length", "<i4"), ("confidence", "<f4"),
+    ("text_start", "<i8"), ("text_length", "<i4"),
+])
+_TABLES = {"pages": PAGE_DTYPE, "spans": SPAN_DTYPE, "lines": LINE_DTYPE, "words": WORD_DTYPE}
+
+logger = logging.getLogger(__name__)
+
+
+def store_path(json_path: Path) -> Path:
+    return json_path.with_suffix(STORE_SUFFIX)
+
+
+class Span(NamedTuple):
+    offset: int
+    length: int
+
+
+class LineView(NamedTuple):
+    content: str
+    polygon: list[float]
+    spans: list[Span]
+
+
+class WordView(NamedTuple):
+    content: str
+    polygon: list[float]
+    span: Span
+    confidence: float
+
+
+def _pad_polygon(polygon: Optional[list[float]]) -> list[float]:
+    return ((polygon or []) + [np.nan] * 8)[:8]
+
+
+def _polygon(values) -> list[float]:
+    return [float(v) for v in values if not np.isnan(v)]
+
+
+class _Blob:
+    def __init__(self, path: Path):
+        self._file = path.open("rb")
+        # 空ファイルは mmap できない
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if path.stat().st_size else b""
+
+    def text(self, start: int, length: int) -> str:
+        return self._data[start:start + length].decode("utf-8")
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class PageView:
+    def __init__(self, store: "LayoutStore", row):
+        self._store = store
+        self.page_number = int(row["page_number"])
+        self.width = float(row["width"])
+        self.height = float(row["height"])
+        self.angle = float(row["angle"])
+        self.unit = store.units[int(row["unit"])]
+        self._row = row
+
+    @cached_property
+    def spans(self) -> list[Span]:
+        return self._store.spans(int(self._row["span_start"]), int(self._row["span_count"]))
+
+    @cached_property
+    def lines(self) -> list[LineView]:
+        start, count = int(self._row["line_start"]), int(self._row["line_count"])
+        return [
+            LineView(
+                self._store.blob.text(int(row["text_start"]), int(row["text_length"])),
+                _polygon(row["polygon"]),
+                self._store.spans(int(row["span_start"]), int(row["span_count"])),
+            )
+            for row in self._store.tables["lines"][start:start + count]
+        ]
+
+    @cached_property
+    def words(self) -> list[WordView]:
+        start, count = int(self._row["word_start"]), int(self._row["word_count"])
+        return [
+            WordView(
+                self._store.blob.text(int(row["text_start"]), int(row["text_length"])),
+                _polygon(row["polygon"]),
+                Span(int(row["offset"]), int(row["length"])),
+                float(row["confidence"]),
+            )
+            for row in self._store.tables["words"][start:start + count]
+        ]
+
+
+class _Pages(Sequence[PageView]):
+    def __init__(self, store: "LayoutStore"):
+        self._store = store
+        self._cache: dict[int, PageView] = {}
+
+    def __len__(self) -> int:
+        return len(self._store.tables["pages"])
+
+    def __getitem__(self, i):  # type: ignore
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i not in self._cache:
+            self._cache[i] = PageView(self._store, self._store.tables["pages"][i])
+        return self._cache[i]
+
+
+class LayoutStore:
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta = json.loads((path / META_NAME).read_text(encoding="utf-8"))
+        assert self.meta["version"] == STORE_VERSION
+        self.units: list[Optional[str]] = self.meta["units"]
+        self.tables = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in _TABLES}
+        self.blob = _Blob(path / "text.bin")
+        self.pages = _Pages(self)
+
+    @cached_property
+    def content(self) -> str:
+        return self.blob.text(*self.meta["content"])
+
+    def spans(self, start: int, count: int) -> list[Span]:
+        return [Span(int(row["offset"]), int(row["length"])) for row in self.tables["spans"][start:start + count]]
+
+    def page(self, page_number: int) -> PageView:
+        # ページ範囲だけを解析した結果では、ページ番号が 1 から始まらない
+        index = np.flatnonzero(self.tables["pages"]["page_number"] == page_number)
+        if not len(index):
+            raise IndexError(page_number)
+        return self.pages[int(index[0])]
+
+    def close(self):
+        self.tables.clear()
+        self.blob.close()
+
+
+def _json_stat(json_path: Path) -> dict:
+    stat = json_path.stat()
+    return {"json_size": stat.st_size, "json_mtime_ns": stat.st_mtime_ns}
+
+
+def _write_tables(layout: dict, out_dir: Path) -> dict:
+    text = bytearray()
+
+    def put(s: str) -> tuple[int, int]:
+        data = s.encode("utf-8")
+        text.extend(data)
+        return len(text) - len(data), len(data)
+
+    content = put(layout.get("content") or "")
+    units: list[Optional[str]] = []
+    pages, spans, lines, words = [], [], [], []
+
+    def add_spans(items: list[dict]) -> tuple[int, int]:
+        start = len(spans)
+        spans.extend((s["offset"], s["length"]) for s in items)
+        return start, len(items)
+
+    for page in layout.get("pages", []):
+        unit = page.get("unit")
+        if unit not in units:
+            units.append(unit)
+        span_start, span_count = add_spans(page.get("spans") or [])
+        line_start, word_start = len(lines), len(words)
+        for line in page.get("lines") or []:
+            lines.append((
+                _pad_polygon(line.get("polygon")), *add_spans(line.get("spans") or []), *put(line["content"]),
+            ))
+        for word in page.get("words") or []:
+            span = word.get("span") or {"offset": -1, "length": 0}
+            words.append((
+                _pad_polygon(word.get("polygon")), span["offset"], span["length"],
+                word.get("confidence", np.nan), *put(word["content"]),
+            ))
+        pages.append((
+            page["pageNumber"], page.get("width") or 0, page.get("height") or 0, page.get("angle") or 0,
+            units.index(unit), span_start, span_count,
+            line_start, len(lines) - line_start, word_start, len(words) - word_start,
+        ))
+
+    for name, rows in {"pages": pages, "spans": spans, "lines": lines, "words": words}.items():
+        np.save(out_dir / f"{name}.npy", np.array(rows, dtype=_TABLES[name]))
+    (out_dir / "text.bin").write_bytes(text)
+    return {"units": units, "content": content}
+
+
+@instrumentation.timed("layout_store.build")
+def build_layout_store(json_path: Path) -> Path:
+    """json から `{stem}.layout/` を作り直す"""
+    path = store_path(json_path)
+    staging = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    staging.mkdir(parents=True)
+    try:
+        stat = _json_stat(json_path)
+        with json_path.open(encoding="utf-8") as f:
+            meta = _write_tables(json.load(f), staging)
+        (staging / META_NAME).write_text(
+            json.dumps({"version": STORE_VERSION, **stat, **meta}, ensure_ascii=False), encoding="utf-8"
+        )
+        replace_tree(staging, path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info(f"layout store written: {path}")
+    return path
+
+
+def replace_tree(src: Path, dst: Path):
+    """
+    ディレクトリ dst を src で置き換える（読み手が途中の状態を見ないように rename で入れ替える）。
+    別のスレッド・プロセスが同時に dst を置き換えていれば、どけてからやり直す（後から置いた方が残る）。
+    """
+    while True:
+        trash = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.old")
+        try:
+            os.rename(dst, trash)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            continue
+        finally:
+            shutil.rmtree(trash, ignore_errors=True)
+        return
+
+
+def is_fresh(json_path: Path) -> bool:
+    meta_path = store_path(json_path) / META_NAME
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:  # ないか、別のスレッド・プロセスが置き換えている途中
+        return False
+    return meta.get("version") == STORE_VERSION and all(meta.get(k) == v for k, v in _json_stat(json_path).items())
+
+
+def open_layout(json_path: Path) -> LayoutStore:
+    """
+    json に対応する保存形式を開く（なければ、または json が変わっていれば作る）。
+    開いている途中で別のスレッド・プロセスが置き換えたら、開き直す。
+    """
+    for attempt in range(OPEN_ATTEMPTS):
+        if not is_fresh(json_path):
+            build_layout_store(json_path)
+        try:
+            return LayoutStore(store_path(json_path))
+        except FileNotFoundError:
+            if attempt == OPEN_ATTEMPTS - 1:
+                raise
+            logger.debug(f"layout store replaced while opening, retrying: {json_path}")
+    raise AssertionError("unreachable")
+
+
+def iter_lines(store: LayoutStore) -> Iterator[tuple[int, str]]:
+    for page in store.pages:
+        for line in page.lines:
+            yield page.page_number, line.content
@@ -1,61 +1,148 @@
 """
 Excel Worksheetから入力セル/計算セルを抽出する
+
+大きなシートでも読めるように、ブックは read_only で開いて行ごとに流す。
+周囲セルの情報（左右、vertical=True なら上下も）は、前後1行ずつの窓から取る。
+セルはモデルを作らずに列指向の表（cell_table.py）に書き、extract_data などはその表をそのまま持つ ExcelSheetData を返す。
 """
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
 
 from pathlib import Path
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
 
+from . import instrumentation
+from .cell_table import CellTableBuilder, FormulaTable, InputTable
 from .models import ExcelCellFormulaData, ExcelCellInputData, ExcelSheetData
 
 
-def extract_cell_info(sheet: Worksheet) -> ExcelSheetData:
-    input_data = []
-    formula_data = []
+ExcelCellData = ExcelCellInputData | ExcelCellFormulaData
+_Row = tuple[int, dict[int, Any]]  # (行番号, 列番号 → セル)
+
+
+class _RawCell(NamedTuple):
+    is_formula: bool
+    sheet: str
+    row: int
+    column: int
+    coordinate: str
+    value: Any
+    metadata: tuple[str, ...]
+
+
+def _rows(sheet) -> Iterator[_Row]:
+    """値のあるセルだけを持つ行（空の行は飛ばす）"""
     for row in sheet.iter_rows():
-        for cell in row:
-            if cell.value is None:
-                continue
-
-            if isinstance(cell.value, (int, float)):
-                cell_type = "input"
-            elif isinstance(cell.value, str) and cell.data_type == "f":
-                cell_type = "formula"
-            else:
-                continue
-
-            # 周囲セルの情報（左右）
-            def safe_value(col_offset, row_offset):
-                try:
-                    ref_cell = sheet.cell(row=cell.row + row_offset, column=cell.column + col_offset)
-                    return str(ref_cell.value).strip() if ref_cell and ref_cell.value else ""
-                except:
-                    return ""
-
-            metadata = [safe_value(-1, 0), safe_value(1, 0)]
-
-            if cell_type == "input":
-                input_data.append(ExcelCellInputData(
-                    sheet=sheet.title,
-                    cell=cell.coordinate,
-                    value=cell.value,  # type: ignore
-                    metadata=metadata
-                ))
-            elif cell_type == "formula":
-                formula_data.append(ExcelCellFormulaData(
-                    sheet=sheet.title,
-                    cell=cell.coordinate,
-                    value=cell.value, # type: ignore
-                    metadata=metadata
-                ))
-
-    return ExcelSheetData(input=input_data, formula=formula_data)
+        cells = {cell.column: cell for cell in row if cell.value is not None}
+        if cells:
+            yield next(iter(cells.values())).row, cells
 
 
-def extract_data(sheet_path: Path, sheet_name: str) -> ExcelSheetData:
-    wb = load_workbook(sheet_path, data_only=False)
-    for sheet in wb.worksheets:
-        if sheet.title != sheet_name:
+def _text(cells: Optional[dict[int, Any]], column: int) -> str:
+    cell = cells.get(column) if cells else None
+    return str(cell.value).strip() if cell is not None and cell.value else ""
+
+
+def _adjacent(row: Optional[_Row], row_number: int) -> Optional[dict[int, Any]]:
+    return row[1] if row is not None and row[0] == row_number else None
+
+
+def _row_data(title: str, row: _Row, above: Optional[_Row], below: Optional[_Row], vertical: bool) -> Iterator[_RawCell]:
+    row_number, cells = row
+    for column, cell in sorted(cells.items()):
+        if isinstance(cell.value, (int, float)):
+            is_formula = False
+        elif isinstance(cell.value, str) and cell.data_type == "f":
+            is_formula = True
+        else:
             continue
-        return extract_cell_info(sheet)
-    raise ValueError(f"sheet not found: {sheet_name}")
+
+        # 周囲セルの情報（左右、上下）
+        metadata = (_text(cells, column - 1), _text(cells, column + 1))
+        if vertical:
+            metadata += (
+                _text(_adjacent(above, row_number - 1), column),
+                _text(_adjacent(below, row_number + 1), column),
+            )
+        yield _RawCell(is_formula, title, row_number, column, cell.coordinate, cell.value, metadata)
+
+
+def _iter_raw(sheet, vertical: bool = False) -> Iterator[_RawCell]:
+    rows = _rows(sheet)
+    above: Optional[_Row] = None
+    current = next(rows, None)
+    while current is not None:
+        below = next(rows, None)
+        yield from _row_data(sheet.title, current, above, below, vertical)
+        above, current = current, below
+
+
+def _model(raw: _RawCell) -> ExcelCellData:
+    model = ExcelCellFormulaData if raw.is_formula else ExcelCellInputData
+    return model(sheet=raw.sheet, cell=raw.coordinate, value=raw.value, metadata=list(raw.metadata))
+
+
+def iter_cells(sheet, vertical: bool = False) -> Iterator[ExcelCellData]:
+    """シートの入力セル/計算セルを行順に返す（read_only のシートでもよい）"""
+    return map(_model, _iter_raw(sheet, vertical))
+
+
+def _iter_workbook_raw(
+        sheet_path: Path,
+        sheet_names: Optional[Iterable[str]] = None,
+        vertical: bool = False,
+    ) -> Iterator[_RawCell]:
+    wb = load_workbook(sheet_path, read_only=True, data_only=False)
+    try:
+        names = wb.sheetnames if sheet_names is None else list(sheet_names)
+        for name in names:
+            if name not in wb.sheetnames:
+                raise ValueError(f"sheet not found: {name}")
+        for name in names:
+            yield from _iter_raw(wb[name], vertical)
+    finally:
+        wb.close()
+
+
+def iter_workbook(
+        sheet_path: Path,
+        sheet_names: Optional[Iterable[str]] = None,
+        vertical: bool = False,
+    ) -> Iterator[ExcelCellData]:
+    """
+    ブックを read_only で 1 回だけ開き、指定したシート（省略時はすべて）のセルを順に返す。
+    """
+    return map(_model, _iter_workbook_raw(sheet_path, sheet_names, vertical))
+
+
+def _build_tables(cells: Iterable[_RawCell]) -> tuple[InputTable, FormulaTable]:
+    builder = CellTableBuilder()
+    for raw in cells:
+        if raw.is_formula:
+            builder.add_formula(raw.sheet, raw.row, raw.column, raw.value, raw.metadata)
+        else:
+            builder.add_input(raw.sheet, raw.row, raw.column, raw.value, raw.metadata)
+    return builder.build()
+
+
+def _collect(tables: tuple[InputTable, FormulaTable]) -> ExcelSheetData:
+    inputs, formulas = tables
+    return ExcelSheetData(input=inputs, formula=formulas)
+
+
+def extract_tables(
+        sheet_path: Path,
+        sheet_names: Optional[Iterable[str]] = None,
+        vertical: bool = False,
+    ) -> tuple[InputTable, FormulaTable]:
+    """iter_workbook と同じセルを、モデルを作らずに入力セル・計算セルの表にする"""
+    return _build_tables(_iter_workbook_raw(sheet_path, sheet_names, vertical))
+
+
+def extract_cell_info(sheet: Worksheet) -> ExcelSheetData:
+    return _collect(_build_tables(_iter_raw(sheet)))
+
+
+@instrumentation.timed("extract")
+def extract_data(sheet_path: Path, sheet_name: str) -> ExcelSheetData:
+    return _collect(extract_tables(sheet_path, [sheet_name]))
@@ -1,45 +1,99 @@
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from typing import List, Union
+from typing import Any, List, Union
 from langchain_core.language_models.chat_models import BaseChatModel
 from langfuse.callback import CallbackHandler
 from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.utils import get_column_letter # 列番号を列名に変換するために使用
+from openpyxl.utils import coordinate_to_tuple, get_column_letter # 列番号を列名に変換するために使用
 
+import asyncio
 import logging
 
 from .models import ExcelCellInputData
 from .prompts import extract_inputs_prompt
+from .tokens import estimate_tokens
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 
+_Row = tuple[int, list[tuple[int, Any]]]  # (行番号, [(列番号, セル)]) 値のあるセルだけ
+
+DEFAULT_TILE_TOKENS = 4000
+
+
+def _sparse_rows(sheet: Worksheet) -> list[_Row]:
+    rows = []
+    for row in sheet.iter_rows():
+        cells = [(cell.column, cell) for cell in row if cell.value is not None and cell.value != ""]
+        if cells:
+            rows.append((cells[0][1].row, cells))
+    return rows
+
+
+def _td(column: int, cell) -> str:
+    col = get_column_letter(column)
+    if isinstance(cell.value, (int, float)):
+        return f'<td data-col="{col}" class="input">{cell.value}</td>'
+    elif isinstance(cell.value, str) and cell.data_type == "f":
+        return f'<td data-col="{col}" class="formula">{cell.value}</td>'
+    return f'<td data-col="{col}">{cell.value}</td>'
+
+
+def _tr(row: _Row) -> str:
+    """値のあるセルだけを書き、間の空セルは colspan にまとめる（空行は書かない）"""
+    row_number, cells = row
+    tds = []
+    previous = 0
+    for column, cell in cells:
+        if column - previous > 1:
+            tds.append(f'<td colspan="{column - previous - 1}"></td>')
+        tds.append(_td(column, cell))
+        previous = column
+    return f'<tr data-row="{row_number}">' + "".join(tds) + "</tr>"
+
+
+def _table(rows: list[str]) -> str:
+    return "<table>\n" + "\n".join(rows) + "\n</table>"
+
+
 def sheet2str(sheet: Worksheet) -> str:
     """
     openpyxlのシートをHTMLテーブル文字列に変換する関数
+    値のあるセルだけを書く（空セルの並びは colspan、空行は省略。行番号は data-row、列名は data-col）
     """
-    rows = []
-    for row_idx, row in enumerate(sheet.iter_rows()):
-        excel_row_num = row_idx + 1 # Excelの行番号は1から始まる
-        tr = "<tr>"
-        for col_idx, cell in enumerate(row):
-            excel_col_letter = get_column_letter(col_idx + 1)
-            cell_value = cell.value
-
-            if cell_value is None:
-                cell_value = ""
-
-            if isinstance(cell_value, (int, float)):
-                tr += f'<td data-row="{excel_row_num}" data-col="{excel_col_letter}" class="input">{cell_value}</td>'
-            elif isinstance(cell_value, str) and cell.data_type == "f":
-                tr += f'<td data-row="{excel_row_num}" data-col="{excel_col_letter}" class="formula">{cell_value}</td>'
-            else:
-                tr += f'<td data-row="{excel_row_num}" data-col="{excel_col_letter}">{cell_value}</td>'
-        tr += "</tr>"
-        rows.append(tr)
+    return _table([_tr(row) for row in _sparse_rows(sheet)])
 
-    return "<table>\n" + "\n".join(rows) + "\n</table>"
+
+def sheet_tiles(
+        sheet: Worksheet,
+        max_tokens: int = DEFAULT_TILE_TOKENS,
+        header_rows: int = 1,
+        overlap: int = 2,
+    ) -> list[str]:
+    """
+    シートを max_tokens 程度の行の範囲（タイル）に分けて、それぞれ sheet2str と同じ形式にする。
+    先頭の header_rows 行（見出し）は全タイルに繰り返し、隣のタイルとは overlap 行ずつ重ねる。
+    見出しの列（左端の列）は行ごと書くので、どのタイルにも入る。
+    """
+    rows = [_tr(row) for row in _sparse_rows(sheet)]
+    header, body = rows[:header_rows], rows[header_rows:]
+    if not body:
+        return [_table(header)]
+    budget = max(max_tokens - sum(estimate_tokens(tr) for tr in header), 1)
+
+    tiles = []
+    start = 0
+    while start < len(body):
+        end, used = start, 0
+        while end < len(body) and (end == start or used + estimate_tokens(body[end]) <= budget):
+            used += estimate_tokens(body[end])
+            end += 1
+        tiles.append(_table(header + body[start:end]))
+        if end == len(body):
+            break
+        start = max(end - overlap, start + 1)
+    return tiles
 
 
 class _ExcelCellInputData(BaseModel):
@@ -52,19 +106,51 @@ class _ExcelCellInputDatas(BaseModel):
     inputs: List[_ExcelCellInputData] = Field(default_factory=list)
 
 
-def extract_inputs(llm: BaseChatModel, sheet: Worksheet) -> List[ExcelCellInputData]:
-    html_output = sheet2str(sheet)
+def _merge(sheet_title: str, results: list[_ExcelCellInputDatas]) -> List[ExcelCellInputData]:
+    """タイルの結果をセル番地で重複排除してまとめる（metadata は和集合、セル番地順）"""
+    merged: dict[str, _ExcelCellInputData] = {}
+    for result in results:
+        for data in result.inputs:
+            logger.debug(data.model_dump_json(indent=2, exclude_none=True))
+            cell = data.cell.strip().upper()
+            if cell in merged:
+                merged[cell].metadata += [m for m in data.metadata if m not in merged[cell].metadata]
+            else:
+                merged[cell] = data.model_copy(update={"cell": cell, "metadata": list(data.metadata)})
+
+    def order(cell: str) -> tuple[int, int]:
+        try:
+            return coordinate_to_tuple(cell)
+        except ValueError:
+            return (0, 0)
+
+    return [
+        ExcelCellInputData(sheet=sheet_title, cell=cell, value=data.value, metadata=data.metadata)
+        for cell, data in sorted(merged.items(), key=lambda item: order(item[0]))
+    ]
+
+
+async def aextract_inputs(
+        llm: BaseChatModel,
+        sheet: Worksheet,
+        max_tokens: int = DEFAULT_TILE_TOKENS,
+        max_concurrency: int = 4,
+    ) -> List[ExcelCellInputData]:
+    """シートをタイルに分けて並行に抽出し、セル番地でまとめる"""
+    tiles = sheet_tiles(sheet, max_tokens)
+    logger.info(f"extracting inputs from {sheet.title}: {len(tiles)} tiles")
     chain = extract_inputs_prompt | llm.with_structured_output(_ExcelCellInputDatas)
-    result: _ExcelCellInputDatas = chain.invoke({"html_table": html_output}, config={"callbacks": [CallbackHandler()]})  # type: ignore
-
-    inputs = []
-    for data in result.inputs:
-        logger.debug(data.model_dump_json(indent=2, exclude_none=True))
-        inputs.append(ExcelCellInputData(
-            sheet=sheet.title,
-            cell=data.cell,
-            value=data.value,
-            metadata=data.metadata
-        ))
-
-    return inputs
+    results: list[_ExcelCellInputDatas] = await chain.abatch(  # type: ignore
+        [{"html_table": tile} for tile in tiles],
+        config={"callbacks": [CallbackHandler()], "max_concurrency": max_concurrency},
+    )
+    return _merge(sheet.title, results)
+
+
+def extract_inputs(
+        llm: BaseChatModel,
+        sheet: Worksheet,
+        max_tokens: int = DEFAULT_TILE_TOKENS,
+        max_concurrency: int = 4,
+    ) -> List[ExcelCellInputData]:
+    return asyncio.run(aextract_inputs(llm, sheet, max_tokens, max_concurrency))
@@ -0,0 +1,156 @@
+'''
+照合済みセルのマニフェストによる差分照合
+
+実行ごとに、照合したセルの番地・値・metadata・出典文書のハッシュ・結果をマニフェスト(JSON)に書く。
+次の実行では今の入力とマニフェストを比べ、以下だけを照合し直す。それ以外の結果は引き継ぐ。
+- 追加されたセル、値か metadata が変わったセル
+- 出典文書が変わったセル（一致したセルはその出典、一致しなかったセルはすべての出典）
+'''
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import BaseModel
+
+from pathlib import Path
+from typing import Optional, Sequence
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+from .formula_graph import CellKey
+from .matching import amatch, input_key, is_verified
+from .models import ExcelCellInputData, MatchingResult
+from .verdict_cache import normalize_metadata, normalize_value
+
+
+MANIFEST_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedCell(BaseModel):
+    sheet: str
+    cell: str
+    value: str
+    metadata: list[str]
+    source_hashes: dict[str, str]
+    result: MatchingResult
+
+
+class VerificationManifest(BaseModel):
+    version: int = MANIFEST_VERSION
+    cells: list[VerifiedCell] = []
+
+
+def source_hashes(analyzed_markdown_paths: list[Path]) -> dict[str, str]:
+    # PDF が変われば解析結果（markdown）も変わる。キーは MatchingResult.source_path と同じ表記
+    return {str(path): hashlib.sha256(path.read_bytes()).hexdigest() for path in analyzed_markdown_paths}
+
+
+def load_manifest(path: Path) -> Optional[VerificationManifest]:
+    if not path.exists():
+        return None
+    manifest = VerificationManifest.model_validate_json(path.read_text(encoding="utf-8"))
+    if manifest.version != MANIFEST_VERSION:
+        logger.warning(f"ignoring manifest with unknown version {manifest.version}: {path}")
+        return None
+    return manifest
+
+
+def save_manifest(path: Path, manifest: VerificationManifest):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    tmp.write_text(manifest.model_dump_json(indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _depends_on(entry: VerifiedCell) -> list[str]:
+    if entry.result.match and entry.result.source_path in entry.source_hashes:
+        return [entry.result.source_path]  # type: ignore
+    return list(entry.source_hashes)
+
+
+def diff_inputs(
+        inputs: list[ExcelCellInputData],
+        manifest: Optional[VerificationManifest],
+        current_hashes: dict[str, str],
+    ) -> tuple[list[ExcelCellInputData], dict[CellKey, MatchingResult]]:
+    """
+    照合し直す入力と、引き継ぐ結果（(シート, cell) → MatchingResult）に分ける。
+    """
+    previous = {(entry.sheet, entry.cell): entry for entry in manifest.cells} if manifest else {}
+    to_verify: list[ExcelCellInputData] = []
+    carried: dict[CellKey, MatchingResult] = {}
+    for inp in inputs:
+        entry = previous.get(input_key(inp))
+        if (
+            entry is None
+            or entry.value != normalize_value(inp.value)
+            or entry.metadata != normalize_metadata(inp.metadata)
+            or set(entry.source_hashes) != set(current_hashes)
+            or any(entry.source_hashes[source] != current_hashes[source] for source in _depends_on(entry))
+        ):
+            to_verify.append(inp)
+        else:
+            carried[input_key(inp)] = entry.result
+    return to_verify, carried
+
+
+def build_manifest(
+        inputs: list[ExcelCellInputData],
+        results: list[MatchingResult],
+        current_hashes: dict[str, str],
+    ) -> VerificationManifest:
+    return VerificationManifest(cells=[
+        VerifiedCell(
+            sheet=inp.sheet,
+            cell=inp.cell,
+            value=normalize_value(inp.value),
+            metadata=normalize_metadata(inp.metadata),
+            source_hashes=current_hashes,
+            result=result,
+        )
+        for inp, result in zip(inputs, results)
+        if is_verified(result)
+    ])
+
+
+async def amatch_incremental(
+        llm: BaseChatModel,
+        inputs: Sequence[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        manifest_path: Path,
+        analyzed_json_paths: Optional[list[Path]] = None,
+        **match_kwargs,
+    ) -> list[MatchingResult]:
+    """
+    マニフェストとの差分だけを amatch で照合し、変わっていないセルの結果は引き継ぐ。
+    結果は inputs と同じ順に返し、マニフェストを更新する。
+    """
+    inputs = list(inputs)  # 列指向の表（cell_table.py）なら、要素のモデルをここで一度だけ作る
+    current_hashes = source_hashes(analyzed_markdown_paths)
+    to_verify, carried = diff_inputs(inputs, load_manifest(manifest_path), current_hashes)
+    logger.info(f"incremental matching: {len(to_verify)} to verify, {len(carried)} carried forward")
+
+    results = dict(carried)
+    if to_verify:
+        verified = await amatch(llm, to_verify, analyzed_markdown_paths, analyzed_json_paths, **match_kwargs)
+        results.update((input_key(inp), res) for inp, res in zip(to_verify, verified))
+
+    ordered = [results[input_key(inp)] for inp in inputs]
+    save_manifest(manifest_path, build_manifest(inputs, ordered, current_hashes))
+    return ordered
+
+
+def match_incremental(
+        llm: BaseChatModel,
+        inputs: Sequence[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        manifest_path: Path,
+        analyzed_json_paths: Optional[list[Path]] = None,
+        **match_kwargs,
+    ) -> list[MatchingResult]:
+    """amatch_incremental の同期版"""
+    return asyncio.run(amatch_incremental(
+        llm, inputs, analyzed_markdown_paths, manifest_path, analyzed_json_paths, **match_kwargs
+    ))
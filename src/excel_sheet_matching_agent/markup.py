@@ -6,94 +6,184 @@ import fitz
 from openpyxl import load_workbook
 from openpyxl.worksheet.worksheet import Worksheet
 
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional
+from collections import defaultdict
+from typing import Literal, NamedTuple, Optional, Sequence
 import json
 import logging
 import csv
+import os
+import uuid
 
+from . import instrumentation
 from .models import MatchingResult, ExcelCellInputData
+from .layout_store import LayoutStore, open_layout
+from .text_index import TextIndex
 
 
 MARK_SYMBOLS = "あいうえお"
 
+SaveMode = Literal["incremental", "overlay"]
+
 logger = logging.getLogger(__name__)
 
+
+def mark_labels(n: int, symbols: str = MARK_SYMBOLS) -> list[str]:
+    """
+    n 個のラベル。symbols の文字を桁にした連番（あ, い, …, お, ああ, あい, …）なので、件数に上限はない。
+    """
+    assert symbols
+    labels = []
+    for i in range(n):
+        label = ""
+        i += 1
+        while i:
+            i, r = divmod(i - 1, len(symbols))
+            label = symbols[r] + label
+        labels.append(label)
+    return labels
+
+
+def cell_labels(inputs: Sequence[ExcelCellInputData]) -> list[str]:
+    """シート!セル のラベル"""
+    return [f"{inp.sheet}!{inp.cell}" for inp in inputs]
+
+
+def _run_now(fn, *args) -> Future:
+    future: Future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+class Marker(NamedTuple):
+    page: int  # 0 始まり
+    point: tuple[float, float]
+    label: str
+    font_size: float
+
+
+def _write_incremental(doc: fitz.Document, output_pdf_path: Path):
+    """
+    開いている元PDFの後ろに変更だけを追記したものを output_pdf_path に書く（saveIncr と同じ中身）。
+    先にコピーを作って開き直さずに、元PDFから 1 回で書き出す。
+    """
+    tmp = output_pdf_path.with_name(f".{output_pdf_path.name}.{uuid.uuid4().hex}")
+    options = fitz.mupdf.PdfWriteOptions()
+    options.do_incremental = 1
+    out = fitz.mupdf.FzOutput(str(tmp), 0)
+    try:
+        fitz.mupdf.pdf_write_document(fitz.mupdf.pdf_document_from_fz_document(doc.this), out, options)
+    finally:
+        out.fz_close_output()
+    os.replace(tmp, output_pdf_path)
+
+
+def write_markers(source_pdf_path: Path, output_pdf_path: Path, markers: list[Marker], save_mode: SaveMode = "incremental"):
+    """
+    マーカーをページごとにまとめて書き込む（各ページは 1 回だけ開く）。
+    - incremental: 元PDFの後ろに、変更したページだけを追記する（全体を書き直さない）
+    - overlay: 元PDFと同じ大きさのページにマーカーだけを書いた、重ねて表示する用のPDFを作る
+    """
+    by_page: dict[int, list[Marker]] = defaultdict(list)
+    for marker in markers:
+        by_page[marker.page].append(marker)
+
+    output_pdf_path.parent.mkdir(parents=True, exist_ok=True)
+    if save_mode == "overlay":
+        src = fitz.open(source_pdf_path)
+        doc = fitz.open()
+        for page in src:
+            doc.new_page(width=page.rect.width, height=page.rect.height)
+        src.close()
+    else:
+        doc = fitz.open(source_pdf_path)
+
+    for page_index, page_markers in sorted(by_page.items()):
+        page = doc[page_index]
+        for marker in page_markers:
+            page.insert_text(  # type: ignore
+                marker.point,
+                marker.label,
+                fontsize=marker.font_size,
+                fontname="japan",
+                color=(1, 0, 0)
+            )
+
+    logger.info(f"writing: {output_pdf_path} ({len(markers)} markers on {len(by_page)} pages)")
+    if save_mode == "overlay":
+        doc.save(output_pdf_path, garbage=3, deflate=True)
+    elif doc.can_save_incrementally():
+        _write_incremental(doc, output_pdf_path)
+    else:
+        # 修復が必要なPDFなどは追記できないので書き直す
+        logger.warning(f"cannot save incrementally, rewriting: {output_pdf_path}")
+        tmp = output_pdf_path.with_name(f".{output_pdf_path.name}.{uuid.uuid4().hex}")
+        doc.save(tmp)
+        doc.close()
+        os.replace(tmp, output_pdf_path)
+        return
+    doc.close()
+
 def load_prebuild_layout_result(json_path: Path) -> AnalyzeResult:
     with json_path.open(encoding='utf-8') as f:
         return AnalyzeResult(json.load(f))
 
+@instrumentation.timed("markup.source_pdf")
 def markup_source_pdf(
     source_pdf_path: Path,
     output_pdf_path: Path,
     results: list[MatchingResult],
-    prebuilt_layout_result: AnalyzeResult,
-    symbols: str,
+    prebuilt_layout_result: AnalyzeResult | LayoutStore,
+    symbols: Sequence[str],
+    save_mode: SaveMode = "incremental",
+    analyzed_path: Optional[Path] = None,
 ) -> list[int]:
-    doc = fitz.open(source_pdf_path)
+    """
+    analyzed_path（この出典の解析結果の markdown か json）を渡すと、
+    source_path が別の出典を指す結果（別の出典で一致したセル）はこの出典にはマークしない。
+    """
+    def here(res: MatchingResult) -> bool:
+        # 解析結果の markdown と json は拡張子だけが違う
+        return analyzed_path is None or res.source_path is None or Path(res.source_path).stem == analyzed_path.stem
+
+    # 全 matched_text を 1 回の走査でまとめて探す
+    index = TextIndex(prebuilt_layout_result)
+    occurrences = index.find_all(res.matched_text for res in results if res.match and res.matched_text and here(res))
 
     page_numbers = []
+    markers = []
     for res, symbol in zip(results, symbols):
-        if not res.match or not res.matched_text:
+        if not res.match or not res.matched_text or not here(res):
             page_numbers.append(0)
             continue
 
-        # 1. 行単位で候補行を探す
-        candidate = None
-        for page in prebuilt_layout_result.pages:
-            for line in page.lines or []:
-                if res.matched_text in line.content:
-                    candidate = (page, line)
-                    break
-            if candidate:
-                break
-
-        if candidate is None:
-            logger.warning(f"no line candidate for: {res.cell}")
+        # 1. 一致箇所を探す（LLM がページを返していればそのページを優先）
+        found = occurrences[res.matched_text]
+        found = [occ for occ in found if occ.page_number == res.page] or found
+        if not found:
+            logger.warning(f"no text candidate for: {res.cell}")
             page_numbers.append(0)
             continue
 
-        page_obj, line = candidate
-        page = doc[page_obj.page_number - 1]
-        page_numbers.append(page_obj.page_number)
-
-        # 2. 文字単位ポリゴンの結合
-        xs0, ys0, xs1, ys1 = [], [], [], []
-        for word in page_obj.words or []:
-            if word.content in res.matched_text:
-                poly = word.polygon
-                xs = poly[0::2]; ys = poly[1::2]  # type: ignore
-                xs0.append(min(xs)); ys0.append(min(ys))
-                xs1.append(max(xs)); ys1.append(max(ys))
-
-        if xs0:
-            # 文字単位矩形取得
-            x0, y0 = min(xs0), min(ys0)
-            x1, y1 = max(xs1), max(ys1)
-        else:
-            # フォールバック：行ポリゴン中央
-            poly = line.polygon
-            px = [(poly[i] + poly[i+2])/2 for i in range(0, 8, 2)]  # type: ignore
-            py = [(poly[i+1] + poly[i+3])/2 for i in range(0, 8, 2)]  # type: ignore
-            x0, y0 = sum(px)/4, sum(py)/4
-            x1, y1 = x0 + 10, y0 + 10  # small marker
+        occurrence = found[0]
+        page_numbers.append(occurrence.page_number)
+
+        # 2. 一致箇所を覆う単語のポリゴンの結合
+        bbox = index.bbox(occurrence)
+        if bbox is None:
+            logger.warning(f"no word polygon for: {res.cell}")
+            continue
+        x0, y0, x1, y1 = bbox
 
         # 3. PDF 座標系への変換（inch→pt）
         # Azure: inch 単位。fitz は pt(1pt=1/72in)
         rect = fitz.Rect(x0*72, y0*72, x1*72, y1*72)
-        font_size = rect.height * 0.8
-
-        # 4. マーカー挿入
-        page.insert_text(  # type: ignore
-            (rect.x0, rect.y0),
-            symbol,
-            fontsize=font_size,
-            fontname="japan",
-            color=(1, 0, 0)
-        )
+        markers.append(Marker(occurrence.page_number - 1, (rect.x0, rect.y0), symbol, rect.height * 0.8))
 
-    logger.info(f"writing: {output_pdf_path}")
-    doc.save(output_pdf_path)
+    # 4. マーカー挿入（ページごとにまとめて）
+    write_markers(source_pdf_path, output_pdf_path, markers, save_mode)
     return page_numbers
 
 def _normalize_num_str(s: str) -> str:
@@ -105,75 +195,181 @@ def _normalize_num_str(s: str) -> str:
         return str(int(f))
     return str(f)
 
-def _find_pdf_bbox_for_cell(page, ws: Worksheet, cell: str) -> Optional[tuple[float, float, float, float]]:
+class WordBox(NamedTuple):
+    page: int  # 0 始まり
+    bbox: tuple[float, float, float, float]
+
+
+def build_value_index(doc: fitz.Document) -> dict[str, list[WordBox]]:
+    """全ページの単語を 1 回ずつ取り出し、正規化した文字列 → 出現位置（ページ順・読み順）の索引にする"""
+    index: dict[str, list[WordBox]] = defaultdict(list)
+    for page in doc:
+        for x0, y0, x1, y1, text, *_ in page.get_text("words"):
+            index[_normalize_num_str(text)].append(WordBox(page.number, (x0, y0, x1, y1)))  # type: ignore
+    return index
+
+
+class _Spans:
+    """1 ページ上の単語の区間（y か x）を始点の順に並べたもの。区間の重なる単語を二分探索で探す"""
+    def __init__(self, spans: list[tuple[float, float, WordBox]]):
+        self.spans = sorted(spans)
+        self.starts = [start for start, _, _ in self.spans]
+        self.longest = max((end - start for start, end, _ in self.spans), default=0.0)
+
+    def overlaps(self, start: float, end: float, exclude: WordBox) -> bool:
+        # 重なる区間の始点は (start - longest, end) にある
+        lo = bisect_right(self.starts, start - self.longest)
+        hi = bisect_left(self.starts, end)
+        return any(other_end > start and box != exclude for _, other_end, box in self.spans[lo:hi])
+
+
+class _AlignmentIndex:
+    """値の索引（build_value_index）から、値ごと・ページごとの行（y）・列（x）の区間を必要になったときに作って持つ"""
+    def __init__(self, index: dict[str, list[WordBox]]):
+        self.index = index
+        self._rows: dict[str, dict[int, _Spans]] = {}
+        self._columns: dict[str, dict[int, _Spans]] = {}
+
+    def _spans(self, text: str, axis: int) -> dict[int, _Spans]:
+        cache = self._rows if axis == 1 else self._columns
+        if text not in cache:
+            by_page: dict[int, list[tuple[float, float, WordBox]]] = defaultdict(list)
+            for box in self.index.get(text, []):
+                by_page[box.page].append((box.bbox[axis], box.bbox[axis + 2], box))
+            cache[text] = {page: _Spans(spans) for page, spans in by_page.items()}
+        return cache[text]
+
+    def in_row(self, text: str, box: WordBox) -> bool:
+        """box と同じ行（y が重なる）に text があるか"""
+        spans = self._spans(text, 1).get(box.page)
+        return spans is not None and spans.overlaps(box.bbox[1], box.bbox[3], box)
+
+    def in_column(self, text: str, box: WordBox) -> bool:
+        """box と同じ列（x が重なる）に text があるか"""
+        spans = self._spans(text, 0).get(box.page)
+        return spans is not None and spans.overlaps(box.bbox[0], box.bbox[2], box)
+
+
+def _neighbour_texts(ws: Worksheet, cell: str, radius: int) -> tuple[list[str], list[str]]:
+    """同じ行・同じ列の近くのセルの値（正規化済み）"""
+    row, col = ws[cell].row, ws[cell].column
+    row_texts = [ws.cell(row, c).value for c in range(max(1, col - radius), col + radius + 1) if c != col]
+    col_texts = [ws.cell(r, col).value for r in range(max(1, row - radius), row + radius + 1) if r != row]
+    return (
+        [_normalize_num_str(str(v)) for v in row_texts if v is not None],
+        [_normalize_num_str(str(v)) for v in col_texts if v is not None],
+    )
+
+
+def _find_pdf_bbox_for_cell(
+        alignment: _AlignmentIndex,
+        ws: Worksheet,
+        cell: str,
+        used: set[WordBox],
+        radius: int = 3,
+    ) -> Optional[WordBox]:
     """
-    PDFページ上で target_text と完全一致するテキストスパンを探し、
-    その bbox を返す。見つからなければ None。
+    セルの値と一致する単語の位置を返す。見つからなければ None。
+    同じ値が複数あれば、同じ行のセルの値が横に・同じ列のセルの値が縦に並んでいる出現を選ぶ。
     """
     raw = ws[cell].value
     if raw is None:
         return None
-    target_norm = _normalize_num_str(str(raw))
+    candidates = alignment.index.get(_normalize_num_str(str(raw)), [])
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else None
 
-    words = page.get_text("words")
-    for x0, y0, x1, y1, text, *_ in words:
-        if _normalize_num_str(text) == target_norm:
-            return (x0, y0, x1, y1)
-    return None
+    row_texts, col_texts = _neighbour_texts(ws, cell, radius)
 
+    def score(box: WordBox) -> tuple[int, bool]:
+        aligned = (
+            sum(alignment.in_row(text, box) for text in row_texts)
+            + sum(alignment.in_column(text, box) for text in col_texts)
+        )
+        return aligned, box not in used
+
+    return max(candidates, key=score)
+
+@instrumentation.timed("markup.excel_pdf")
 def markup_excel_pdf(
     excel_path: Path,
     source_pdf_path: Path,
     output_pdf_path: Path,
-    inputs: list[ExcelCellInputData],
+    inputs: Sequence[ExcelCellInputData],
     matches: list[bool],
-    mark_symbols: str
+    mark_symbols: Sequence[str],
+    save_mode: SaveMode = "incremental",
 ):
     assert len(inputs) == len(matches)
-    # Excel読み込み
+    # Excel読み込み（セルは入力のシートから引く。アクティブなシートとは限らない）
     wb = load_workbook(excel_path)
-    ws = wb.active
-    assert ws is not None
 
-    # PDF読み込み
+    # PDF読み込み（全ページの単語を 1 回だけ取り出す）
     doc = fitz.open(source_pdf_path)
-    page = doc[0]  # TODO p.1
+    alignment = _AlignmentIndex(build_value_index(doc))
+    doc.close()
 
+    used: set[WordBox] = set()
+    markers = []
     for inp, match, symbol in zip(inputs, matches, mark_symbols):
         if not match:
             continue
         cell = inp.cell
-        bbox = _find_pdf_bbox_for_cell(page, ws, cell)
-        if not bbox:
+        box = _find_pdf_bbox_for_cell(alignment, wb[inp.sheet], cell, used)
+        if not box:
             logger.warning(f"{cell} が見つかりません")
             continue
-        _, _, x1, y1 = bbox
+        used.add(box)
+        _, _, x1, y1 = box.bbox
+        markers.append(Marker(box.page, (x1 + 2, y1 - 2), symbol, 12))
 
-        # テキスト挿入
-        page.insert_text(  # type: ignore
-            fitz.Point(x1 + 2, y1 - 2),
-            symbol,
-            fontsize=12,
-            fontname="japan",
-            color=(1, 0, 0)
-         ) # :contentReference[oaicite:6]{index=6}
+    # テキスト挿入（ページごとにまとめて）・保存
+    write_markers(source_pdf_path, output_pdf_path, markers, save_mode)
 
-    # 保存
-    logger.info(f"writing: {output_pdf_path}")
-    doc.save(output_pdf_path)
+def markup_source_json(
+        source_pdf: Path,
+        prebuild_layout_json: Path,
+        output_pdf_path: Path,
+        matching_results: list[MatchingResult],
+        labels: list[str],
+        save_mode: SaveMode = "incremental",
+    ) -> list[int]:
+    """解析結果の json から markup_source_pdf を呼ぶ（別プロセスにも渡せるようにパスだけを受け取る）"""
+    # json 全体は読まずに、列指向の保存形式を mmap で開く
+    prebuilt_layout_result = open_layout(prebuild_layout_json)
+    try:
+        return markup_source_pdf(
+            source_pdf, output_pdf_path, matching_results, prebuilt_layout_result, labels, save_mode, prebuild_layout_json
+        )
+    finally:
+        prebuilt_layout_result.close()
 
+@instrumentation.timed("markup")
 def markup(
         excel_path: Path,
         excel_pdf_path: Path,
-        inputs: list[ExcelCellInputData],
+        inputs: Sequence[ExcelCellInputData],
         matching_results: list[MatchingResult],
         source_pdfs: list[Path],
         prebuilt_layout_result_jsons: list[Path],
-        mark_symbols: str = MARK_SYMBOLS
+        mark_symbols: str = MARK_SYMBOLS,
+        output_dir: Optional[Path] = None,
+        labels: Optional[list[str]] = None,
+        save_mode: SaveMode = "incremental",
+        max_workers: Optional[int] = None,
     ):
+    """
+    output_dir を指定すると、マークアップしたPDFと照合結果のCSVを元ファイルの隣ではなく output_dir に書く
+    （複数のジョブが同じ出典PDFを使うときに、出力を取り合わないように）。
+    labels を省略すると mark_symbols の文字の連番をラベルにする（cell_labels(inputs) なら シート!セル）。
+    save_mode="overlay" なら `{stem}_markup.pdf` の代わりにマーカーだけの `{stem}_overlay.pdf` を書く。
+    Excel印刷PDFと各出典PDFは、最大 max_workers プロセスで並列にマークアップする（1 なら順に実行）。
+    並列のときは、計測（instrumentation）には markup 全体の時間だけが残る。
+    """
     assert len(source_pdfs) == len(prebuilt_layout_result_jsons)
     assert len(inputs) == len(matching_results)
-    assert len(MARK_SYMBOLS) > len(inputs)
+    labels = labels if labels is not None else mark_labels(len(inputs), mark_symbols)
+    assert len(labels) == len(inputs)
     assert excel_path.exists()
     assert excel_pdf_path.exists()
     for source_pdf in source_pdfs:
@@ -181,29 +377,56 @@ def markup(
     for prebuilt_layout_result_json in prebuilt_layout_result_jsons:
         assert prebuilt_layout_result_json.exists()
 
-    # Excel
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    suffix = "_overlay.pdf" if save_mode == "overlay" else "_markup.pdf"
+
+    def output_path(pdf: Path) -> Path:
+        return (output_dir or pdf.parent) / f"{pdf.stem}{suffix}"
+
     matches = [match.match for match in matching_results]
-    excel_pdf_markup_path = excel_pdf_path.parent / f"{excel_pdf_path.stem}_markup.pdf"
-    markup_excel_pdf(excel_path, excel_pdf_path, excel_pdf_markup_path, inputs, matches, mark_symbols)
-
-    # Source
-    source_pages = [("", 0)]*len(inputs)
-    for source_pdf, prebuild_layout_json in zip(source_pdfs, prebuilt_layout_result_jsons):
-        source_pdf_markup_path = source_pdf.parent / f"{source_pdf.stem}_markup.pdf"
-        prebuilt_layout_result = load_prebuild_layout_result(prebuild_layout_json)
-        pages = markup_source_pdf(source_pdf, source_pdf_markup_path, matching_results, prebuilt_layout_result, mark_symbols)
-        for i, page in enumerate(pages):
-            if page == 0:
-                continue
-            source_pages[i] = (source_pdf.stem, page)
+    workers = max_workers or min(len(source_pdfs) + 1, os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    submit = executor.submit if executor else _run_now
+    try:
+        # Excel
+        excel_future = submit(
+            markup_excel_pdf, excel_path, excel_pdf_path, output_path(excel_pdf_path), inputs, matches, labels, save_mode
+        )
+        # Source
+        source_futures = [
+            submit(markup_source_json, source_pdf, prebuild_layout_json, output_path(source_pdf), matching_results, labels, save_mode)
+            for source_pdf, prebuild_layout_json in zip(source_pdfs, prebuilt_layout_result_jsons)
+        ]
+        excel_future.result()
+        source_pages = [("", 0)]*len(inputs)
+        for source_pdf, future in zip(source_pdfs, source_futures):
+            for i, page in enumerate(future.result()):
+                if page == 0:
+                    continue
+                source_pages[i] = (source_pdf.stem, page)
+    finally:
+        if executor:
+            executor.shutdown()
 
     # Summarize in csv
-    matching_log_csv = excel_path.parent / f"{excel_path.stem}_matching.csv"
-    with matching_log_csv.open("w", newline="", encoding="utf-8") as f:
+    write_matching_csv(
+        (output_dir or excel_path.parent) / f"{excel_path.stem}_matching.csv", inputs, matching_results, source_pages, labels
+    )
+
+def write_matching_csv(
+        path: Path,
+        inputs: Sequence[ExcelCellInputData],
+        matching_results: list[MatchingResult],
+        source_pages: list[tuple[str, int]],
+        labels: list[str],
+    ):
+    """照合結果のCSV。source_pages は入力ごとの（出典PDFの stem, ページ番号）"""
+    with path.open("w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         # ヘッダ
-        writer.writerow(["cell", "value", "match", "source", "page_no" "reason", "symbol"])
-        for inp, source_page, matching_result, symbol in zip(inputs, source_pages, matching_results, mark_symbols):
+        writer.writerow(["cell", "value", "match", "source", "page_no", "reason", "symbol"])
+        for inp, source_page, matching_result, symbol in zip(inputs, source_pages, matching_results, labels):
             writer.writerow([
                 inp.cell,
                 inp.value,
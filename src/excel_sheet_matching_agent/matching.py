@@ -1,32 +1,445 @@
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from pydantic import BaseModel
 
-from typing import List
+from typing import List, Optional, Sequence
 from pathlib import Path
+import asyncio
+import logging
+import time
 
 from .prompts import matching_prompt
 from .models import ExcelCellInputData, MatchingBatchResult, MatchingResult
+from . import instrumentation
+from .formula_graph import CellKey, DependencyGraph, cell_key
+from .index_cache import IndexCache
+from .prematch import prematch
+from .retrieval import Chunk, build_index, find_chunk
+from .tokens import estimate_tokens
+from .verdict_cache import VerdictCache, document_hash, model_id, prompt_hash
 
 
-def batch_verify_inputs_with_llm(verify_chain, inputs: List[ExcelCellInputData], document_text: str) -> list[MatchingResult]:
+DEFAULT_TOP_K = 5
+# LLM から結果が得られなかったセルの reason（キャッシュしない）
+NO_RESULT_REASON = "No result was returned for this cell."
+FAILED_REASON = "LLM verification failed"
+# targets の計算に使われないので照合しなかったセルの reason（キャッシュしない）
+SKIPPED_REASON = "Skipped: this cell does not feed any target output."
+
+logger = logging.getLogger(__name__)
+
+
+class BatchConfig(BaseModel):
+    """LLM への問い合わせの分割・並列度"""
+    max_tokens: int = 8000          # 1回の問い合わせに入れる文書+入力のトークン数（概算）
+    max_inputs: int = 40            # 1回の問い合わせに入れる入力セル数
+    max_concurrency: int = 4
+    requests_per_second: Optional[float] = None
+    max_retries: int = 2
+
+
+def is_verified(result: MatchingResult) -> bool:
+    """LLM（または事前照合）で実際に判定できた結果か"""
+    return result.reason not in (NO_RESULT_REASON, SKIPPED_REASON) and not result.reason.startswith(FAILED_REASON)
+
+
+def input_key(inp: ExcelCellInputData) -> CellKey:
+    """結果を突き合わせるキー（別のシートに同じ番地があるので、番地だけでは足りない）"""
+    return (inp.sheet, inp.cell)
+
+
+def resolve_targets(inputs: Sequence[ExcelCellInputData], targets: Sequence[str | CellKey]) -> list[CellKey]:
+    """targets（"シート!B10" や "B10"）を (シート, セル) にする。シートを省いたものは inputs の最初のセルのシート"""
+    sheet = inputs[0].sheet if len(inputs) else ""
+    return [target if isinstance(target, tuple) else cell_key(target, sheet) for target in targets]
+
+
+def relevant_inputs(
+        graph: DependencyGraph,
+        inputs: List[ExcelCellInputData],
+        targets: Sequence[str | CellKey],
+    ) -> List[ExcelCellInputData]:
+    """targets の計算に（推移的に）使われる入力セル"""
+    precedents = graph.transitive_precedents(resolve_targets(inputs, targets))
+    return [inp for inp in inputs if (inp.sheet, inp.cell) in precedents]
+
+
+def impacted_outputs(
+        graph: DependencyGraph,
+        inputs: List[ExcelCellInputData],
+        results: list[MatchingResult],
+        targets: Sequence[str | CellKey],
+    ) -> dict[str, list[str]]:
+    """
+    一致しなかった入力セル（"シート!セル"）ごとに、その値を使っている targets。
+    シートを省いた targets は inputs の最初のセルのシートとみなすので、inputs の一部を渡すときは resolve_targets で解決したものを渡す。
+    """
+    target_keys = resolve_targets(inputs, targets)
+    mismatched = [(inp.sheet, inp.cell) for inp, res in zip(inputs, results) if not res.match and is_verified(res)]
+    return {
+        f"{key[0]}!{key[1]}": [f"{t[0]}!{t[1]}" for t in outputs]
+        for key, outputs in graph.impacted(mismatched, target_keys).items()
+        if outputs
+    }
+
+
+def _chunk_to_text(chunk: Chunk) -> str:
+    return f"[chunk {chunk.id}] source_path: {chunk.source_path}, page: {chunk.page}\n{chunk.text}"
+
+
+def _chunks_to_text(contexts: list[list[Chunk]]) -> str:
+    # 入力セルの候補チャンクを重複なしで並べる
+    seen: dict[int, Chunk] = {}
+    for chunks in contexts:
+        for chunk in chunks:
+            seen.setdefault(chunk.id, chunk)
+    return "\n\n".join(_chunk_to_text(chunk) for chunk in sorted(seen.values(), key=lambda c: c.id))
+
+
+def _describe_input(item: ExcelCellInputData, chunks: Optional[list[Chunk]] = None) -> str:
+    hint = ", ".join([v for v in item.metadata if v])
+    description = f"- Cell: {item.cell}\n  Value: {item.value}\n  Hint: {hint}"
+    if chunks is not None:
+        description += "\n  Candidates: " + ", ".join(f"chunk {chunk.id}" for chunk in chunks)
+    return description
+
+
+def _prompt_values(
+        inputs: List[ExcelCellInputData],
+        document_text: str,
+        contexts: Optional[list[list[Chunk]]],
+    ) -> dict[str, str]:
+    if contexts is not None:
+        assert len(contexts) == len(inputs)
+        document_text = _chunks_to_text(contexts)
     # Excelセル情報をプレーンテキスト化して渡す
-    input_descriptions = []
-    for item in inputs:
-        hint = ", ".join([v for v in item.metadata.values() if v])
-        input_descriptions.append(f"- Cell: {item.cell}\n  Value: {item.value}\n  Hint: {hint}")
-    
-    result = verify_chain.invoke({
+    input_descriptions = [
+        _describe_input(item, contexts[i] if contexts is not None else None)
+        for i, item in enumerate(inputs)
+    ]
+    return {
         "document_text": document_text,
         "excel_inputs": "\n".join(input_descriptions)
-    })
-    return result.results # type: ignore
-
-def match(llm: BaseChatModel, inputs: List[ExcelCellInputData], analyzed_markdown_paths: list[Path]) -> list[MatchingResult]:
-    document_text = ""
-    for i, markdown_path in enumerate(analyzed_markdown_paths):
-        with markdown_path.open() as f:
-            document_text = f"### Doucment #{i+1}\n"
-            document_text = f"source_path: {markdown_path}\n"
-            document_text += f.read()
-            document_text += "\n\n"
+    }
+
+
+def _fill_sources(
+        results: list[MatchingResult],
+        inputs: List[ExcelCellInputData],
+        contexts: Optional[list[list[Chunk]]],
+    ) -> list[MatchingResult]:
+    if contexts is None:
+        return results
+    # matched_text を含むチャンクから出典のパスとページを埋める
+    contexts_by_cell = {item.cell: chunks for item, chunks in zip(inputs, contexts)}
+    for res in results:
+        if not res.match or not res.matched_text:
+            continue
+        chunk = find_chunk(contexts_by_cell.get(res.cell, []), res.matched_text)
+        if chunk is not None:
+            res.source_path = chunk.source_path
+            res.page = chunk.page
+    return results
+
+
+def batch_verify_inputs_with_llm(
+        verify_chain,
+        inputs: List[ExcelCellInputData],
+        document_text: str = "",
+        contexts: Optional[list[list[Chunk]]] = None,
+    ) -> list[MatchingResult]:
+    """
+    contexts を渡すと、document_text の代わりに入力セルごとの候補チャンクだけを LLM に渡す。
+    """
+    result = verify_chain.invoke(_prompt_values(inputs, document_text, contexts))
+    return _fill_sources(result.results, inputs, contexts)  # type: ignore
+
+
+async def abatch_verify_inputs_with_llm(
+        verify_chain,
+        inputs: List[ExcelCellInputData],
+        document_text: str = "",
+        contexts: Optional[list[list[Chunk]]] = None,
+    ) -> list[MatchingResult]:
+    started = time.perf_counter()
+    result = await verify_chain.ainvoke(_prompt_values(inputs, document_text, contexts), config=instrumentation.llm_config())
+    instrumentation.observe("llm_batch_seconds", time.perf_counter() - started)
+    return _fill_sources(result.results, inputs, contexts)  # type: ignore
+
+
+def split_batches(
+        inputs: List[ExcelCellInputData],
+        contexts: Optional[list[list[Chunk]]],
+        config: BatchConfig,
+        document_text: str = "",
+    ) -> list[list[int]]:
+    """
+    入力セルの番号を、トークン数・セル数の上限に収まるように分ける。
+    候補チャンクは同じバッチ内で共有されるので、新しく増える分だけ数える。
+    LLM の結果はセル番地（シート名なし）で返るので、別のシートの同じ番地は同じバッチに入れない。
+    文書全体が単独で上限を超えるときは、分けても各バッチに同じ文書が載るだけなので、セルの分だけで数える。
+    """
+    base_tokens = estimate_tokens(document_text) if contexts is None else 0
+    if base_tokens >= config.max_tokens:
+        logger.warning(f"document alone exceeds max_tokens ({base_tokens} >= {config.max_tokens}); batching by inputs only")
+        base_tokens = 0
+
+    def cost(i: int, seen: set[int]) -> int:
+        if contexts is None:
+            return estimate_tokens(_describe_input(inputs[i]))
+        return estimate_tokens(_describe_input(inputs[i], contexts[i])) + sum(
+            estimate_tokens(_chunk_to_text(chunk)) for chunk in contexts[i] if chunk.id not in seen
+        )
+
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    tokens = base_tokens
+    seen: set[int] = set()
+    cells: set[str] = set()
+    for i in range(len(inputs)):
+        c = cost(i, seen)
+        if batch and (tokens + c > config.max_tokens or len(batch) >= config.max_inputs or inputs[i].cell in cells):
+            batches.append(batch)
+            batch, tokens, seen, cells = [], base_tokens, set(), set()
+            c = cost(i, seen)
+        batch.append(i)
+        cells.add(inputs[i].cell)
+        tokens += c
+        if contexts is not None:
+            seen.update(chunk.id for chunk in contexts[i])
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def averify_in_batches(
+        verify_chain,
+        inputs: List[ExcelCellInputData],
+        document_text: str = "",
+        contexts: Optional[list[list[Chunk]]] = None,
+        config: Optional[BatchConfig] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+    ) -> list[MatchingResult]:
+    """
+    入力をトークン数で分割し、max_concurrency 件ずつ並行に問い合わせる。
+    - 失敗したバッチは半分に分けて再試行する（1件になったら max_retries 回まで）
+    - 結果は（シート, cell）で突き合わせ、返ってこなかったセルだけを再度問い合わせる
+    semaphore を渡すと、max_concurrency の代わりにそれで（他の呼び出しと合わせて）並列度を抑える。
+    結果は inputs と同じ順に返す。
+    """
+    config = config or BatchConfig()
+    semaphore = semaphore or asyncio.Semaphore(config.max_concurrency)
+    limiter = InMemoryRateLimiter(requests_per_second=config.requests_per_second) if config.requests_per_second else None
+    results: dict[CellKey, MatchingResult] = {}
+
+    async def run(batch: list[int], attempt: int = 0):
+        batch_inputs = [inputs[i] for i in batch]
+        batch_contexts = [contexts[i] for i in batch] if contexts is not None else None
+        try:
+            async with semaphore:
+                if limiter is not None:
+                    await limiter.aacquire()
+                batch_results = await abatch_verify_inputs_with_llm(verify_chain, batch_inputs, document_text, batch_contexts)
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(f"batch of {len(batch)} inputs failed, bisecting: {e}")
+                mid = len(batch) // 2
+                await asyncio.gather(run(batch[:mid], attempt), run(batch[mid:], attempt))
+            elif attempt < config.max_retries:
+                logger.warning(f"{inputs[batch[0]].cell}: verification failed, retrying: {e}")
+                await run(batch, attempt + 1)
+            else:
+                logger.error(f"{inputs[batch[0]].cell}: verification failed: {e}")
+                inp = inputs[batch[0]]
+                results[input_key(inp)] = MatchingResult(cell=inp.cell, match=False, reason=f"{FAILED_REASON}: {e}")
+            return
+
+        # バッチの中では番地は重ならない（split_batches）
+        keys = {item.cell: input_key(item) for item in batch_inputs}
+        for res in batch_results:
+            if res.cell in keys:
+                results.setdefault(keys[res.cell], res)
+            else:
+                logger.warning(f"unexpected cell in LLM result: {res.cell}")
+        missing = [i for i in batch if input_key(inputs[i]) not in results]
+        if not missing:
+            return
+        if attempt < config.max_retries:
+            logger.warning(f"{len(missing)} results missing, asking again: {[inputs[i].cell for i in missing]}")
+            await run(missing, attempt + 1)
+        else:
+            for i in missing:
+                inp = inputs[i]
+                results[input_key(inp)] = MatchingResult(cell=inp.cell, match=False, reason=NO_RESULT_REASON)
+
+    batches = split_batches(inputs, contexts, config, document_text)
+    logger.info(f"verifying {len(inputs)} inputs in {len(batches)} batches")
+    await asyncio.gather(*(run(batch) for batch in batches))
+    return [results[input_key(item)] for item in inputs]
+
+
+def _source_text(markdown_path: Path) -> str:
+    with markdown_path.open() as f:
+        return f"source_path: {markdown_path}\n{f.read()}"
+
+
+def _better(current: Optional[MatchingResult], new: MatchingResult) -> MatchingResult:
+    """出典ごとの結果のうち残すもの（一致 > 判定できた不一致 > 失敗など。同じなら先の出典）"""
+    def rank(res: MatchingResult) -> int:
+        return 2 if res.match else 1 if is_verified(res) else 0
+    return new if current is None or rank(new) > rank(current) else current
+
+
+async def averify_per_source(
+        verify_chain,
+        inputs: List[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        config: Optional[BatchConfig] = None,
+    ) -> list[MatchingResult]:
+    """
+    文書全体を渡すときに、出典ごとに別々に問い合わせる（出典を 1 つのプロンプトにつなげない）。
+    すべてのセルを最初の出典から照合し、一致しなかったセルだけを次の出典に送る。
+    問い合わせは出典数×セル数ではなく一致しないセルの分だけ増える。
+    出典は順に照合し、1 つの出典の中のバッチは並行に問い合わせる（並列度は config.max_concurrency）。
+    結果はセルごとに 1 つにまとめ、一致した出典の source_path を入れる。結果は inputs と同じ順に返す。
+    """
+    if not analyzed_markdown_paths:
+        return await averify_in_batches(verify_chain, inputs, config=config)
+    config = config or BatchConfig()
+    results: dict[CellKey, MatchingResult] = {}
+    sources = len(analyzed_markdown_paths)
+    pending = inputs
+    for source, path in enumerate(analyzed_markdown_paths):
+        verified = await averify_in_batches(verify_chain, pending, _source_text(path), config=config)
+        for inp, res in zip(pending, verified):
+            if res.match and res.source_path is None:
+                res.source_path = str(path)
+            results[input_key(inp)] = _better(results.get(input_key(inp)), res)
+        unresolved = [inp for inp in pending if not results[input_key(inp)].match]
+        instrumentation.count("source_fanout_skipped", (len(pending) - len(unresolved)) * (sources - source - 1))
+        pending = unresolved
+        if not pending:
+            break
+    return [results[input_key(inp)] for inp in inputs]
+
+
+async def _averify_with_llm(
+        llm: BaseChatModel,
+        inputs: List[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        analyzed_json_paths: Optional[list[Path]],
+        top_k: Optional[int],
+        config: Optional[BatchConfig],
+        index_cache: Optional[IndexCache] = None,
+    ) -> list[MatchingResult]:
     verify_chain = matching_prompt | llm.with_structured_output(MatchingBatchResult)
-    return batch_verify_inputs_with_llm(verify_chain, inputs, document_text)
+    if top_k is not None:
+        if index_cache is not None:
+            index = index_cache.retrieval_index(analyzed_markdown_paths, analyzed_json_paths)
+        else:
+            index = build_index(analyzed_markdown_paths, analyzed_json_paths)
+        contexts = [index.search(inp, top_k) for inp in inputs]
+        return await averify_in_batches(verify_chain, inputs, contexts=contexts, config=config)
+
+    return await averify_per_source(verify_chain, inputs, analyzed_markdown_paths, config)
+
+@instrumentation.timed("match")
+async def amatch(
+        llm: BaseChatModel,
+        inputs: Sequence[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        analyzed_json_paths: Optional[list[Path]] = None,
+        top_k: Optional[int] = DEFAULT_TOP_K,
+        use_prematch: bool = True,
+        batch_config: Optional[BatchConfig] = None,
+        verdict_cache: Optional[VerdictCache] = None,
+        targets: Optional[list[str]] = None,
+        graph: Optional[DependencyGraph] = None,
+        index_cache: Optional[IndexCache] = None,
+    ) -> list[MatchingResult]:
+    """
+    0. targets（"シート!B10" や "B10"）を指定すると、graph 上でその計算に使われる入力だけを照合する。
+       それ以外の入力は照合せずに SKIPPED_REASON の結果にする。
+    1. 数値+単位が文書中に一意に見つかる入力は LLM を使わずに一致とする（use_prematch）
+    2. verdict_cache に同じモデル・プロンプト・文書・(value, metadata) の結果があればそれを使う
+    3. 残りは top_k 件の関連チャンクだけを入力セルごとに LLM に渡す。
+       top_k=None のときは文書全体を出典ごとに渡す（averify_per_source）。
+       問い合わせは batch_config に従って分割・並列化する。
+    index_cache を渡すと、出典のインデックス（1, 3 で使う）をそこから取る（常駐プロセス向け）。
+    結果は inputs と同じ順に返す。inputs は list でも列指向の表（cell_table.py）でもよい。
+    """
+    results: dict[CellKey, MatchingResult] = {}
+    all_inputs = inputs = list(inputs)  # 表なら要素のモデルをここで一度だけ作る
+    if targets is not None:
+        assert graph is not None, "graph is required to select inputs by targets"
+        # シートを省いた targets は、照合する入力を絞る前の最初のセルのシートで一度だけ解決する
+        target_keys = resolve_targets(inputs, targets)
+        relevant = relevant_inputs(graph, inputs, target_keys)
+        relevant_keys = {input_key(inp) for inp in relevant}
+        for inp in inputs:
+            if input_key(inp) not in relevant_keys:
+                results[input_key(inp)] = MatchingResult(cell=inp.cell, match=False, reason=SKIPPED_REASON)
+        inputs = relevant
+        logger.info(f"inputs feeding {len(targets)} targets: {len(inputs)}/{len(all_inputs)}")
+
+    if use_prematch:
+        prematched = 0
+        with instrumentation.stage("match.prematch"):
+            if index_cache is not None:
+                prematch_results = index_cache.token_table(analyzed_markdown_paths, analyzed_json_paths).resolve(inputs)
+            else:
+                prematch_results = prematch(inputs, analyzed_markdown_paths, analyzed_json_paths)
+        for inp, res in zip(inputs, prematch_results):
+            if res is not None:
+                results[input_key(inp)] = res
+                prematched += 1
+        logger.info(f"prematched without LLM: {prematched}/{len(inputs)}")
+        instrumentation.count("prematch_hits", prematched)
+        instrumentation.count("prematch_misses", len(inputs) - prematched)
+
+    remaining = [inp for inp in inputs if input_key(inp) not in results]
+    if remaining and verdict_cache is not None:
+        cache_key = (model_id(llm), prompt_hash(matching_prompt, top_k=top_k), document_hash(analyzed_markdown_paths))
+        cached = verdict_cache.get_many(*cache_key, remaining)
+        results.update(cached)
+        logger.info(f"verdict cache hits: {len(cached)}/{len(remaining)}")
+        instrumentation.count("verdict_cache_hits", len(cached))
+        instrumentation.count("verdict_cache_misses", len(remaining) - len(cached))
+        remaining = [inp for inp in remaining if input_key(inp) not in results]
+
+    if remaining:
+        with instrumentation.stage("match.llm"):
+            verified = await _averify_with_llm(
+                llm, remaining, analyzed_markdown_paths, analyzed_json_paths, top_k, batch_config, index_cache
+            )
+        for inp, res in zip(remaining, verified):
+            results.setdefault(input_key(inp), res)
+        if verdict_cache is not None:
+            verdict_cache.put_many(*cache_key, [
+                (inp, results[input_key(inp)]) for inp in remaining if is_verified(results[input_key(inp)])
+            ])
+
+    if targets is not None:
+        for inp, outputs in impacted_outputs(graph, inputs, [results[input_key(inp)] for inp in inputs], target_keys).items():  # type: ignore
+            logger.warning(f"{inp} does not match the sources; affects: {', '.join(outputs)}")
+
+    return [results[input_key(inp)] for inp in all_inputs]
+
+def match(
+        llm: BaseChatModel,
+        inputs: Sequence[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        analyzed_json_paths: Optional[list[Path]] = None,
+        top_k: Optional[int] = DEFAULT_TOP_K,
+        use_prematch: bool = True,
+        batch_config: Optional[BatchConfig] = None,
+        verdict_cache: Optional[VerdictCache] = None,
+        targets: Optional[list[str]] = None,
+        graph: Optional[DependencyGraph] = None,
+        index_cache: Optional[IndexCache] = None,
+    ) -> list[MatchingResult]:
+    """amatch の同期版（イベントループの中からは amatch を使う）"""
+    return asyncio.run(amatch(
+        llm, inputs, analyzed_markdown_paths, analyzed_json_paths, top_k, use_prematch, batch_config, verdict_cache,
+        targets, graph, index_cache,
+    ))
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, WrapSerializer, WrapValidator
+from typing import Annotated, Optional, List, Sequence
 
 class ExcelCellInputData(BaseModel):
     sheet: str
@@ -13,9 +13,18 @@ class ExcelCellFormulaData(BaseModel):
     value: str
     metadata: list[str]
 
+def _keep_table(value, handler):
+    # 列指向の表（cell_table.py）は要素を作らずにそのまま持つ（要素は読むときに作る検証済みのモデル）
+    if isinstance(value, Sequence) and not isinstance(value, (list, tuple, str)):
+        return value
+    return handler(value)
+
+def _dump_table(value, handler):
+    return handler(list(value))
+
 class ExcelSheetData(BaseModel):
-    input: list[ExcelCellInputData]
-    formula: list[ExcelCellFormulaData]
+    input: Annotated[Sequence[ExcelCellInputData], WrapValidator(_keep_table), WrapSerializer(_dump_table)]
+    formula: Annotated[Sequence[ExcelCellFormulaData], WrapValidator(_keep_table), WrapSerializer(_dump_table)]
 
 class MatchingResult(BaseModel):
     cell: str
@@ -23,6 +32,7 @@ class MatchingResult(BaseModel):
     reason: str
     matched_text: Optional[str] = None
     source_path: Optional[str] = None
+    page: Optional[int] = None
 
 class MatchingBatchResult(BaseModel):
     results: List[MatchingResult]
@@ -0,0 +1,262 @@
+'''
+解析（prebuilt-layout）・Excel の読み込み・照合・マークアップを重ねて実行するパイプライン
+
+- Excel の読み込みは、出典PDFの解析と並行して始める
+- 出典PDFごとに、解析が終わりしだい、その出典でまだ一致していないセルを照合する
+- セルの結果は確定しだい（一致したとき、またはすべての出典で一致しなかったとき）on_result と
+  `{ブック名}_results.jsonl` に流す。出典PDFのマークアップはその出典の照合が終わりしだい始める
+- チェックポイント（JSON）に、出典ごとの解析結果のパスと照合結果をチャンクごとに書く。
+  途中で落ちても、同じチェックポイントで再実行すれば、終わった解析・照合の呼び出しは繰り返さない
+'''
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import BaseModel
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from . import instrumentation
+from .analyze_local_pdf import analyze_many_async, fitz_lock
+from .formula_graph import CellKey
+from .layout_cache import LayoutCache
+from .load_xlsx import extract_data
+from .manifest import VerificationManifest, build_manifest, diff_inputs, source_hashes
+from .markup import MARK_SYMBOLS, SaveMode, mark_labels, markup_excel_pdf, markup_source_json, write_matching_csv
+from .matching import amatch, input_key
+from .models import ExcelCellInputData, MatchingResult
+
+
+CHECKPOINT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 200
+NOT_MATCHED_REASON = "Not found in any source document."
+
+logger = logging.getLogger(__name__)
+
+ResultCallback = Callable[[ExcelCellInputData, MatchingResult], None]
+
+
+class SourceCheckpoint(BaseModel):
+    pdf_size: int
+    pdf_mtime_ns: int
+    markdown_path: Path
+    json_path: Path
+    # この出典だけで照合した結果（manifest.py と同じ形式）
+    matched: VerificationManifest = VerificationManifest()
+
+
+class PipelineCheckpoint(BaseModel):
+    version: int = CHECKPOINT_VERSION
+    sources: dict[str, SourceCheckpoint] = {}
+
+
+def load_checkpoint(path: Path) -> PipelineCheckpoint:
+    if not path.exists():
+        return PipelineCheckpoint()
+    checkpoint = PipelineCheckpoint.model_validate_json(path.read_text(encoding="utf-8"))
+    if checkpoint.version != CHECKPOINT_VERSION:
+        logger.warning(f"ignoring checkpoint with unknown version {checkpoint.version}: {path}")
+        return PipelineCheckpoint()
+    return checkpoint
+
+
+def save_checkpoint(path: Path, checkpoint: PipelineCheckpoint):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    tmp.write_text(checkpoint.model_dump_json(), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _with_fitz_lock(fn, *args):
+    # プロセスプールの executor でも使えるように、モジュールの関数にしておく
+    with fitz_lock:
+        return fn(*args)
+
+
+def _is_analyzed(entry: Optional[SourceCheckpoint], pdf: Path) -> bool:
+    if entry is None or not (entry.markdown_path.exists() and entry.json_path.exists()):
+        return False
+    stat = pdf.stat()
+    return (entry.pdf_size, entry.pdf_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+
+async def arun_pipeline(
+        llm: BaseChatModel,
+        excel_path: Path,
+        excel_pdf_path: Path,
+        sheet_name: str,
+        source_pdfs: list[Path],
+        checkpoint_path: Path,
+        output_dir: Optional[Path] = None,
+        analysis_output_dir: Path = Path("./data/document_intelligence"),
+        layout_cache: Optional[LayoutCache] = None,
+        client=None,
+        max_analysis_concurrency: int = 4,
+        shard_pages: Optional[int] = None,
+        use_text_layer: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_result: Optional[ResultCallback] = None,
+        executor: Optional[Executor] = None,
+        mark_symbols: str = MARK_SYMBOLS,
+        save_mode: SaveMode = "incremental",
+        **match_kwargs,
+    ) -> list[MatchingResult]:
+    """
+    main.py の流れ（解析 → 読み込み → 照合 → マークアップ）を、依存のない段階どうしは並行に実行する。
+    出力先は markup と同じ（output_dir を省略すると元ファイルの隣）。
+    shard_pages を指定すると、出典PDFをそのページ数ずつに分けて解析する（analyze_many_async を参照）。
+    use_text_layer=True なら、テキストレイヤーのあるページは API を呼ばずに解析する。
+    照合は出典ごとに chunk_size セルずつ amatch で行い、チャンクが終わるたびにチェックポイントを書く。
+    マークアップは executor で実行する（省略時は 1 本のスレッド）。PyMuPDF は複数スレッドから同時に使えないので、
+    マークアップは解析のテキストレイヤーの読み取り・シャードへの分割と同じ fitz_lock を持って行う。
+    結果は入力セルの順に返す。
+    """
+    for pdf in [excel_path, excel_pdf_path, *source_pdfs]:
+        assert pdf.exists()
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    owns_executor = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=1)
+    markup_suffix = "_overlay.pdf" if save_mode == "overlay" else "_markup.pdf"
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint_lock = asyncio.Lock()
+
+    def output_path(path: Path, suffix: str) -> Path:
+        return (output_dir or path.parent) / f"{path.stem}{suffix}"
+
+    async def save():
+        async with checkpoint_lock:
+            await asyncio.to_thread(save_checkpoint, checkpoint_path, checkpoint.model_copy(deep=True))
+
+    extraction = asyncio.create_task(asyncio.to_thread(extract_data, excel_path, sheet_name))
+    analysis_semaphore = asyncio.Semaphore(max_analysis_concurrency)
+
+    async def analyze(pdf: Path) -> SourceCheckpoint:
+        entry = checkpoint.sources.get(str(pdf))
+        if _is_analyzed(entry, pdf):
+            logger.info(f"analysis restored from checkpoint: {pdf}")
+            return entry  # type: ignore
+        async with analysis_semaphore:
+            [(markdown_path, json_path)] = await analyze_many_async(
+                [pdf], 1, analysis_output_dir, cache=layout_cache, client=client, shard_pages=shard_pages,
+                use_text_layer=use_text_layer,
+            )
+        stat = pdf.stat()
+        entry = SourceCheckpoint(
+            pdf_size=stat.st_size, pdf_mtime_ns=stat.st_mtime_ns, markdown_path=markdown_path, json_path=json_path
+        )
+        checkpoint.sources[str(pdf)] = entry
+        await save()
+        return entry
+
+    try:
+        analyses = [asyncio.create_task(analyze(pdf)) for pdf in source_pdfs]
+        try:
+            data = await extraction
+        except BaseException:
+            for task in analyses:
+                task.cancel()
+            raise
+        # 表（data.input）は別プロセスのマークアップと CSV にそのまま渡し、何度も回す照合には一度だけ list にする
+        table = data.input
+        inputs = list(table)
+        labels = mark_labels(len(inputs), mark_symbols)
+
+        # 確定した結果の書き出し
+        results: dict[CellKey, MatchingResult] = {}
+        remaining_sources = {input_key(inp): len(source_pdfs) for inp in inputs}
+        results_path = output_path(excel_path, "_results.jsonl")
+        results_file = results_path.open("w", encoding="utf-8")
+
+        def emit(inp: ExcelCellInputData, result: MatchingResult):
+            results[input_key(inp)] = result
+            results_file.write(json.dumps({"sheet": inp.sheet, "value": inp.value, **result.model_dump()}, ensure_ascii=False) + "\n")
+            results_file.flush()
+            if on_result is not None:
+                on_result(inp, result)
+
+        async def match_source(pdf: Path, entry: SourceCheckpoint) -> list[MatchingResult]:
+            """この出典でまだ一致していないセルを照合し、この出典での結果（入力の順）を返す"""
+            hashes = source_hashes([entry.markdown_path])
+            source_results: dict[CellKey, MatchingResult] = {}
+            to_verify, carried = diff_inputs(inputs, entry.matched, hashes)
+            source_results.update(carried)
+            to_verify = [inp for inp in to_verify if input_key(inp) not in results]
+            logger.info(f"matching against {pdf.name}: {len(to_verify)} to verify, {len(carried)} from checkpoint")
+            for start in range(0, len(to_verify), chunk_size):
+                chunk = [inp for inp in to_verify[start:start + chunk_size] if input_key(inp) not in results]
+                if not chunk:
+                    continue
+                verified = await amatch(llm, chunk, [entry.markdown_path], [entry.json_path], **match_kwargs)
+                source_results.update((input_key(inp), res) for inp, res in zip(chunk, verified))
+                checked = [inp for inp in inputs if input_key(inp) in source_results]
+                entry.matched = build_manifest(checked, [source_results[input_key(inp)] for inp in checked], hashes)
+                await save()
+
+            for inp in inputs:
+                res = source_results.get(input_key(inp))
+                if input_key(inp) in results and results[input_key(inp)].match:
+                    continue
+                remaining_sources[input_key(inp)] -= 1
+                if res is not None and res.match:
+                    emit(inp, res)
+                elif remaining_sources[input_key(inp)] == 0:
+                    emit(inp, res if res is not None else MatchingResult(cell=inp.cell, match=False, reason=NOT_MATCHED_REASON))
+            return [
+                source_results.get(input_key(inp)) or MatchingResult(cell=inp.cell, match=False, reason=NOT_MATCHED_REASON)
+                for inp in inputs
+            ]
+
+        async def process(pdf: Path, analysis: asyncio.Task) -> list[int]:
+            entry = await analysis
+            with instrumentation.stage("pipeline.match_source"):
+                source_results = await match_source(pdf, entry)
+            # この出典で一致したセルだけをこの出典にマークアップする
+            with instrumentation.stage("pipeline.markup_source"):
+                return await loop.run_in_executor(
+                    executor, _with_fitz_lock, markup_source_json, pdf, entry.json_path, output_path(pdf, markup_suffix),
+                    source_results, labels, save_mode,
+                )
+
+        try:
+            pages_by_source = await asyncio.gather(*(process(pdf, task) for pdf, task in zip(source_pdfs, analyses)))
+        finally:
+            results_file.close()
+        for inp in inputs:
+            if input_key(inp) not in results:  # 出典がないとき
+                results[input_key(inp)] = MatchingResult(cell=inp.cell, match=False, reason=NOT_MATCHED_REASON)
+        ordered = [results[input_key(inp)] for inp in inputs]
+
+        with instrumentation.stage("pipeline.markup_excel"):
+            await loop.run_in_executor(
+                executor, _with_fitz_lock, markup_excel_pdf, excel_path, excel_pdf_path, output_path(excel_pdf_path, markup_suffix),
+                table, [r.match for r in ordered], labels, save_mode,
+            )
+        source_pages = [("", 0)] * len(inputs)
+        for pdf, pages in zip(source_pdfs, pages_by_source):
+            for i, page in enumerate(pages):
+                if page and not source_pages[i][1]:
+                    source_pages[i] = (pdf.stem, page)
+        write_matching_csv(output_path(excel_path, "_matching.csv"), table, ordered, source_pages, labels)
+        return ordered
+    finally:
+        if owns_executor:
+            executor.shutdown()
+
+
+def run_pipeline(
+        llm: BaseChatModel,
+        excel_path: Path,
+        excel_pdf_path: Path,
+        sheet_name: str,
+        source_pdfs: list[Path],
+        checkpoint_path: Path,
+        **kwargs,
+    ) -> list[MatchingResult]:
+    """arun_pipeline の同期版"""
+    return asyncio.run(arun_pipeline(llm, excel_path, excel_pdf_path, sheet_name, source_pdfs, checkpoint_path, **kwargs))
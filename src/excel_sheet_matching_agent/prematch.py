@@ -0,0 +1,294 @@
+'''
+LLM を使わない数値・単位の事前照合
+
+解析結果の行テキストから「数値+単位」のトークンを一度だけ抜き出し、
+正規化（全角→半角、桁区切り、万・千円などの倍率）したうえで基本単位に換算した表を作る。
+入力セルの値と metadata の単位ヒントをその表と突き合わせ、一意に決まるものだけ MatchingResult にする。
+曖昧なもの・見つからないものは None を返す（LLM で照合する）。
+'''
+import numpy as np
+
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+import re
+import unicodedata
+
+from .layout_store import iter_lines, open_layout
+from .models import ExcelCellInputData, MatchingResult
+
+
+PAGE_BREAK = "<!-- PageBreak -->"
+
+# 基本単位への換算表: 記号 → (次元, 倍率)
+_LENGTH = {"m": 1}
+_VOLUME = {"m": 3}
+_MASS = {"kg": 1}
+_TIME = {"s": 1}
+BASE_UNITS: dict[str, tuple[dict[str, int], float]] = {
+    # 長さ
+    "km": (_LENGTH, 1e3), "m": (_LENGTH, 1.0), "cm": (_LENGTH, 1e-2), "mm": (_LENGTH, 1e-3),
+    "μm": (_LENGTH, 1e-6), "um": (_LENGTH, 1e-6), "nm": (_LENGTH, 1e-9),
+    # 体積
+    "kl": (_VOLUME, 1.0), "kL": (_VOLUME, 1.0), "l": (_VOLUME, 1e-3), "L": (_VOLUME, 1e-3),
+    "dl": (_VOLUME, 1e-4), "dL": (_VOLUME, 1e-4), "ml": (_VOLUME, 1e-6), "mL": (_VOLUME, 1e-6),
+    "cc": (_VOLUME, 1e-6), "μl": (_VOLUME, 1e-9), "μL": (_VOLUME, 1e-9),
+    # 質量
+    "t": (_MASS, 1e3), "kg": (_MASS, 1.0), "g": (_MASS, 1e-3), "mg": (_MASS, 1e-6), "μg": (_MASS, 1e-9),
+    # 時間
+    "h": (_TIME, 3600.0), "hr": (_TIME, 3600.0), "min": (_TIME, 60.0), "s": (_TIME, 1.0),
+    "sec": (_TIME, 1.0), "ms": (_TIME, 1e-3),
+    # 放射能・線量
+    "Bq": ({"Bq": 1}, 1.0), "kBq": ({"Bq": 1}, 1e3), "MBq": ({"Bq": 1}, 1e6),
+    "GBq": ({"Bq": 1}, 1e9), "TBq": ({"Bq": 1}, 1e12),
+    "Sv": ({"Sv": 1}, 1.0), "mSv": ({"Sv": 1}, 1e-3), "μSv": ({"Sv": 1}, 1e-6), "nSv": ({"Sv": 1}, 1e-9),
+    "Gy": ({"Gy": 1}, 1.0), "mGy": ({"Gy": 1}, 1e-3), "μGy": ({"Gy": 1}, 1e-6),
+    # その他
+    "円": ({"円": 1}, 1.0),
+    "%": ({"%": 1}, 1.0),
+}
+# 数値の直後に付く和文の倍率（千円、3万、1.2億円 など）
+MULTIPLIERS = {"百": 1e2, "千": 1e3, "万": 1e4, "億": 1e8, "兆": 1e12}
+
+RTOL = 1e-9
+
+_NUMBER = r"(?<![\d.,])(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?:[eE][-+]?\d+)?"
+_UNIT_WORD = r"[A-Za-zμ%][A-Za-z0-9μ%/*・·^\-]*"
+_UNIT = rf"(?:{_UNIT_WORD}(?: {_UNIT_WORD})*|円)"
+_TOKEN_RE = re.compile(rf"(?P<number>{_NUMBER})\s?(?P<mult>[百千万億兆]*)(?P<unit>{_UNIT})?")
+_HINT_RE = re.compile(rf"(?P<mult>[百千万億兆]*)(?P<unit>{_UNIT})")
+_TERM_RE = re.compile(r"(?P<base>[^\d^\-]+)\^?(?P<exp>-?\d+)?")
+_HINT_PREFIX_RE = re.compile(r"^(?:単位)\s*[:：]?\s*")
+
+
+def normalize(text: str) -> str:
+    """全角→半角などの互換文字を正規化する（µ→μ も含む）"""
+    return unicodedata.normalize("NFKC", text)
+
+
+def parse_number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+def parse_multiplier(text: str) -> float:
+    factor = 1.0
+    for ch in text:
+        factor *= MULTIPLIERS[ch]
+    return factor
+
+
+def parse_unit(unit: str) -> Optional[tuple[str, float]]:
+    """
+    単位を (次元, 基本単位への倍率) にする。知らない単位を含む場合は None。
+    `/` は直後の項だけを割る（"Sv/Bq*m2" = Sv·m²/Bq）。
+    """
+    dims: dict[str, int] = {}
+    factor = 1.0
+    for op, term in re.findall(r"(^|[/*・· ])([^/*・· ]+)", unit):
+        m = _TERM_RE.fullmatch(term)
+        if m is None or m.group("base") not in BASE_UNITS:
+            return None
+        base_dims, base_factor = BASE_UNITS[m.group("base")]
+        exp = int(m.group("exp") or 1) * (-1 if op == "/" else 1)
+        factor *= base_factor ** exp
+        for dim, power in base_dims.items():
+            dims[dim] = dims.get(dim, 0) + power * exp
+    if not dims and unit:
+        return None
+    return " ".join(f"{dim}^{power}" for dim, power in sorted(dims.items()) if power), factor
+
+
+def resolve_unit(unit: str) -> tuple[str, float, str]:
+    """
+    単位文字列の先頭から、解釈できる最長の部分を (次元, 倍率, 使った文字列) で返す。
+    解釈できなければ最初の語をそのまま次元として扱う（"?Bq/cm2" のように）。
+    """
+    words = unit.split(" ")
+    for n in range(len(words), 0, -1):
+        candidate = " ".join(words[:n])
+        parsed = parse_unit(candidate)
+        if parsed is not None:
+            return parsed[0], parsed[1], candidate
+    return f"?{words[0]}", 1.0, words[0]
+
+
+class _Query(NamedTuple):
+    owner: int
+    dim: str
+    value: float
+    unit: str
+
+
+def input_units(inp: ExcelCellInputData) -> list[tuple[str, float, str]]:
+    """metadata から単位ヒントを探す。例: "m", "単位: ml", "千円", "(Bq/cm3)" """
+    units = []
+    for hint in inp.metadata:
+        for part in re.split(r"[,、]", normalize(hint)):
+            part = _HINT_PREFIX_RE.sub("", part.strip()).strip("()[]「」 ")
+            m = _HINT_RE.fullmatch(part)
+            if m is None:
+                continue
+            dim, factor, _ = resolve_unit(m.group("unit"))
+            units.append((dim, factor * parse_multiplier(m.group("mult")), part))
+    return units
+
+
+class TokenTable:
+    """
+    文書中の「数値+単位」トークンの表。
+    次元ごと・換算後の値の順に並べてあり、入力の値は二分探索で引く。
+    """
+    def __init__(self, source_paths: list[str]):
+        self.source_paths = source_paths
+        self.texts: list[str] = []
+        self.lines: list[str] = []
+        self._raw: list[float] = []
+        self._factors: list[float] = []
+        self._dims: list[str] = []
+        self._pages: list[int] = []
+        self._sources: list[int] = []
+        self._lines: list[int] = []
+        self.dim_ids: dict[str, int] = {}
+
+    def add_line(self, source: int, page: int, line: str):
+        normalized = normalize(line)
+        # NFKC で長さが変わらなければ元のテキストを matched_text に使う
+        original = line if len(line) == len(normalized) else normalized
+        line_id = len(self.lines)
+        for m in _TOKEN_RE.finditer(normalized):
+            try:
+                raw = parse_number(m.group("number"))
+            except ValueError:
+                continue
+            factor = parse_multiplier(m.group("mult"))
+            end = m.end("mult")
+            dim = ""
+            if m.group("unit"):
+                dim, unit_factor, used = resolve_unit(m.group("unit"))
+                factor *= unit_factor
+                end = m.start("unit") + len(used)
+            self.texts.append(original[m.start():end].rstrip())
+            self._raw.append(raw)
+            self._factors.append(factor)
+            self._dims.append(dim)
+            self._pages.append(page)
+            self._sources.append(source)
+            self._lines.append(line_id)
+        if self._lines and self._lines[-1] == line_id:
+            self.lines.append(normalized)
+
+    def freeze(self):
+        # 基本単位への換算はまとめて NumPy で行う
+        values = np.asarray(self._raw, dtype=np.float64) * np.asarray(self._factors, dtype=np.float64)
+        for dim in self._dims:
+            self.dim_ids.setdefault(dim, len(self.dim_ids))
+        dims = np.fromiter((self.dim_ids[dim] for dim in self._dims), dtype=np.int32, count=len(self._dims))
+        self.order = np.lexsort((values, dims))
+        self.values = values[self.order]
+        self.dims = dims[self.order]
+        self.pages = np.asarray(self._pages, dtype=np.int32)
+        self.sources = np.asarray(self._sources, dtype=np.int32)
+        return self
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _lookup(self, queries: list[_Query]) -> dict[int, list[int]]:
+        """クエリごとに一致したトークン番号（元の順）"""
+        hits: dict[int, list[int]] = {}
+        by_dim: dict[int, list[int]] = {}
+        for i, q in enumerate(queries):
+            if q.dim in self.dim_ids:
+                by_dim.setdefault(self.dim_ids[q.dim], []).append(i)
+        for dim_id, query_ids in by_dim.items():
+            start, end = np.searchsorted(self.dims, [dim_id, dim_id + 1])
+            values = self.values[start:end]
+            q = np.array([queries[i].value for i in query_ids], dtype=np.float64)
+            tol = np.abs(q) * RTOL
+            lo = np.searchsorted(values, q - tol, side="left")
+            hi = np.searchsorted(values, q + tol, side="right")
+            for i, a, b in zip(query_ids, lo.tolist(), hi.tolist()):
+                if a < b:
+                    hits[i] = self.order[start + a:start + b].tolist()
+        return hits
+
+    def _labelled(self, token: int, inp: ExcelCellInputData) -> bool:
+        """トークンのある行に、セルの metadata の語（ラベル）が書かれているか"""
+        line = self.lines[self._lines[token]]
+        return any(label and label in line for label in map(normalize, inp.metadata))
+
+    def resolve(self, inputs: list[ExcelCellInputData]) -> list[Optional[MatchingResult]]:
+        """
+        文書中にちょうど 1 か所だけあり、単位（metadata の単位ヒント）か同じ行のラベルで裏付けられる値だけを決める。
+        複数か所にある値（"第1条" と "1名" など）や、裏付けのない単位なしの数値は LLM に任せる（None）。
+        """
+        queries: list[_Query] = []
+        for owner, inp in enumerate(inputs):
+            units = input_units(inp)
+            if not units:
+                # 単位が分からないときは単位のない数値とだけ照合する
+                units = [("", 1.0, "")]
+            for dim, factor, unit in units:
+                queries.append(_Query(owner, dim, float(inp.value) * factor, unit))
+
+        hits_by_owner: dict[int, list[tuple[int, _Query]]] = {}
+        for i, token_ids in self._lookup(queries).items():
+            q = queries[i]
+            hits_by_owner.setdefault(q.owner, []).extend((t, q) for t in token_ids)
+
+        results: list[Optional[MatchingResult]] = [None] * len(inputs)
+        for owner, hits in hits_by_owner.items():
+            if len({t for t, _ in hits}) != 1:
+                continue  # 曖昧（同じ表記でも出現が複数なら決めない）
+            token, q = hits[0]
+            inp = inputs[owner]
+            if not q.unit and not self._labelled(token, inp):
+                continue  # 単位なしの数値はラベルがなければ偶然の一致かもしれない
+            matched_text = self.texts[token]
+            results[owner] = MatchingResult(
+                cell=inp.cell,
+                match=True,
+                reason=f"Deterministic match: {inp.value} {q.unit}".rstrip() + f" equals {matched_text}.",
+                matched_text=matched_text,
+                source_path=self.source_paths[int(self.sources[token])],
+                page=int(self.pages[token]),
+            )
+        return results
+
+
+def _markdown_lines(markdown: str) -> Iterator[tuple[int, str]]:
+    for page_number, page_text in enumerate(markdown.split(PAGE_BREAK), start=1):
+        for line in page_text.splitlines():
+            yield page_number, line
+
+
+def build_token_table(
+        analyzed_markdown_paths: Iterable[Path],
+        analyzed_json_paths: Optional[Iterable[Optional[Path]]] = None,
+    ) -> TokenTable:
+    """prebuilt-layout の json の行（なければ markdown の行）からトークン表を作る"""
+    markdown_paths = list(analyzed_markdown_paths)
+    json_paths = list(analyzed_json_paths) if analyzed_json_paths is not None else [None] * len(markdown_paths)
+    assert len(markdown_paths) == len(json_paths)
+
+    table = TokenTable([str(path) for path in markdown_paths])
+    for source, (markdown_path, json_path) in enumerate(zip(markdown_paths, json_paths)):
+        if json_path is not None and json_path.exists():
+            # 常駐プロセスで何度も作り直すので、mmap したファイルは GC を待たずに閉じる
+            store = open_layout(json_path)
+            try:
+                for page, line in iter_lines(store):
+                    table.add_line(source, page, line)
+            finally:
+                store.close()
+        else:
+            for page, line in _markdown_lines(markdown_path.read_text(encoding="utf-8")):
+                table.add_line(source, page, line)
+    return table.freeze()
+
+
+def prematch(
+        inputs: list[ExcelCellInputData],
+        analyzed_markdown_paths: list[Path],
+        analyzed_json_paths: Optional[list[Path]] = None,
+    ) -> list[Optional[MatchingResult]]:
+    return build_token_table(analyzed_markdown_paths, analyzed_json_paths).resolve(inputs)
@@ -6,6 +6,8 @@ matching_prompt = ChatPromptTemplate([
         """You are a document verification assistant.
 Your job is to determine whether each numeric input from an Excel sheet is justified by the provided source document.
 Use semantic understanding, and consider units, value conversions, and contextual meaning.
+The source document may be given as numbered chunks (`[chunk N] source_path: ..., page: ...`).
+In that case each input lists its candidate chunks; report the `source_path` and `page` of the chunk containing the matched text.
 """
     ),
     (
@@ -66,7 +68,8 @@ Now verify the following inputs against the document.
 extract_inputs_prompt = ChatPromptTemplate([
     ("human", """You are an expert data extraction tool capable of analyzing HTML representations of spreadsheets and extracting specific information based on class attributes.
 
-Here is an HTML table representing an Excel sheet:
+Here is an HTML table representing an Excel sheet (or a range of its rows; the first row is the sheet's header row, repeated for context).
+Only non-empty cells are listed. Empty rows are omitted and runs of empty cells are written as a single `<td colspan="N"></td>`.
 ```html
 {html_table}
 ```
@@ -75,7 +78,7 @@ Your task is to find all `<td>` elements that have the class `input`.
 For each such cell, extract the following information and format it as a JSON object conforming to the `ExcelCellInputData` schema provided below.
 
 **Instructions for fields:**
-- `cell`: Determine the Excel cell reference (e.g., "A1", "B2") by combining the `data-col` attribute (which is the Excel column letter like A, B, C) and the `data-row` attribute (which is the Excel row number like 1, 2, 3). For example, if `data-col="B"` and `data-row="2"`, the cell reference is "B2".
+- `cell`: Determine the Excel cell reference (e.g., "A1", "B2") by combining the `data-col` attribute of the `<td>` (which is the Excel column letter like A, B, C) and the `data-row` attribute of the enclosing `<tr>` (which is the Excel row number like 1, 2, 3). For example, if `data-col="B"` and `data-row="2"`, the cell reference is "B2".
 - `value`: Extract the numeric value directly from the content of the `<td>` tag. Ensure it is parsed as an integer or float. If the cell is empty, the value should be null.
 - `metadata`: Analyze the cells surrounding this `input` cell (especially in the same row or column, like potential headers or labels) and infer a list of strings that describe or provide context for this value. **Prioritize extracting units if they are present near the cell.** If no clear metadata is apparent from the HTML context, return an empty list `[]`.
 
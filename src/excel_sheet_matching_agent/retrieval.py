@@ -0,0 +1,193 @@
+'''
+解析結果（markdown/json）から照合に使うチャンクを引くためのローカル検索インデックス
+
+- チャンク: 段落・表の行・ページ
+- 転置インデックス: 数値トークン（正規化済み）とラベル（英単語・漢字かなの2-gram）
+- 入力セルごとに、値と metadata のヒントに合うチャンクを上位 k 件返す
+'''
+from pydantic import BaseModel
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, Optional
+import json
+import math
+import re
+import unicodedata
+
+from .models import ExcelCellInputData
+
+
+ChunkKind = Literal["paragraph", "table_row", "page"]
+
+# 単位換算（km↔m, cm↔m など）でありうる倍率。完全一致より低く評価する
+NUMBER_SCALES = (1e-6, 1e-3, 1e-2, 1e-1, 1e1, 1e2, 1e3, 1e4, 1e6)
+EXACT_NUMBER_WEIGHT = 3.0
+SCALED_NUMBER_WEIGHT = 1.0
+LABEL_WEIGHT = 0.5
+# ページ全体のチャンクはほぼ何にでも当たるので、段落・表の行を優先する
+KIND_WEIGHTS: dict[str, float] = {"paragraph": 1.0, "table_row": 1.0, "page": 0.5}
+
+PAGE_BREAK = "<!-- PageBreak -->"
+
+_NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?(?:[eE][-+]?\d+)?")
+_WORD_RE = re.compile(r"[a-z][a-z0-9]*")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-鿿]+")
+_TR_RE = re.compile(r"<tr>(.*?)</tr>", re.DOTALL)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+class Chunk(BaseModel):
+    id: int
+    source_path: str
+    page: Optional[int]
+    kind: ChunkKind
+    text: str
+
+
+def normalize_text(text: str) -> str:
+    """全角→半角などの互換文字を正規化し、小文字化する"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def number_key(value: float) -> str:
+    return f"{value:.12g}"
+
+
+def number_tokens(text: str) -> set[str]:
+    keys = set()
+    for m in _NUMBER_RE.finditer(normalize_text(text)):
+        try:
+            keys.add(number_key(float(m.group().replace(",", ""))))
+        except ValueError:
+            continue
+    return keys
+
+
+def label_tokens(text: str) -> set[str]:
+    text = normalize_text(text)
+    tokens = set(_WORD_RE.findall(text))
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.add(run)
+        tokens.update(run[i:i+2] for i in range(len(run) - 1))
+    return tokens
+
+
+class RetrievalIndex:
+    def __init__(self):
+        self.chunks: list[Chunk] = []
+        self.numbers: dict[str, set[int]] = defaultdict(set)
+        self.labels: dict[str, set[int]] = defaultdict(set)
+
+    def add(self, source_path: str, page: Optional[int], kind: ChunkKind, text: str):
+        text = text.strip()
+        if not text:
+            return
+        chunk = Chunk(id=len(self.chunks), source_path=source_path, page=page, kind=kind, text=text)
+        self.chunks.append(chunk)
+        for key in number_tokens(text):
+            self.numbers[key].add(chunk.id)
+        for token in label_tokens(text):
+            self.labels[token].add(chunk.id)
+
+    def _idf(self, postings: set[int]) -> float:
+        return math.log(1 + len(self.chunks) / len(postings))
+
+    def search(self, inp: ExcelCellInputData, k: int = 5) -> list[Chunk]:
+        scores: dict[int, float] = defaultdict(float)
+
+        value = float(inp.value)
+        number_weights = {number_key(value * scale): SCALED_NUMBER_WEIGHT for scale in NUMBER_SCALES}
+        number_weights[number_key(value)] = EXACT_NUMBER_WEIGHT
+        for key, weight in number_weights.items():
+            postings = self.numbers.get(key)
+            if not postings:
+                continue
+            idf = self._idf(postings)
+            for chunk_id in postings:
+                scores[chunk_id] += weight * idf
+
+        hint_tokens = set()
+        for hint in inp.metadata:
+            hint_tokens |= label_tokens(hint)
+        for token in hint_tokens:
+            postings = self.labels.get(token)
+            if not postings:
+                continue
+            idf = self._idf(postings)
+            for chunk_id in postings:
+                scores[chunk_id] += LABEL_WEIGHT * idf
+
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (-item[1] * KIND_WEIGHTS[self.chunks[item[0]].kind], item[0]),
+        )
+        return [self.chunks[chunk_id] for chunk_id, _ in ranked[:k]]
+
+
+def _page_number(element: dict) -> Optional[int]:
+    regions = element.get("boundingRegions") or []
+    return regions[0]["pageNumber"] if regions else None
+
+
+def _chunks_from_layout(layout: dict) -> Iterator[tuple[Optional[int], ChunkKind, str]]:
+    content = layout.get("content", "")
+    for page in layout.get("pages", []):
+        text = "".join(content[s["offset"]:s["offset"] + s["length"]] for s in page.get("spans", []))
+        yield page["pageNumber"], "page", text
+    for paragraph in layout.get("paragraphs", []):
+        yield _page_number(paragraph), "paragraph", paragraph.get("content", "")
+    for table in layout.get("tables", []):
+        rows: dict[int, list[dict]] = defaultdict(list)
+        for cell in table.get("cells", []):
+            rows[cell["rowIndex"]].append(cell)
+        for _, cells in sorted(rows.items()):
+            cells.sort(key=lambda c: c["columnIndex"])
+            yield _page_number(cells[0]), "table_row", " | ".join(c.get("content", "") for c in cells)
+
+
+def _chunks_from_markdown(markdown: str) -> Iterator[tuple[Optional[int], ChunkKind, str]]:
+    for page_number, page_text in enumerate(markdown.split(PAGE_BREAK), start=1):
+        yield page_number, "page", page_text
+        for row in _TR_RE.findall(page_text):
+            yield page_number, "table_row", " | ".join(
+                _TAG_RE.sub("", cell).strip() for cell in re.split(r"</t[dh]>", row) if _TAG_RE.sub("", cell).strip()
+            )
+        for block in re.split(r"\n\s*\n", _TR_RE.sub("", page_text)):
+            yield page_number, "paragraph", _TAG_RE.sub("", block)
+
+
+def build_index(
+        analyzed_markdown_paths: Iterable[Path],
+        analyzed_json_paths: Optional[Iterable[Optional[Path]]] = None,
+    ) -> RetrievalIndex:
+    """
+    prebuilt-layout の json があればそこから、なければ markdown からチャンクを作る。
+    チャンクの source_path は markdown のパス（LLM に渡していたものと同じ）。
+    """
+    markdown_paths = list(analyzed_markdown_paths)
+    json_paths = list(analyzed_json_paths) if analyzed_json_paths is not None else [None] * len(markdown_paths)
+    assert len(markdown_paths) == len(json_paths)
+
+    index = RetrievalIndex()
+    for markdown_path, json_path in zip(markdown_paths, json_paths):
+        if json_path is not None and json_path.exists():
+            with json_path.open(encoding="utf-8") as f:
+                chunks = _chunks_from_layout(json.load(f))
+        else:
+            chunks = _chunks_from_markdown(markdown_path.read_text(encoding="utf-8"))
+        for page, kind, text in chunks:
+            index.add(str(markdown_path), page, kind, text)
+    return index
+
+
+def find_chunk(chunks: list[Chunk], matched_text: str) -> Optional[Chunk]:
+    """matched_text を含むチャンク（空白・全角半角の差は無視）"""
+    needle = re.sub(r"\s+", "", normalize_text(matched_text))
+    if not needle:
+        return None
+    for chunk in chunks:
+        if needle in re.sub(r"\s+", "", normalize_text(chunk.text)):
+            return chunk
+    return None
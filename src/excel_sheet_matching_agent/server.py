@@ -0,0 +1,351 @@
+'''
+常駐のワーカー: 読み込み・照合・マークアップのジョブをローカルの HTTP（TCP か Unix ソケット）で受け付ける
+
+    python -m excel_sheet_matching_agent.server --port 8765
+    python -m excel_sheet_matching_agent.server --socket /tmp/esma.sock
+
+    curl -s localhost:8765/match -d '{"excel_path": "examples/計算シートサンプル.xlsx", "sheet_name": "シート1",
+                                      "source_pdfs": ["examples/出典サンプル.pdf"]}'
+
+- 起動時に langchain・Azure SDK・PyMuPDF・OpenCC の読み込み、LLM と Document Intelligence のクライアントの作成を済ませ、
+  プロセスが終わるまで使い回す（LLM の問い合わせは 1 つのイベントループで行うので、接続も使い回される）
+- Excel の読み込み結果（列指向の表, see `cell_table.py`）・出典の解析結果のパス・照合用のインデックス（index_cache.py）は、
+  最近使ったものをメモリに持つ（LRU。ファイルのサイズ・更新時刻が変われば作り直す）
+- ジョブは上限つきのキューに入れ、workers 本のスレッドで処理する。キューが一杯なら 503 を返す
+- PyMuPDF は複数スレッドから同時に使えないので、マークアップは analyze_local_pdf.fitz_lock を持って行う
+  （解析のテキストレイヤーの読み取り・シャードへの分割も同じロックで順に行われる。Document Intelligence を待つ間はロックを持たない）
+
+API（リクエスト・レスポンスとも JSON）:
+    POST /extract  {"excel_path", "sheet_name"}
+    POST /match    {"excel_path", "sheet_name", "source_pdfs", "top_k", "use_prematch", "shard_pages", "use_text_layer"}
+    POST /markup   /match と同じもの + {"excel_pdf_path", "output_dir", "save_mode"}
+    GET  /status   キュー・キャッシュの状態
+'''
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import BaseServer, ThreadingMixIn, UnixStreamServer
+from typing import Any, Callable, Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from .analyze_local_pdf import analyze_local_pdf, fitz_lock, get_client, get_converters
+from .index_cache import DEFAULT_MAX_ENTRIES, IndexCache, LRUCache, file_key
+from .layout_cache import LayoutCache
+from .cell_table import FormulaTable, InputTable
+from .load_xlsx import extract_tables
+from .markup import SaveMode, markup
+from .matching import DEFAULT_TOP_K, amatch
+from .models import ExcelCellInputData, ExcelSheetData, MatchingResult
+from .verdict_cache import VerdictCache
+
+
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractRequest(BaseModel):
+    excel_path: Path
+    sheet_name: str
+
+
+class MatchRequest(ExtractRequest):
+    source_pdfs: list[Path]
+    top_k: Optional[int] = DEFAULT_TOP_K
+    use_prematch: bool = True
+    shard_pages: Optional[int] = None
+    use_text_layer: bool = False
+
+
+class MarkupRequest(MatchRequest):
+    excel_pdf_path: Path
+    output_dir: Optional[Path] = None
+    save_mode: SaveMode = "incremental"
+
+
+class UnknownJob(LookupError):
+    pass
+
+
+class Worker:
+    """
+    ジョブのキューと、ジョブをまたいで使い回すもの（LLM・クライアント・キャッシュ）を持つ。
+    start() でワーカーのスレッドとイベントループを起動し、close() で止める。
+    """
+    def __init__(
+            self,
+            llm,
+            analysis_output_dir: Path = Path("./data/document_intelligence"),
+            layout_cache: Optional[LayoutCache] = None,
+            client=None,
+            verdict_cache: Optional[VerdictCache] = None,
+            cache_entries: int = DEFAULT_MAX_ENTRIES,
+            queue_size: int = DEFAULT_QUEUE_SIZE,
+            workers: int = 1,
+        ):
+        self.llm = llm
+        self.analysis_output_dir = analysis_output_dir
+        self.layout_cache = layout_cache
+        self.client = client
+        self.verdict_cache = verdict_cache
+        self.index_cache = IndexCache(cache_entries)
+        self.workbooks = LRUCache("workbook_cache", cache_entries)
+        self.analyses = LRUCache("analysis_memo", cache_entries)
+        self.workers = workers
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._threads: list[threading.Thread] = []
+        self._loop = asyncio.new_event_loop()
+        self._stats_lock = threading.Lock()
+        self._handlers: dict[str, tuple[Callable[[Any], dict], type[BaseModel]]] = {
+            "extract": (self.extract, ExtractRequest),
+            "match": (self.match, MatchRequest),
+            "markup": (self.markup, MarkupRequest),
+        }
+        self.completed = 0
+        self.failed = 0
+
+    def warm_up(self):
+        """最初のジョブを待たせないように、重い準備を先に済ませる"""
+        started = time.perf_counter()
+        get_converters()
+        if self.client is None and os.environ.get("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT"):
+            self.client = get_client()
+        logger.info(f"warmed up in {time.perf_counter() - started:.2f}s")
+
+    def start(self):
+        threading.Thread(target=self._loop.run_forever, name="esma-loop", daemon=True).start()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"esma-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def submit(self, kind: str, body: dict) -> Future:
+        """
+        ジョブをキューに入れる。知らない kind なら UnknownJob、body が不正なら pydantic の ValidationError、
+        キューが一杯なら queue.Full。
+        """
+        if kind not in self._handlers:
+            raise UnknownJob(kind)
+        handler, model = self._handlers[kind]
+        request = model.model_validate(body)
+        future: Future = Future()
+        self._queue.put_nowait((handler, request, future))
+        return future
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            handler, request, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(handler(request))
+                with self._stats_lock:
+                    self.completed += 1
+            except BaseException as e:
+                logger.exception(f"job failed: {request}")
+                future.set_exception(e)
+                with self._stats_lock:
+                    self.failed += 1
+
+    def status(self) -> dict:
+        with self._stats_lock:
+            completed, failed = self.completed, self.failed
+        return {
+            "queued": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "workers": self.workers,
+            "completed": completed,
+            "failed": failed,
+            "caches": {
+                "workbooks": self.workbooks.stats,
+                "analyses": self.analyses.stats,
+                "indexes": self.index_cache.stats,
+            },
+        }
+
+    # ジョブ
+
+    def _extract(self, request: ExtractRequest) -> tuple[InputTable, FormulaTable]:
+        key = (file_key(request.excel_path), request.sheet_name)
+        return self.workbooks.get_or_build(key, lambda: extract_tables(request.excel_path, [request.sheet_name]))
+
+    def _analyze(self, pdf: Path, request: MatchRequest) -> tuple[Path, Path]:
+        def analyze() -> tuple[Path, Path]:
+            return analyze_local_pdf(
+                pdf, self.analysis_output_dir, cache=self.layout_cache, client=self.client,
+                shard_pages=request.shard_pages, use_text_layer=request.use_text_layer,
+            )
+        key = (file_key(pdf), request.shard_pages, request.use_text_layer)
+        paths = self.analyses.get_or_build(key, analyze)
+        if not all(path.exists() for path in paths):
+            paths = analyze()
+        return paths
+
+    def _match(self, request: MatchRequest) -> tuple[list[ExcelCellInputData], list[tuple[Path, Path]], list[MatchingResult]]:
+        for path in [request.excel_path, *request.source_pdfs]:
+            if not path.exists():
+                raise FileNotFoundError(path)
+        inputs = list(self._extract(request)[0])
+        analyzed = [self._analyze(pdf, request) for pdf in request.source_pdfs]
+        coroutine = amatch(
+            self.llm, inputs, [md for md, _ in analyzed], [js for _, js in analyzed],
+            top_k=request.top_k, use_prematch=request.use_prematch,
+            verdict_cache=self.verdict_cache, index_cache=self.index_cache,
+        )
+        results = asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+        return inputs, analyzed, results
+
+    def extract(self, request: ExtractRequest) -> dict:
+        inputs, formulas = self._extract(request)
+        return ExcelSheetData(input=inputs, formula=formulas).model_dump(mode="json")
+
+    def match(self, request: MatchRequest) -> dict:
+        inputs, _, results = self._match(request)
+        return {"results": [{"value": inp.value, **res.model_dump()} for inp, res in zip(inputs, results)]}
+
+    def markup(self, request: MarkupRequest) -> dict:
+        if not request.excel_pdf_path.exists():
+            raise FileNotFoundError(request.excel_pdf_path)
+        inputs, analyzed, results = self._match(request)
+        with fitz_lock:
+            markup(
+                request.excel_path, request.excel_pdf_path, inputs, results, request.source_pdfs,
+                [js for _, js in analyzed], output_dir=request.output_dir,
+                save_mode=request.save_mode, max_workers=1,
+            )
+        suffix = "_overlay.pdf" if request.save_mode == "overlay" else "_markup.pdf"
+        outputs = [
+            (request.output_dir or pdf.parent) / f"{pdf.stem}{suffix}" for pdf in [request.excel_pdf_path, *request.source_pdfs]
+        ]
+        outputs.append((request.output_dir or request.excel_path.parent) / f"{request.excel_path.stem}_matching.csv")
+        return {
+            "results": [{"value": inp.value, **res.model_dump()} for inp, res in zip(inputs, results)],
+            "outputs": [str(path) for path in outputs],
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "ThreadingHTTPServer | _UnixHTTPServer"
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/status":
+            self._reply(200, self.server.worker.status())  # type: ignore
+        else:
+            self._reply(404, {"error": f"not found: {self.path}"})
+
+    def do_POST(self):
+        worker: Worker = self.server.worker  # type: ignore
+        started = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            future = worker.submit(self.path.strip("/"), body)
+        except UnknownJob:
+            return self._reply(404, {"error": f"unknown job: {self.path}"})
+        except ValueError as e:  # JSON の誤り・pydantic の ValidationError も ValueError
+            return self._reply(400, {"error": str(e)})
+        except queue.Full:
+            return self._reply(503, {"error": "job queue is full"})
+        try:
+            result = future.result()
+        except FileNotFoundError as e:
+            return self._reply(400, {"error": f"file not found: {e}"})
+        except Exception as e:
+            return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        self._reply(200, {**result, "elapsed": time.perf_counter() - started})
+
+    def log_message(self, format, *args):
+        # Unix ソケットでは client_address が空なので、既定の実装（アドレスを書く）は使わない
+        logger.info(format % args)
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(
+        worker: Worker,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        socket_path: Optional[Path] = None,
+    ) -> BaseServer:
+    """worker のジョブを受け付けるサーバー（serve_forever は呼び出し側で）。socket_path を指定すると Unix ソケットで待つ"""
+    server: BaseServer
+    if socket_path is not None:
+        socket_path.unlink(missing_ok=True)
+        server = _UnixHTTPServer(str(socket_path), _Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    server.worker = worker  # type: ignore
+    return server
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m excel_sheet_matching_agent.server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", type=Path, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--model", default="google_genai:gemini-2.0-flash-lite", help="provider:model for init_chat_model")
+    parser.add_argument("--workers", type=int, default=1, help="jobs processed concurrently")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="jobs waiting before requests are refused")
+    parser.add_argument("--cache-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="workbooks/sources kept in memory")
+    parser.add_argument("--no-verdict-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    from langchain.chat_models import init_chat_model
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    llm = init_chat_model(args.model, temperature=0)
+    worker = Worker(
+        llm, verdict_cache=None if args.no_verdict_cache else VerdictCache(),
+        cache_entries=args.cache_entries, queue_size=args.queue_size, workers=args.workers,
+    )
+    worker.warm_up()
+    worker.start()
+    server = make_server(worker, args.host, args.port, args.socket)
+    logger.info(f"listening on {args.socket or f'{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        worker.close()
+        if args.socket is not None:
+            args.socket.unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+'''
+大きな出典PDFのページ分割（シャード）と、シャードごとの解析結果の結合
+
+- split_pdf: PDF を shard_pages ページずつの PDF に分ける（ページ範囲を指定すればその範囲だけ）。
+  同じページからは同じバイト列のシャードができるので、解析結果のキャッシュはシャード単位で効く
+  （PDF の一部のページを改訂しても、解析し直すのはそのページを含むシャードだけ）
+- merge_layouts: シャードの解析結果（json）を、元のPDFのページ番号・content 中の位置で 1 つにまとめる
+'''
+import fitz
+
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+import re
+
+
+DEFAULT_SHARD_PAGES = 50
+PAGE_BREAK = "\n<!-- PageBreak -->\n"
+
+_ELEMENT_RE = re.compile(r"^/(?P<kind>\w+)/(?P<index>\d+)(?P<rest>.*)$")
+
+
+class Shard(NamedTuple):
+    first_page: int  # 元のPDFでの 1 始まりのページ番号
+    page_count: int
+    path: Path
+
+
+def page_range(page_count: int, pages: Optional[tuple[int, int]] = None) -> tuple[int, int]:
+    """pages（1 始まり・両端を含む）を PDF のページ数に収める"""
+    first, last = pages if pages is not None else (1, page_count)
+    first, last = max(first, 1), min(last, page_count)
+    if first > last:
+        raise ValueError(f"empty page range: {pages} (pages: {page_count})")
+    return first, last
+
+
+def split_pdf(
+        pdf_path: Path,
+        out_dir: Path,
+        shard_pages: int = DEFAULT_SHARD_PAGES,
+        pages: Optional[tuple[int, int]] = None,
+    ) -> list[Shard]:
+    """
+    pdf_path を shard_pages ページずつに分けて out_dir に書く。pages を指定すればその範囲（1 始まり・両端を含む）だけ。
+    """
+    assert shard_pages > 0
+    out_dir.mkdir(parents=True, exist_ok=True)
+    shards = []
+    with fitz.open(pdf_path) as doc:
+        first, last = page_range(len(doc), pages)
+        for start in range(first, last + 1, shard_pages):
+            end = min(start + shard_pages - 1, last)
+            path = out_dir / f"{pdf_path.stem}.p{start:05d}-{end:05d}.pdf"
+            with fitz.open() as shard:
+                shard.insert_pdf(doc, from_page=start - 1, to_page=end - 1)
+                # /ID を作り直さないので、同じページからは同じバイト列になる
+                shard.save(path, garbage=3, deflate=True, no_new_id=True)
+            shards.append(Shard(start, end - start + 1, path))
+    return shards
+
+
+def _shift(value: Any, offset: int, page_offset: int, element_offsets: dict[str, int], key: str = "") -> Any:
+    if isinstance(value, dict):
+        shifted = {k: _shift(v, offset, page_offset, element_offsets, k) for k, v in value.items()}
+        if "offset" in value and "length" in value:
+            shifted["offset"] = value["offset"] + offset
+        if "pageNumber" in value:
+            shifted["pageNumber"] = value["pageNumber"] + page_offset
+        return shifted
+    if isinstance(value, list):
+        return [_shift(v, offset, page_offset, element_offsets, key) for v in value]
+    if key == "elements" and isinstance(value, str):
+        # "/paragraphs/3" などの参照
+        m = _ELEMENT_RE.match(value)
+        if m:
+            return f"/{m.group('kind')}/{int(m.group('index')) + element_offsets.get(m.group('kind'), 0)}{m.group('rest')}"
+    return value
+
+
+def merge_layouts(shards: list[tuple[Shard, dict]]) -> dict:
+    """
+    シャードごとの解析結果を 1 つにまとめる。content は PageBreak でつなぎ、
+    span の offset・pageNumber・"/paragraphs/3" などの要素の参照をずらす。
+    """
+    merged: dict[str, Any] = {}
+    content = ""
+    for shard, layout in shards:
+        if content:
+            content += PAGE_BREAK
+        offset = len(content)
+        element_offsets = {k: len(v) for k, v in merged.items() if isinstance(v, list)}
+        shifted = _shift(layout, offset, shard.first_page - 1, element_offsets)
+        content += layout.get("content") or ""
+        for key, value in shifted.items():
+            if key == "content":
+                continue
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            else:
+                merged.setdefault(key, value)
+    merged["content"] = content
+    return merged
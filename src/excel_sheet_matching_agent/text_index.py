@@ -0,0 +1,141 @@
+'''
+Document Intelligence の解析結果（AnalyzeResult）から作る、正規化済みページテキストの索引
+
+ページごとに単語を span の順に並べ、NFKC・小文字化して空白とカンマを除いてつなげる。
+正規化後の各文字がどの単語に由来するかを持つので、一致した箇所を覆う単語だけが分かる。
+複数の matched_text は Aho-Corasick で、各ページ 1 回の走査でまとめて探す。
+'''
+from azure.ai.documentintelligence.models import AnalyzeResult, DocumentPage, DocumentWord
+
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Optional
+import unicodedata
+
+if TYPE_CHECKING:
+    from .layout_store import LayoutStore
+
+
+# 幅・空白・桁区切りのカンマの違いは無視する
+_IGNORED = set(" \t\r\n　,")
+# 単語の間にこれ以外の文字（markdown の表の区切りなど）があれば、そこをまたいでは一致させない
+_SEPARATOR = "\0"
+
+
+def normalize_chars(text: str) -> Iterator[tuple[int, str]]:
+    """正規化後の文字と、元の text での位置"""
+    for i, ch in enumerate(text):
+        for c in unicodedata.normalize("NFKC", ch).lower():
+            if c not in _IGNORED and not c.isspace():
+                yield i, c
+
+
+def normalize_pattern(text: str) -> str:
+    return "".join(c for _, c in normalize_chars(text))
+
+
+class AhoCorasick:
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = [p for p in dict.fromkeys(patterns) if p]
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        for i, pattern in enumerate(self.patterns):
+            state = 0
+            for c in pattern:
+                nxt = self._goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][c] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(i)
+
+        # 幅優先で failure link を張る
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(c, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[tuple[int, int]]:
+        """(パターン番号, 一致の終端位置) を text の先頭から順に返す"""
+        state = 0
+        for end, c in enumerate(text, 1):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for i in self._out[state]:
+                yield i, end
+
+
+class PageText(NamedTuple):
+    page: DocumentPage
+    text: str
+    word_of: list[int]  # text の各文字 → page.words の添字（区切りは -1）
+
+
+class Occurrence(NamedTuple):
+    page_number: int
+    start: int
+    end: int
+
+
+def _page_text(page: DocumentPage, content: str) -> PageText:
+    words = page.words or []
+    order = sorted(range(len(words)), key=lambda i: words[i].span.offset)
+    chars: list[str] = []
+    word_of: list[int] = []
+    prev_end: Optional[int] = None
+    for i in order:
+        span = words[i].span
+        if prev_end is not None and chars and any(
+                c not in _IGNORED and not c.isspace() for c in content[prev_end:span.offset]):
+            chars.append(_SEPARATOR)
+            word_of.append(-1)
+        for _, c in normalize_chars(words[i].content):
+            chars.append(c)
+            word_of.append(i)
+        prev_end = span.offset + span.length
+    return PageText(page, "".join(chars), word_of)
+
+
+class TextIndex:
+    def __init__(self, result: "AnalyzeResult | LayoutStore"):
+        content = result.content or ""
+        self.pages = {page.page_number: _page_text(page, content) for page in result.pages or []}
+
+    def find_all(self, texts: Iterable[str]) -> dict[str, list[Occurrence]]:
+        """各 text の出現位置（ページ順・ページ内の出現順）"""
+        texts = list(dict.fromkeys(texts))
+        normalized = {text: normalize_pattern(text) for text in texts}
+        matcher = AhoCorasick(normalized.values())
+        by_pattern: dict[str, list[Occurrence]] = {p: [] for p in matcher.patterns}
+        for page_number in sorted(self.pages):
+            for i, end in matcher.iter(self.pages[page_number].text):
+                pattern = matcher.patterns[i]
+                by_pattern[pattern].append(Occurrence(page_number, end - len(pattern), end))
+        for occurrences in by_pattern.values():
+            occurrences.sort()
+        return {text: by_pattern.get(pattern, []) for text, pattern in normalized.items()}
+
+    def words(self, occurrence: Occurrence) -> list[DocumentWord]:
+        page = self.pages[occurrence.page_number]
+        indices = dict.fromkeys(i for i in page.word_of[occurrence.start:occurrence.end] if i >= 0)
+        return [(page.page.words or [])[i] for i in indices]
+
+    def bbox(self, occurrence: Occurrence) -> Optional[tuple[float, float, float, float]]:
+        """一致箇所を覆う単語のポリゴンを合わせた矩形（ページの単位）"""
+        xs: list[float] = []
+        ys: list[float] = []
+        for word in self.words(occurrence):
+            if word.polygon:
+                xs += word.polygon[0::2]
+                ys += word.polygon[1::2]
+        if not xs:
+            return None
+        return min(xs), min(ys), max(xs), max(ys)
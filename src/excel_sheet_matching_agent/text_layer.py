@@ -0,0 +1,137 @@
+'''
+テキストレイヤーのあるPDFから、prebuilt-layout と同じ形の解析結果を PyMuPDF で作る
+
+- ページ・行・単語・ポリゴン（inch）・span・content（markdown）を持つ dict を返す。
+  単語の分け方は Document Intelligence に合わせる（日本語は 1 文字ずつ、英数字は空白までをまとめる）
+- テキストがほとんどないページ（スキャン画像など）は has_text_layer で見分け、
+  そのページだけを Document Intelligence に送る（analyze_local_pdf の use_text_layer を参照）
+'''
+import fitz
+
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from .sharding import PAGE_BREAK, page_range
+
+
+MIN_TEXT_CHARS = 20  # これより文字の少ないページはスキャンとみなす
+PARAGRAPH_BREAK = "\n\n"
+
+
+def has_text_layer(page: fitz.Page, min_chars: int = MIN_TEXT_CHARS) -> bool:
+    return len("".join(page.get_text("text").split())) >= min_chars
+
+
+def text_layer_runs(pdf_path: Path, min_chars: int = MIN_TEXT_CHARS) -> list[tuple[bool, int, int]]:
+    """（テキストレイヤーがあるか, 最初のページ, 最後のページ）の連続したページの組（1 始まり）"""
+    runs: list[tuple[bool, int, int]] = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            local = has_text_layer(page, min_chars)
+            number = page.number + 1  # type: ignore
+            if runs and runs[-1][0] == local:
+                runs[-1] = (local, runs[-1][1], number)
+            else:
+                runs.append((local, number, number))
+    return runs
+
+
+def _inch_polygon(bbox: tuple[float, float, float, float]) -> list[float]:
+    x0, y0, x1, y1 = (round(v / 72, 4) for v in bbox)
+    return [x0, y0, x1, y0, x1, y1, x0, y1]
+
+
+def _union(boxes: list[tuple[float, float, float, float]]) -> tuple[float, float, float, float]:
+    return min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+
+
+def _split_words(chars: list[dict]) -> Iterator[tuple[int, int]]:
+    """行の文字を単語（開始, 終了）に分ける"""
+    i = 0
+    while i < len(chars):
+        if chars[i]["c"].isspace():
+            i += 1
+            continue
+        j = i + 1
+        if chars[i]["c"].isascii():
+            while j < len(chars) and chars[j]["c"].isascii() and not chars[j]["c"].isspace():
+                j += 1
+        yield i, j
+        i = j
+
+
+def _page_layout(page: fitz.Page, page_number: int, content: list[str], offset: int) -> tuple[dict, list[dict], int]:
+    """
+    1 ページ分の pages の要素と paragraphs を作り、テキストを content に足す。
+    offset はこのページの先頭の content 中の位置。戻り値の最後は次のページの offset。
+    """
+    words, lines, paragraphs = [], [], []
+    page_start = offset
+    flags = fitz.TEXTFLAGS_RAWDICT & ~fitz.TEXT_PRESERVE_IMAGES
+    for block in page.get_text("rawdict", flags=flags)["blocks"]:
+        if block.get("type", 0) != 0:
+            continue
+        block_start = None
+        for line in block["lines"]:
+            chars = [c for span in line["spans"] for c in span["chars"]]
+            text = "".join(c["c"] for c in chars).rstrip()
+            if not text.strip():
+                continue
+            chars = chars[:len(text)]
+            if block_start is None:
+                if offset > page_start:
+                    content.append(PARAGRAPH_BREAK)
+                    offset += len(PARAGRAPH_BREAK)
+                block_start = offset
+            else:
+                content.append("\n")
+                offset += 1
+            for start, end in _split_words(chars):
+                words.append({
+                    "content": text[start:end],
+                    "polygon": _inch_polygon(_union([c["bbox"] for c in chars[start:end]])),
+                    "confidence": 1.0,
+                    "span": {"offset": offset + start, "length": end - start},
+                })
+            lines.append({"content": text, "polygon": _inch_polygon(line["bbox"]), "spans": [{"offset": offset, "length": len(text)}]})
+            content.append(text)
+            offset += len(text)
+        if block_start is not None:
+            paragraphs.append({
+                "spans": [{"offset": block_start, "length": offset - block_start}],
+                "boundingRegions": [{"pageNumber": page_number, "polygon": _inch_polygon(block["bbox"])}],
+                "content": "",  # extract_layout で埋める
+            })
+    rect = page.rect
+    layout_page = {
+        "pageNumber": page_number, "angle": 0, "width": round(rect.width / 72, 4), "height": round(rect.height / 72, 4),
+        "unit": "inch", "words": words, "lines": lines, "spans": [{"offset": page_start, "length": offset - page_start}],
+    }
+    return layout_page, paragraphs, offset
+
+
+def extract_layout(pdf_path: Path, pages: Optional[tuple[int, int]] = None) -> dict[str, Any]:
+    """
+    pdf_path の（pages の範囲の）テキストレイヤーから prebuilt-layout と同じ形の結果を作る。
+    pageNumber は範囲の先頭を 1 とする（sharding.merge_layouts でシャードの結果としてまとめられる）。
+    """
+    content: list[str] = []
+    offset = 0
+    layout_pages, paragraphs = [], []
+    with fitz.open(pdf_path) as doc:
+        first, last = page_range(len(doc), pages)
+        for i, number in enumerate(range(first, last + 1)):
+            if i:
+                content.append(PAGE_BREAK)
+                offset += len(PAGE_BREAK)
+            layout_page, page_paragraphs, offset = _page_layout(doc[number - 1], i + 1, content, offset)
+            layout_pages.append(layout_page)
+            paragraphs += page_paragraphs
+    text = "".join(content)
+    for paragraph in paragraphs:
+        span = paragraph["spans"][0]
+        paragraph["content"] = text[span["offset"]:span["offset"] + span["length"]]
+    return {
+        "apiVersion": None, "modelId": "pymupdf-text-layer", "stringIndexType": "unicodeCodePoint",
+        "content": text, "contentFormat": "markdown", "pages": layout_pages, "paragraphs": paragraphs,
+    }
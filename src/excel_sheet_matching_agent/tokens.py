@@ -0,0 +1,11 @@
+'''
+プロンプトのトークン数の概算（照合のバッチ分割と、LLM での読み込みの行の分割で使う）
+
+モデルのトークナイザーは読み込みが重いので使わない。
+'''
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCII は4文字で1トークン、それ以外は1文字1トークン）"""
+    ascii_chars = sum(1 for ch in text if ch.isascii())
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
@@ -0,0 +1,234 @@
+'''
+LLM の照合結果（MatchingResult）の永続キャッシュ（SQLite）
+
+キーはモデル名・temperature・プロンプトテンプレートのハッシュ・文書の内容ハッシュと、
+入力セルの正規化した (value, metadata)。セル番地はキーに含めないので、行を挿入してもヒットする。
+件数の上限を超えたら最終アクセスの古い順に削除する。
+
+CLI:
+    python -m excel_sheet_matching_agent.verdict_cache stats
+    python -m excel_sheet_matching_agent.verdict_cache list --limit 20
+    python -m excel_sheet_matching_agent.verdict_cache invalidate --model gpt-4o-mini
+    python -m excel_sheet_matching_agent.verdict_cache clear
+'''
+from pathlib import Path
+from typing import Iterable, Optional
+import argparse
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from .models import ExcelCellInputData, MatchingResult
+
+
+DEFAULT_PATH = Path("./data/verdict_cache.sqlite3")
+DEFAULT_MAX_ENTRIES = 100_000
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    document_hash TEXT NOT NULL,
+    value TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS verdicts_accessed_at ON verdicts (accessed_at);
+CREATE INDEX IF NOT EXISTS verdicts_model ON verdicts (model);
+CREATE INDEX IF NOT EXISTS verdicts_document_hash ON verdicts (document_hash);
+"""
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_value(value: int | float) -> str:
+    return f"{float(value):.12g}"
+
+
+def normalize_metadata(metadata: list[str]) -> list[str]:
+    return [unicodedata.normalize("NFKC", v).strip() for v in metadata if v and v.strip()]
+
+
+def model_id(llm) -> str:
+    """モデル名と temperature（取れない属性は None）"""
+    name = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    return f"{name}@{getattr(llm, 'temperature', None)}"
+
+
+def prompt_hash(prompt, **params) -> str:
+    """プロンプトテンプレートと、結果に影響するその他のパラメータ（top_k など）のハッシュ"""
+    return _sha256(prompt.pretty_repr() + json.dumps(params, sort_keys=True, default=str))
+
+
+def document_hash(paths: Iterable[Path]) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.read_bytes())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class VerdictCache:
+    def __init__(self, path: Path = DEFAULT_PATH, max_entries: Optional[int] = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def key(model: str, prompt: str, document: str, inp: ExcelCellInputData) -> str:
+        return _sha256(json.dumps(
+            [model, prompt, document, normalize_value(inp.value), normalize_metadata(inp.metadata)],
+            ensure_ascii=False,
+        ))
+
+    def get_many(
+            self, model: str, prompt: str, document: str, inputs: list[ExcelCellInputData]
+        ) -> dict[tuple[str, str], MatchingResult]:
+        """キャッシュにある入力の結果を (シート, cell) ごとに返す"""
+        keys: dict[str, list[ExcelCellInputData]] = {}
+        for inp in inputs:
+            keys.setdefault(self.key(model, prompt, document, inp), []).append(inp)
+        found: dict[tuple[str, str], MatchingResult] = {}
+        with self._lock:
+            rows = []
+            key_list = list(keys)
+            for i in range(0, len(key_list), 500):
+                part = key_list[i:i+500]
+                rows += self._conn.execute(
+                    f"SELECT key, result FROM verdicts WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+            self._conn.executemany(
+                "UPDATE verdicts SET accessed_at = ? WHERE key = ?", [(time.time(), key) for key, _ in rows]
+            )
+            self._conn.commit()
+        for key, result in rows:
+            cached = MatchingResult.model_validate_json(result)
+            for inp in keys[key]:
+                found[(inp.sheet, inp.cell)] = cached.model_copy(update={"cell": inp.cell})
+        self.hits += len(found)
+        self.misses += len(inputs) - len(found)
+        return found
+
+    def put_many(self, model: str, prompt: str, document: str, items: list[tuple[ExcelCellInputData, MatchingResult]]):
+        now = time.time()
+        rows = [
+            (
+                self.key(model, prompt, document, inp), model, prompt, document,
+                normalize_value(inp.value), json.dumps(normalize_metadata(inp.metadata), ensure_ascii=False),
+                result.model_dump_json(), now, now,
+            )
+            for inp, result in items
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        if self.max_entries is None:
+            return 0
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM verdicts WHERE key IN ("
+                " SELECT key FROM verdicts ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+        return cur.rowcount
+
+    def invalidate(self, model: Optional[str] = None, document: Optional[str] = None) -> int:
+        """条件に合うエントリを削除する（条件なしなら全件）"""
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("model LIKE ?")
+            params.append(f"{model}%")
+        if document is not None:
+            conditions.append("document_hash LIKE ?")
+            params.append(f"{document}%")
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM verdicts{where}", params)
+            self._conn.commit()
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+            by_model = self._conn.execute("SELECT model, COUNT(*) FROM verdicts GROUP BY model").fetchall()
+        return {
+            "path": str(self.path),
+            "entries": count,
+            "max_entries": self.max_entries,
+            "by_model": dict(by_model),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def entries(self, limit: int = 20) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, document_hash, value, metadata, result, accessed_at"
+                " FROM verdicts ORDER BY accessed_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {
+                "model": model,
+                "document_hash": document[:12],
+                "value": value,
+                "metadata": json.loads(metadata),
+                "result": json.loads(result),
+                "accessed_at": accessed_at,
+            }
+            for model, document, value, metadata, result, accessed_at in rows
+        ]
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m excel_sheet_matching_agent.verdict_cache")
+    parser.add_argument("--db", type=Path, default=DEFAULT_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats")
+    list_parser = sub.add_parser("list")
+    list_parser.add_argument("--limit", type=int, default=20)
+    invalidate_parser = sub.add_parser("invalidate")
+    invalidate_parser.add_argument("--model", help="model name prefix, e.g. gpt-4o-mini")
+    invalidate_parser.add_argument("--document-hash", help="document hash prefix")
+    sub.add_parser("clear")
+    args = parser.parse_args(argv)
+
+    cache = VerdictCache(args.db)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif args.command == "list":
+        for entry in cache.entries(args.limit):
+            print(json.dumps(entry, ensure_ascii=False))
+    elif args.command == "invalidate":
+        print(f"deleted: {cache.invalidate(args.model, args.document_hash)}")
+    elif args.command == "clear":
+        print(f"deleted: {cache.invalidate()}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from azure.ai.documentintelligence.models import AnalyzeResult
+
+from pathlib import Path
+import asyncio
+import io
+import json
+import time
+
+from excel_sheet_matching_agent.analyze_local_pdf import (
+    AdaptiveBackoff, analyze_local_pdf, analyze_many, analyze_many_async, cc, write_converted_json
+)
+from excel_sheet_matching_agent.fakes import (
+    FakeAsyncDocumentIntelligenceClient, FakeDocumentIntelligenceClient, default_result_factory
+)
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.layout_store import is_fresh
+
+
+def _pdfs(tmp_path: Path, n: int) -> list[Path]:
+    paths = []
+    for i in range(n):
+        path = tmp_path / f"source{i}.pdf"
+        path.write_bytes(f"%PDF-fake {i}".encode())
+        paths.append(path)
+    return paths
+
+
+def test_analyze_local_pdf_uses_cache(tmp_path: Path):
+    pdf, = _pdfs(tmp_path, 1)
+    client = FakeDocumentIntelligenceClient()
+    cache = LayoutCache(tmp_path / "cache")
+    md, js = analyze_local_pdf(pdf, tmp_path / "out", cache=cache, client=client)  # type: ignore
+    assert md.parent == tmp_path / "out" / "markdown" and md.name.startswith("source0.")
+    assert js.exists()
+    assert is_fresh(js)
+    analyze_local_pdf(pdf, tmp_path / "out", cache=cache, client=client)  # type: ignore
+    assert client.calls == 1
+    assert cache.stats.hits == 1
+
+    # 同名でも中身が違えば再解析する
+    before = md.read_text(encoding="utf-8")
+    pdf.write_bytes(b"%PDF-fake revised")
+    analyze_local_pdf(pdf, tmp_path / "out", cache=cache, client=client)  # type: ignore
+    assert client.calls == 2
+    assert md.read_text(encoding="utf-8") != before
+    assert is_fresh(js)
+
+
+def test_analyze_many_parallel_in_order(tmp_path: Path):
+    pdfs = _pdfs(tmp_path, 8)
+    client = FakeDocumentIntelligenceClient(latency=0.1)
+    start = time.perf_counter()
+    results = analyze_many(pdfs, max_concurrency=4, output_dir=tmp_path / "out",
+                           cache=LayoutCache(tmp_path / "cache"), client=client)  # type: ignore
+    elapsed = time.perf_counter() - start
+    assert [md.stem.rsplit(".", 1)[0] for md, _ in results] == [pdf.stem for pdf in pdfs]
+    assert client.max_in_flight == 4
+    assert elapsed < 0.8 * 8 * 0.1
+
+
+def test_same_name_in_different_directories(tmp_path: Path):
+    pdfs = []
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        pdfs.append(tmp_path / name / "source.pdf")
+        pdfs[-1].write_bytes(f"%PDF-fake {name}".encode())
+    results = analyze_many(pdfs, max_concurrency=2, output_dir=tmp_path / "out",
+                           cache=LayoutCache(tmp_path / "cache"), client=FakeDocumentIntelligenceClient())  # type: ignore
+    assert len({md for md, _ in results}) == len({js for _, js in results}) == 2
+    for pdf, (md, js) in zip(pdfs, results):
+        expected = cc(default_result_factory("prebuilt-layout", pdf.read_bytes()).content)
+        assert md.read_text(encoding="utf-8") == expected
+        assert json.loads(js.read_text(encoding="utf-8"))["content"] == expected
+
+
+def test_analyze_many_backs_off_on_429(tmp_path: Path):
+    pdfs = _pdfs(tmp_path, 2)
+    client = FakeDocumentIntelligenceClient(throttle_first=2)
+    backoff = AdaptiveBackoff(initial=0.01)
+    results = analyze_many(pdfs, max_concurrency=2, output_dir=tmp_path / "out",
+                           cache=LayoutCache(tmp_path / "cache"), client=client, backoff=backoff)  # type: ignore
+    assert len(results) == 2
+    assert client.calls == 4
+    assert backoff.delay == 0.0
+
+
+def test_analyze_many_async(tmp_path: Path):
+    pdfs = _pdfs(tmp_path, 6)
+    client = FakeAsyncDocumentIntelligenceClient(latency=0.05)
+    results = asyncio.run(analyze_many_async(pdfs, max_concurrency=3, output_dir=tmp_path / "out",
+                                             cache=LayoutCache(tmp_path / "cache"), client=client))  # type: ignore
+    assert [md.stem.rsplit(".", 1)[0] for md, _ in results] == [pdf.stem for pdf in pdfs]
+    assert client.max_in_flight == 3
+
+
+def test_converted_json_matches_full_conversion():
+    layout = json.loads(Path("data/document_intelligence/json/出典サンプル.json").read_text(encoding="utf-8"))
+    layout["pages"][0]["words"][0]["content"] = "线量"
+    layout["paragraphs"][0]["content"] = "简体字的线量率"
+    f = io.StringIO()
+    write_converted_json(AnalyzeResult(layout), f)
+    converted = json.loads(f.getvalue())
+    assert converted == json.loads(cc(json.dumps(layout, ensure_ascii=False)))
+    assert converted["pages"][0]["words"][0]["content"] == "線量"
+    assert converted["pages"][0]["words"][0]["polygon"] == layout["pages"][0]["words"][0]["polygon"]
+
+
+def test_falls_back_to_legacy_names(tmp_path: Path):
+    # 同梱の解析結果（パスのハッシュを付ける前の名前）があれば、API を呼ばずに使う
+    bundled = Path(__file__).parents[1] / "data" / "document_intelligence"
+    out = tmp_path / "out"
+    for kind, suffix in [("markdown", ".md"), ("json", ".json")]:
+        (out / kind).mkdir(parents=True)
+        (out / kind / f"出典サンプル{suffix}").write_bytes((bundled / kind / f"出典サンプル{suffix}").read_bytes())
+    pdf = tmp_path / "出典サンプル.pdf"
+    pdf.write_bytes(b"%PDF-fake sample")
+    client = FakeDocumentIntelligenceClient()
+    cache = LayoutCache(tmp_path / "cache")
+    md, js = analyze_local_pdf(pdf, out, cache=cache, client=client)  # type: ignore
+    assert client.calls == 0
+    assert md.read_bytes() == (out / "markdown" / "出典サンプル.md").read_bytes()
+    assert json.loads(js.read_text(encoding="utf-8"))["content"] == md.read_text(encoding="utf-8")
+    assert is_fresh(js)
+
+    # 改訂した PDF には使わない
+    pdf.write_bytes(b"%PDF-fake revised")
+    analyze_local_pdf(pdf, out, cache=cache, client=client)  # type: ignore
+    assert client.calls == 1
+
+    # 同名の別の PDF を解析したことがあれば使わない
+    (tmp_path / "other").mkdir()
+    other = tmp_path / "other" / "出典サンプル.pdf"
+    other.write_bytes(b"%PDF-fake other")
+    analyze_local_pdf(other, out, cache=LayoutCache(tmp_path / "cache2"), client=client)  # type: ignore
+    assert client.calls == 2
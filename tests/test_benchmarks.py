@@ -0,0 +1,36 @@
+from pathlib import Path
+
+from benchmarks.run import compare, run
+from benchmarks.synthetic import SHEET_NAME, make_case
+from excel_sheet_matching_agent.analyze_local_pdf import analyze_local_pdf
+from excel_sheet_matching_agent.fakes import FakeDocumentIntelligenceClient, FakeMatchingLLM
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.load_xlsx import extract_data
+from excel_sheet_matching_agent.matching import match
+
+
+def test_synthetic_case_matches_with_fakes(tmp_path: Path):
+    case = make_case(tmp_path, scale=5, formula_ratio=0.5)
+    data = extract_data(case.excel_path, SHEET_NAME)
+    assert len(data.input) + len(data.formula) == len(case.rows)
+    assert len(data.formula) == sum(r.formula is not None for r in case.rows)
+
+    client = FakeDocumentIntelligenceClient(layouts={case.source_pdf_path.stem: case.json_path})
+    markdown_path, json_path = analyze_local_pdf(
+        case.source_pdf_path, tmp_path / "analyzed", cache=LayoutCache(tmp_path / "cache"), client=client  # type: ignore
+    )
+    assert client.analyzed == [case.source_pdf_path.stem]
+
+    llm = FakeMatchingLLM()
+    results = match(llm, data.input, [markdown_path], [json_path], use_prematch=False)  # type: ignore
+    assert llm.calls and all(r.match for r in results)
+
+
+def test_run_and_compare(tmp_path: Path):
+    current = run([1], tmp_path, repeat=1)
+    assert {"1x/extract_data", "1x/match", "1x/markup_source_pdf", "1x/markup_excel_pdf"} <= set(current["results"])
+    assert compare(current, current) == []
+
+    slower = {"results": {name: seconds * 2 + 1 for name, seconds in current["results"].items()}}
+    assert len(compare(slower, current)) == len(current["results"])
+    assert compare(slower, current, min_delta=10) == []
@@ -0,0 +1,77 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import asyncio
+import json
+
+import fitz
+from openpyxl import Workbook
+
+from excel_sheet_matching_agent import instrumentation
+from excel_sheet_matching_agent.cli import Job, load_jobs, run_batch, write_summary
+from excel_sheet_matching_agent.fakes import FakeAsyncDocumentIntelligenceClient, FakeMatchingLLM
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+
+
+def _pdf(path: Path, text: str) -> Path:
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(path)
+    return path
+
+
+def _job(tmp_path: Path, name: str, source_pdf: Path) -> Job:
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None
+    ws.title = "s"
+    ws.append(["x", 1.5])
+    excel_path = tmp_path / f"{name}.xlsx"
+    wb.save(excel_path)
+    return Job(excel_path=excel_path, excel_pdf_path=_pdf(tmp_path / f"{name}.pdf", "x 1.5"),
+               sheet_name="s", source_pdfs=[source_pdf])
+
+
+def test_load_jobs_csv(tmp_path: Path):
+    path = tmp_path / "jobs.csv"
+    path.write_text("excel_path,excel_pdf_path,sheet_name,source_pdfs\nbook.xlsx,book.pdf,s1,a.pdf; b.pdf\n", encoding="utf-8")
+    job, = load_jobs(path)
+    assert job.name == "book_s1"
+    assert job.source_pdfs == [Path("a.pdf"), Path("b.pdf")]
+
+
+def test_run_batch_isolates_failures(tmp_path: Path):
+    source = _pdf(tmp_path / "source.pdf", "1.5")
+    jobs = [_job(tmp_path, "a", source), _job(tmp_path, "b", source)]
+    jobs.append(jobs[1].model_copy(update={"name": "missing", "excel_path": tmp_path / "missing.xlsx"}))
+
+    client = FakeAsyncDocumentIntelligenceClient()
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results = asyncio.run(run_batch(
+            jobs, FakeMatchingLLM(lambda cell, value, document: False), tmp_path / "out", executor,
+            analysis_output_dir=tmp_path / "di", layout_cache=LayoutCache(tmp_path / "cache"), client=client,
+        ))
+
+    assert [(r.name, r.status, r.stage) for r in results] == [("a_s", "ok", None), ("b_s", "ok", None), ("missing", "failed", "extract")]
+    assert client.calls == 1  # 共有の出典は 1 回だけ解析
+    assert (tmp_path / "out" / "a_s" / "source_markup.pdf").exists()
+    assert (tmp_path / "out" / "b_s" / "b_matching.csv").exists()
+
+    write_summary(tmp_path / "out" / "summary.json", results)
+    summary = json.loads((tmp_path / "out" / "summary.json").read_text(encoding="utf-8"))
+    assert (summary["ok"], summary["failed"]) == (2, 1)
+
+
+def test_run_batch_merges_worker_stages(tmp_path: Path):
+    source = _pdf(tmp_path / "source.pdf", "1.5")
+    jobs = [_job(tmp_path, "a", source), _job(tmp_path, "b", source)]
+
+    with ProcessPoolExecutor(max_workers=2) as executor, instrumentation.recording() as recorder:
+        asyncio.run(run_batch(
+            jobs, FakeMatchingLLM(lambda cell, value, document: False), tmp_path / "out", executor, analysis_output_dir=tmp_path / "di",
+            layout_cache=LayoutCache(tmp_path / "cache"), client=FakeAsyncDocumentIntelligenceClient(),
+        ))
+
+    stages = recorder.report()["stages"]
+    assert stages["extract"]["calls"] == 2  # 子プロセスでの計測
+    assert stages["markup"]["calls"] == 2
+    assert stages["batch.markup"]["calls"] == 2
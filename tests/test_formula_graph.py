@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from openpyxl import Workbook
+from openpyxl.workbook.defined_name import DefinedName
+
+from excel_sheet_matching_agent.fakes import FakeMatchingLLM
+from excel_sheet_matching_agent.formula_graph import load_graph
+from excel_sheet_matching_agent.load_xlsx import extract_data
+from excel_sheet_matching_agent.matching import SKIPPED_REASON, impacted_outputs, match
+from excel_sheet_matching_agent.models import ExcelCellInputData
+
+
+MARKDOWN_PATH = Path("data/document_intelligence/markdown/出典サンプル.md")
+
+
+def _workbook(tmp_path: Path) -> Path:
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None
+    ws.title = "calc"
+    ws["B1"], ws["B2"], ws["B3"], ws["B4"] = 1, 2, 3, 4  # B4 はどこからも使われない
+    ws["C1"] = "=SUM(B1:B2)*rate"
+    ws["C2"] = "=C1+'other sheet'!A1"
+    ws["C3"] = "=B3"
+    other = wb.create_sheet("other sheet")
+    other["A1"] = 5
+    other["A2"] = 6
+    wb.defined_names["rate"] = DefinedName("rate", attr_text="'other sheet'!$A$2")
+    path = tmp_path / "book.xlsx"
+    wb.save(path)
+    return path
+
+
+def test_transitive_precedents(tmp_path: Path):
+    graph = load_graph(_workbook(tmp_path))
+    assert graph.transitive_precedents([("calc", "C2")]) == {
+        ("calc", "C1"), ("calc", "B1"), ("calc", "B2"), ("other sheet", "A1"), ("other sheet", "A2"),
+    }
+    assert graph.transitive_precedents([("calc", "C3")]) == {("calc", "B3")}
+
+
+def test_match_only_inputs_feeding_targets(tmp_path: Path):
+    path = _workbook(tmp_path)
+    graph = load_graph(path)
+    inputs = extract_data(path, "calc").input
+    llm = FakeMatchingLLM(lambda cell, value, document: cell != "B2")
+    results = match(llm, inputs, [MARKDOWN_PATH], use_prematch=False, targets=["C2"], graph=graph)  # type: ignore
+    assert llm.calls == [["B1", "B2"]]
+    assert [r.reason for r in results[2:]] == [SKIPPED_REASON, SKIPPED_REASON]
+    assert impacted_outputs(graph, inputs, results, ["C2", "calc!C3"]) == {"calc!B2": ["calc!C2"]}
+
+
+def test_bare_targets_use_the_sheet_of_all_inputs(tmp_path: Path, caplog):
+    graph = load_graph(_workbook(tmp_path))
+    # 最初のセル（calc!B4）は照合しないので、照合する入力の最初は別のシートのセル
+    inputs = [
+        ExcelCellInputData(sheet="calc", cell="B4", value=4, metadata=[]),
+        ExcelCellInputData(sheet="other sheet", cell="A1", value=5, metadata=[]),
+        ExcelCellInputData(sheet="calc", cell="B1", value=1, metadata=[]),
+    ]
+    llm = FakeMatchingLLM(lambda cell, value, document: cell != "A1")
+    results = match(llm, inputs, [MARKDOWN_PATH], use_prematch=False, targets=["C2"], graph=graph)  # type: ignore
+    assert llm.calls == [["A1", "B1"]]
+    assert results[0].reason == SKIPPED_REASON
+    assert "other sheet!A1 does not match the sources; affects: calc!C2" in caplog.text
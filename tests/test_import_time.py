@@ -0,0 +1,74 @@
+'''
+import 時間のベンチマーク（スケジューラからジョブごとに起動するので、起動コストの劣化を防ぐ）
+'''
+from pathlib import Path
+import os
+import re
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ["fitz", "openpyxl", "azure", "langchain_core", "opencc", "langfuse"]
+# 時間は負荷の高い CI ではぶれるので、遅延 import 前（1.3s 程度）の劣化だけを捕まえる緩い上限にする。
+# 細かい劣化は、重いモジュールを import していないか（import したモジュールの一覧）で見る
+IMPORT_BUDGET_US = 500_000
+
+
+def _run(code: str, *args: str, env: dict | None = None) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args, "-c", code],
+        capture_output=True, text=True, env=env, cwd=Path(__file__).parent.parent,
+    )
+
+
+def _env_without_azure() -> dict:
+    env = dict(os.environ)
+    env.pop("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT", None)
+    env.pop("AZURE_DOCUMENT_INTELLIGENCE_API_KEY", None)
+    return env
+
+
+def test_import_does_not_load_heavy_modules():
+    proc = _run(
+        "import sys, excel_sheet_matching_agent\n"
+        f"print(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+        env=_env_without_azure(),
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "[]"
+
+
+def test_llm_extractor_does_not_load_matching():
+    # LLM での読み込みは照合（prematch・retrieval・formula_graph）を使わない
+    proc = _run(
+        "import sys, excel_sheet_matching_agent.load_xlsx_llm\n"
+        "print(sorted(m for m in sys.modules if m.startswith('excel_sheet_matching_agent.')))",
+        env=_env_without_azure(),
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert "excel_sheet_matching_agent.matching" not in proc.stdout
+
+
+def test_import_time_budget():
+    proc = _run("import excel_sheet_matching_agent", "-X", "importtime")
+    assert proc.returncode == 0, proc.stderr
+    imported = re.findall(r"^import time:.*\|\s*([\w.]+)$", proc.stderr, re.MULTILINE)
+    assert not [m for m in imported if m.split(".")[0] in HEAVY_MODULES]
+    m = re.search(r"\|\s*(\d+)\s*\| excel_sheet_matching_agent$", proc.stderr, re.MULTILINE)
+    assert m is not None
+    cumulative_us = int(m.group(1))
+    print(f"import excel_sheet_matching_agent: {cumulative_us / 1000:.1f} ms")
+    assert cumulative_us < IMPORT_BUDGET_US
+
+
+def test_lazy_attrs_without_azure_env():
+    # Azure の環境変数がなくても import・クライアント以外の利用はできる
+    proc = _run(
+        "import excel_sheet_matching_agent as esma\n"
+        "from excel_sheet_matching_agent.markup import markup_source_pdf\n"
+        "assert callable(esma.markup) and callable(esma.analyze_local_pdf)\n"
+        "print(esma.extract_data.__module__)",
+        env=_env_without_azure(),
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "excel_sheet_matching_agent.load_xlsx"
@@ -0,0 +1,67 @@
+from pathlib import Path
+import json
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from excel_sheet_matching_agent import instrumentation
+from excel_sheet_matching_agent.fakes import FakeMatchingLLM
+from excel_sheet_matching_agent.matching import match
+from excel_sheet_matching_agent.models import ExcelCellInputData
+from excel_sheet_matching_agent.verdict_cache import VerdictCache
+
+
+def _inputs(*values: float) -> list[ExcelCellInputData]:
+    return [ExcelCellInputData(sheet="s", cell=f"A{i+1}", value=v, metadata=["label"]) for i, v in enumerate(values)]
+
+
+def test_disabled_records_nothing():
+    assert instrumentation.get_recorder() is None
+    with instrumentation.stage("x"):
+        instrumentation.count("y")
+    assert instrumentation.llm_config() is None
+
+
+def test_match_stages_and_cache_hits(tmp_path: Path):
+    source = tmp_path / "source.md"
+    source.write_text("doc", encoding="utf-8")
+    cache = VerdictCache(tmp_path / "verdicts.sqlite")
+    with instrumentation.recording() as recorder:
+        match(FakeMatchingLLM(lambda cell, value, document: True), _inputs(1, 2), [source], use_prematch=False, verdict_cache=cache)  # type: ignore
+        match(FakeMatchingLLM(lambda cell, value, document: True), _inputs(1, 2, 3), [source], use_prematch=False, verdict_cache=cache)  # type: ignore
+    assert instrumentation.get_recorder() is None
+
+    report = recorder.report()
+    assert report["stages"]["match"]["calls"] == 2
+    assert report["stages"]["match.llm"]["calls"] == 2
+    assert report["counters"]["verdict_cache_hits"] == 2
+    assert report["counters"]["verdict_cache_misses"] == 3
+    assert report["hit_rates"]["verdict_cache"] == 2 / 5
+    assert report["observations"]["llm_batch_seconds"]["count"] == 2
+    assert report["peak_rss_bytes"] > 0
+
+    recorder.write_report(tmp_path / "report.json")
+    assert json.loads((tmp_path / "report.json").read_text(encoding="utf-8"))["counters"] == report["counters"]
+
+
+def test_token_usage_and_prometheus_text():
+    with instrumentation.recording() as recorder:
+        message = AIMessage("ok", usage_metadata={"input_tokens": 120, "output_tokens": 30, "total_tokens": 150})
+        instrumentation.TokenUsageCallback().on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+        with instrumentation.stage("extract"):
+            pass
+    text = recorder.prometheus_text()
+    assert "esma_llm_prompt_tokens 120" in text
+    assert "esma_llm_completion_tokens 30" in text
+    assert 'esma_stage_calls{stage="extract"} 1' in text
+    assert "# TYPE esma_peak_rss_bytes gauge" in text
+
+
+def test_report_without_resource_module(monkeypatch):
+    monkeypatch.setattr(instrumentation, "resource", None)
+    with instrumentation.recording() as recorder:
+        with instrumentation.stage("x"):
+            pass
+    assert recorder.report()["peak_rss_bytes"] is None
+    text = recorder.prometheus_text()
+    assert "peak_rss_bytes" not in text and 'esma_stage_calls{stage="x"} 1' in text
@@ -0,0 +1,65 @@
+from pathlib import Path
+import os
+import time
+
+from excel_sheet_matching_agent.layout_cache import LayoutCache, MARKDOWN_NAME
+
+
+def _put(cache: LayoutCache, key: str, text: str):
+    with cache.writer(key) as staging:
+        (staging / MARKDOWN_NAME).write_text(text, encoding="utf-8")
+
+
+def test_key_depends_on_content_not_name(tmp_path: Path):
+    a = tmp_path / "a" / "source.pdf"
+    b = tmp_path / "b" / "source.pdf"
+    a.parent.mkdir(); b.parent.mkdir()
+    a.write_bytes(b"%PDF-1 a")
+    b.write_bytes(b"%PDF-1 b")
+    cache = LayoutCache(tmp_path / "cache")
+    key_a = cache.key(a, "prebuilt-layout", "markdown", "v1")
+    assert key_a != cache.key(b, "prebuilt-layout", "markdown", "v1")
+    assert key_a != cache.key(a, "prebuilt-layout", "markdown", "v2")
+    assert key_a != cache.key(a, "prebuilt-read", "markdown", "v1")
+
+
+def test_get_put_stats(tmp_path: Path):
+    cache = LayoutCache(tmp_path / "cache")
+    assert cache.get("k") is None
+    _put(cache, "k", "hello")
+    entry = cache.get("k")
+    assert entry is not None
+    assert entry.markdown_path.read_text(encoding="utf-8") == "hello"
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.writes) == (1, 1, 1)
+    # 書き込みに失敗したエントリは公開されない
+    try:
+        with cache.writer("broken") as staging:
+            (staging / MARKDOWN_NAME).write_text("partial", encoding="utf-8")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert cache.get("broken") is None
+    assert list(cache.tmp_dir.iterdir()) == []
+
+
+def test_evict_lru_by_size(tmp_path: Path):
+    cache = LayoutCache(tmp_path / "cache", max_bytes=None)
+    for i, key in enumerate(["old", "mid", "new"]):
+        _put(cache, key, "x" * 1000)
+        meta = cache.entries_dir / key / "meta.json"
+        os.utime(meta, (time.time() - 100 + i, time.time() - 100 + i))
+    cache.get("old")  # 最近使った
+    cache.max_bytes = cache.size() - 1
+    assert cache.evict() == 1
+    assert cache.get("mid") is None
+    assert cache.get("old") is not None
+    assert cache.get("new") is not None
+
+
+def test_evict_by_age(tmp_path: Path):
+    cache = LayoutCache(tmp_path / "cache", max_age=60)
+    _put(cache, "k", "x")
+    meta = cache.entries_dir / "k" / "meta.json"
+    os.utime(meta, (time.time() - 120, time.time() - 120))
+    assert cache.get("k") is None
+    assert cache.stats.evictions == 1
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+import shutil
+
+from excel_sheet_matching_agent.layout_store import build_layout_store, is_fresh, open_layout, replace_tree, store_path
+from excel_sheet_matching_agent.markup import load_prebuild_layout_result
+from excel_sheet_matching_agent.text_index import TextIndex
+
+
+JSON_PATH = Path("data/document_intelligence/json/出典サンプル.json")
+
+
+def test_store_matches_analyze_result(tmp_path: Path):
+    json_path = tmp_path / JSON_PATH.name
+    shutil.copy(JSON_PATH, json_path)
+    result = load_prebuild_layout_result(json_path)
+    store = open_layout(json_path)
+    assert store_path(json_path).is_dir()
+
+    assert store.content == result.content
+    assert len(store.pages) == len(result.pages)
+    for expected, page in zip(result.pages, store.pages):
+        assert page.page_number == expected.page_number
+        assert page.unit == expected.unit
+        assert [line.content for line in page.lines] == [line.content for line in expected.lines]
+        assert [(w.content, w.span.offset, w.span.length) for w in page.words] == \
+            [(w.content, w.span.offset, w.span.length) for w in expected.words]
+        for word, expected_word in zip(page.words, expected.words):
+            assert all(abs(a - b) < 1e-5 for a, b in zip(word.polygon, expected_word.polygon))
+
+    # AnalyzeResult の代わりにそのまま使える
+    text = "作業時の線量率を算出する"
+    occ, = TextIndex(store).find_all([text])[text]
+    assert "".join(w.content for w in TextIndex(store).words(occ)) == text
+    store.close()
+
+
+def test_rebuilt_when_json_changes(tmp_path: Path):
+    json_path = tmp_path / JSON_PATH.name
+    layout = json.loads(JSON_PATH.read_text(encoding="utf-8"))
+    json_path.write_text(json.dumps(layout, ensure_ascii=False), encoding="utf-8")
+    open_layout(json_path).close()
+    assert is_fresh(json_path)
+
+    layout["pages"][0]["lines"][0]["content"] = "改訂"
+    json_path.write_text(json.dumps(layout, ensure_ascii=False), encoding="utf-8")
+    assert not is_fresh(json_path)
+    store = open_layout(json_path)
+    assert store.page(1).lines[0].content == "改訂"
+    store.close()
+
+
+def test_replace_tree_concurrently(tmp_path: Path):
+    def replace(i: int):
+        src = tmp_path / f"src{i}"
+        src.mkdir()
+        (src / "value").write_text(str(i))
+        replace_tree(src, tmp_path / "dst")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(replace, range(64)))
+    assert int((tmp_path / "dst" / "value").read_text()) in range(64)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["dst"]
+
+
+def test_open_while_rebuilding(tmp_path: Path):
+    json_path = tmp_path / JSON_PATH.name
+    shutil.copy(JSON_PATH, json_path)
+
+    def open_or_rebuild(i: int) -> int:
+        if i % 2:
+            build_layout_store(json_path)
+            return 0
+        store = open_layout(json_path)
+        count = len(store.pages)
+        store.close()
+        return count
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        counts = [c for c in executor.map(open_or_rebuild, range(64)) if c]
+    assert len(set(counts)) == 1
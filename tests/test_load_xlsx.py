@@ -0,0 +1,67 @@
+from pathlib import Path
+import pickle
+
+from openpyxl import Workbook, load_workbook
+import pytest
+
+from excel_sheet_matching_agent.cell_table import FormulaTable, InputTable
+from excel_sheet_matching_agent.load_xlsx import extract_cell_info, extract_data, extract_tables, iter_workbook
+
+
+def _workbook(tmp_path: Path) -> Path:
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None
+    ws.title = "s1"
+    ws.append(["", "単位"])
+    ws.append(["線量率", 1.5, "µSv/h"])
+    ws.append(["時間", 2, "h"])
+    ws.append([])
+    ws.append(["線量", "=B2*B3", "µSv"])
+    wb.create_sheet("s2").append(["x", 10])
+    path = tmp_path / "book.xlsx"
+    wb.save(path)
+    return path
+
+
+def test_extract_data_streaming_matches_full_load(tmp_path: Path):
+    path = _workbook(tmp_path)
+    streamed = extract_data(path, "s1")
+    assert streamed == extract_cell_info(load_workbook(path)["s1"])
+    assert [(c.cell, c.metadata) for c in streamed.input] == [("B2", ["線量率", "µSv/h"]), ("B3", ["時間", "h"])]
+    assert [(c.cell, c.value) for c in streamed.formula] == [("B5", "=B2*B3")]
+
+
+def test_iter_workbook_multiple_sheets_with_vertical_metadata(tmp_path: Path):
+    path = _workbook(tmp_path)
+    cells = list(iter_workbook(path, vertical=True))
+    assert [(c.sheet, c.cell) for c in cells] == [("s1", "B2"), ("s1", "B3"), ("s1", "B5"), ("s2", "B1")]
+    assert cells[0].metadata == ["線量率", "µSv/h", "単位", "2"]
+    # 空行を挟んだ上下は周囲として扱わない
+    assert cells[2].metadata == ["線量", "µSv", "", ""]
+    with pytest.raises(ValueError):
+        list(iter_workbook(path, ["missing"]))
+
+
+def test_tables_are_a_view_of_the_same_cells(tmp_path: Path):
+    path = _workbook(tmp_path)
+    inputs, formulas = extract_tables(path, vertical=True)
+    cells = list(iter_workbook(path, vertical=True))
+    assert list(inputs) == [cells[0], cells[1], cells[3]]
+    assert list(formulas) == [cells[2]]
+    assert inputs[-1] == cells[3] and inputs[0:2] == cells[:2]
+    assert isinstance(inputs[1].value, int) and isinstance(inputs[0].value, float)
+    assert inputs.values.tolist() == [1.5, 2.0, 10.0]
+    assert inputs.coordinate(2) == "B1"
+    assert inputs.sheets == ["s1", "s2"]
+    with pytest.raises(IndexError):
+        inputs[3]
+
+
+def test_extract_data_keeps_the_tables(tmp_path: Path):
+    data = extract_data(_workbook(tmp_path), "s1")
+    assert isinstance(data.input, InputTable) and isinstance(data.formula, FormulaTable)
+    dumped = data.model_dump(mode="json")
+    assert dumped["input"][1] == {"sheet": "s1", "cell": "B3", "value": 2, "metadata": ["時間", "h"]}
+    assert type(data).model_validate(dumped) == data
+    assert pickle.loads(pickle.dumps(data)) == data
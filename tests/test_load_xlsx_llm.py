@@ -1,9 +1,11 @@
 
 from pathlib import Path
-from openpyxl import load_workbook
+import re
+from openpyxl import Workbook, load_workbook
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
 
-from excel_sheet_matching_agent.load_xlsx_llm import sheet2str, extract_inputs
+from excel_sheet_matching_agent.load_xlsx_llm import sheet2str, sheet_tiles, extract_inputs
 
 
 
@@ -19,3 +21,48 @@ def test_extract_inputs():
     inputs = extract_inputs(llm, wb["シート1"])
     for input in inputs:
         print(input)
+
+
+def _sparse_sheet(rows: int):
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None
+    ws.append(["項目", None, None, None, "値"])
+    for i in range(rows):
+        ws.cell(row=i + 3, column=1, value=f"label{i}")
+        ws.cell(row=i + 3, column=5, value=i)
+    return ws
+
+
+def test_sheet2str_is_sparse():
+    html = sheet2str(_sparse_sheet(2))
+    assert '<tr data-row="3"><td data-col="A">label0</td><td colspan="3"></td><td data-col="E" class="input">0</td></tr>' in html
+    assert 'data-row="2"' not in html  # 空行は書かない
+
+
+def test_sheet_tiles_repeat_header_and_overlap():
+    ws = _sparse_sheet(200)
+    tiles = sheet_tiles(ws, max_tokens=300, overlap=2)
+    assert len(tiles) > 1
+    assert all('<tr data-row="1">' in tile for tile in tiles)
+    rows = [re.findall(r'<tr data-row="(\d+)">', tile)[1:] for tile in tiles]
+    assert rows[0][-2:] == rows[1][:2]
+    assert {r for tile in rows for r in tile} == {str(i + 3) for i in range(200)}
+
+
+class FakeLLM:
+    def with_structured_output(self, schema):
+        def invoke(prompt):
+            text = prompt.to_string()
+            return schema(inputs=[
+                {"cell": f"E{row}", "value": 0, "metadata": [label]}
+                for row, label in re.findall(r'<tr data-row="(\d+)"><td data-col="A">(label\d+)</td>', text)
+            ])
+        return RunnableLambda(invoke)
+
+
+def test_extract_inputs_tiles_are_merged():
+    ws = _sparse_sheet(100)
+    inputs = extract_inputs(FakeLLM(), ws, max_tokens=300)  # type: ignore
+    assert [inp.cell for inp in inputs] == [f"E{i + 3}" for i in range(100)]
+    assert inputs[0].metadata == ["label0"]
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from excel_sheet_matching_agent.fakes import FakeMatchingLLM
+from excel_sheet_matching_agent.manifest import build_manifest, diff_inputs, load_manifest, match_incremental
+from excel_sheet_matching_agent.models import ExcelCellInputData, MatchingResult
+
+
+def _inputs(*values: float) -> list[ExcelCellInputData]:
+    return [ExcelCellInputData(sheet="s", cell=f"A{i+1}", value=v, metadata=["label"]) for i, v in enumerate(values)]
+
+
+def test_only_changed_cells_are_verified(tmp_path: Path):
+    source = tmp_path / "source.md"
+    source.write_text("doc", encoding="utf-8")
+    manifest_path = tmp_path / "manifest.json"
+    llm = FakeMatchingLLM(lambda cell, value, document: True)
+
+    match_incremental(llm, _inputs(1, 2, 3), [source], manifest_path, use_prematch=False)  # type: ignore
+    assert llm.calls == [["A1", "A2", "A3"]]
+    assert len(load_manifest(manifest_path).cells) == 3  # type: ignore
+
+    # 1セルだけ変更 + 1セル追加
+    results = match_incremental(llm, _inputs(1, 20, 3, 4), [source], manifest_path, use_prematch=False)  # type: ignore
+    assert llm.calls[1:] == [["A2", "A4"]]
+    assert [r.cell for r in results] == ["A1", "A2", "A3", "A4"]
+
+    # 変更なし
+    match_incremental(llm, _inputs(1, 20, 3, 4), [source], manifest_path, use_prematch=False)  # type: ignore
+    assert len(llm.calls) == 2
+
+    # 出典が変わったら（どの出典で一致したか分からないセルは）照合し直す
+    source.write_text("revised doc", encoding="utf-8")
+    match_incremental(llm, _inputs(1, 20, 3, 4), [source], manifest_path, use_prematch=False)  # type: ignore
+    assert llm.calls[2:] == [["A1", "A2", "A3", "A4"]]
+
+
+def test_diff_inputs_keys_by_sheet_and_cell():
+    inputs = [
+        ExcelCellInputData(sheet="s1", cell="B2", value=1, metadata=["label"]),
+        ExcelCellInputData(sheet="s2", cell="B2", value=2, metadata=["label"]),
+    ]
+    results = [MatchingResult(cell="B2", match=True, reason="one"), MatchingResult(cell="B2", match=False, reason="two")]
+    hashes = {"source.md": "h"}
+    to_verify, carried = diff_inputs(inputs, build_manifest(inputs, results, hashes), hashes)
+    assert to_verify == []
+    assert carried == {("s1", "B2"): results[0], ("s2", "B2"): results[1]}
@@ -0,0 +1,137 @@
+from pathlib import Path
+import csv
+import json
+
+import fitz
+from openpyxl import Workbook
+
+from excel_sheet_matching_agent.markup import Marker, cell_labels, mark_labels, markup, markup_excel_pdf, write_markers
+from excel_sheet_matching_agent.models import ExcelCellInputData, MatchingResult
+
+
+def _sheet(tmp_path: Path) -> tuple[Path, Path]:
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None
+    for row in [("a", 1.5), ("b", 1.5), ("c", 2)]:
+        ws.append(row)
+    # アクティブなシートは入力のシートとは別
+    wb.active = wb.create_sheet("表紙")
+    excel_path = tmp_path / "sheet.xlsx"
+    wb.save(excel_path)
+
+    # 印刷PDF: 1ページ目に a, b の行、2ページ目に c の行
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 100), "a")
+    page.insert_text((200, 100), "1.50")
+    page.insert_text((72, 200), "b")
+    page.insert_text((200, 200), "1.5")
+    page = doc.new_page()
+    page.insert_text((72, 100), "c")
+    page.insert_text((200, 100), "2")
+    pdf_path = tmp_path / "sheet.pdf"
+    doc.save(pdf_path)
+    return excel_path, pdf_path
+
+
+def _marks(pdf_path: Path, symbol: str) -> list[tuple[int, float]]:
+    doc = fitz.open(pdf_path)
+    return [
+        (page.number, y1)
+        for page in doc
+        for _, _, _, y1, text, *_ in page.get_text("words")
+        if symbol in text
+    ]
+
+
+def test_repeated_values_use_row_neighbours_across_pages(tmp_path: Path):
+    excel_path, pdf_path = _sheet(tmp_path)
+    inputs = [ExcelCellInputData(sheet="Sheet", cell=cell, value=v, metadata=[]) for cell, v in [("B2", 1.5), ("B3", 2)]]
+    output = tmp_path / "sheet_markup.pdf"
+    markup_excel_pdf(excel_path, pdf_path, output, inputs, [True, True], "あい")
+
+    (page, y), = _marks(output, "あ")
+    assert page == 0 and 150 < y < 210  # b の行
+    (page, _), = _marks(output, "い")
+    assert page == 1
+
+
+def test_mark_labels_are_unbounded():
+    labels = mark_labels(40, "あいう")
+    assert labels[:5] == ["あ", "い", "う", "ああ", "あい"]
+    assert len(set(mark_labels(20000))) == 20000
+
+
+def test_write_markers_incremental_and_overlay(tmp_path: Path):
+    _, pdf_path = _sheet(tmp_path)
+    markers = [Marker(0, (100, 100), "あ", 12), Marker(1, (100, 100), "い", 12), Marker(0, (100, 200), "う", 12)]
+
+    output = tmp_path / "incremental.pdf"
+    write_markers(pdf_path, output, markers)
+    # 元PDFのバイト列はそのままで、変更が末尾に追記される
+    assert output.read_bytes().startswith(pdf_path.read_bytes())
+    assert [p for p, _ in _marks(output, "あ")] == [0]
+
+    overlay = tmp_path / "overlay.pdf"
+    write_markers(pdf_path, overlay, markers, save_mode="overlay")
+    doc = fitz.open(overlay)
+    assert doc.page_count == 2
+    assert "1.5" not in doc[0].get_text()
+    assert [p for p, _ in _marks(overlay, "い")] == [1]
+
+
+def test_markup_many_inputs_in_parallel(tmp_path: Path):
+    excel_path, excel_pdf_path = _sheet(tmp_path)
+    source_pdf = tmp_path / "source.pdf"
+    doc = fitz.open()
+    doc.new_page(width=612, height=792)
+    doc.save(source_pdf)
+    layout_json = tmp_path / "source.json"
+    layout_json.write_text(json.dumps({
+        "content": "1.5",
+        "pages": [{
+            "pageNumber": 1, "unit": "inch", "spans": [{"offset": 0, "length": 3}],
+            "words": [{"content": "1.5", "polygon": [1, 1, 2, 1, 2, 1.2, 1, 1.2], "span": {"offset": 0, "length": 3}}],
+        }],
+    }), encoding="utf-8")
+
+    inputs = [ExcelCellInputData(sheet="Sheet", cell=f"B{i % 3 + 1}", value=1.5, metadata=[]) for i in range(8)]
+    results = [MatchingResult(cell=inp.cell, match=True, reason="", matched_text="1.5") for inp in inputs]
+    markup(excel_path, excel_pdf_path, inputs, results, [source_pdf], [layout_json],
+           output_dir=tmp_path / "out", labels=cell_labels(inputs), max_workers=2)
+
+    assert (tmp_path / "out" / "source_markup.pdf").exists()
+    with (tmp_path / "out" / "sheet_matching.csv").open(encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["cell", "value", "match", "source", "page_no", "reason", "symbol"]
+    assert [row[6] for row in rows[1:]] == [f"Sheet!B{i % 3 + 1}" for i in range(8)]
+    assert all(row[3:5] == ["source", "1"] for row in rows[1:])
+
+
+def test_cells_are_marked_only_in_their_source(tmp_path: Path):
+    excel_path, excel_pdf_path = _sheet(tmp_path)
+    source_pdfs, layout_jsons = [], []
+    for name in ["a", "b"]:
+        doc = fitz.open()
+        doc.new_page(width=612, height=792)
+        doc.save(tmp_path / f"{name}.pdf")
+        source_pdfs.append(tmp_path / f"{name}.pdf")
+        layout_jsons.append(tmp_path / f"{name}.json")
+        layout_jsons[-1].write_text(json.dumps({
+            "content": "2",
+            "pages": [{
+                "pageNumber": 1, "unit": "inch", "spans": [{"offset": 0, "length": 1}],
+                "words": [{"content": "2", "polygon": [1, 1, 2, 1, 2, 1.2, 1, 1.2], "span": {"offset": 0, "length": 1}}],
+            }],
+        }), encoding="utf-8")
+
+    inputs = [ExcelCellInputData(sheet="Sheet", cell="B3", value=2, metadata=[])]
+    results = [MatchingResult(cell="B3", match=True, reason="", matched_text="2", source_path=str(tmp_path / "b.md"))]
+    markup(excel_path, excel_pdf_path, inputs, results, source_pdfs, layout_jsons,
+           output_dir=tmp_path / "out", max_workers=1)
+
+    assert _marks(tmp_path / "out" / "a_markup.pdf", "あ") == []
+    assert len(_marks(tmp_path / "out" / "b_markup.pdf", "あ")) == 1
+    with (tmp_path / "out" / "sheet_matching.csv").open(encoding="utf-8") as f:
+        assert list(csv.reader(f))[1][3:5] == ["b", "1"]
@@ -0,0 +1,99 @@
+from pathlib import Path
+import asyncio
+import re
+
+from langchain_core.runnables import RunnableLambda
+
+from excel_sheet_matching_agent.fakes import FakeMatchingLLM
+from excel_sheet_matching_agent.matching import BatchConfig, amatch, averify_in_batches, split_batches
+from excel_sheet_matching_agent.models import ExcelCellInputData, MatchingBatchResult, MatchingResult
+from excel_sheet_matching_agent.prompts import matching_prompt
+
+
+def _inputs(n: int) -> list[ExcelCellInputData]:
+    return [ExcelCellInputData(sheet="s", cell=f"B{i+1}", value=i, metadata=["label", "m"]) for i in range(n)]
+
+
+def _cells(prompt) -> list[str]:
+    return re.findall(r"- Cell: (\S+)", prompt.to_string())
+
+
+def _chain(calls: list, fail_if=lambda cells: False, drop: set[str] = set()):
+    def invoke(prompt) -> MatchingBatchResult:
+        cells = _cells(prompt)
+        calls.append(cells)
+        if fail_if(cells):
+            raise ValueError("malformed response")
+        # 順序を入れ替えて返す
+        return MatchingBatchResult(results=[
+            MatchingResult(cell=cell, match=True, reason="ok") for cell in reversed(cells) if cell not in drop
+        ])
+    return matching_prompt | RunnableLambda(invoke)
+
+
+def test_split_batches_by_size_and_tokens():
+    inputs = _inputs(1000)
+    batches = split_batches(inputs, None, BatchConfig(max_inputs=100))
+    assert len(batches) == 10
+    assert sorted(i for batch in batches for i in batch) == list(range(1000))
+    batches = split_batches(inputs, None, BatchConfig(max_tokens=200, max_inputs=1000))
+    assert all(len(batch) < 100 for batch in batches)
+
+
+def test_split_batches_with_oversized_document():
+    document = ("放射能濃度は100Bq/cm3とする。" * 500)[:9000]
+    batches = split_batches(_inputs(50), None, BatchConfig(max_tokens=8000, max_inputs=40), document)
+    assert [len(batch) for batch in batches] == [40, 10]
+
+
+def test_concurrent_batches_merge_by_cell():
+    calls = []
+    inputs = _inputs(1000)
+    results = asyncio.run(averify_in_batches(_chain(calls), inputs, "doc", config=BatchConfig(max_inputs=100, max_concurrency=8)))
+    assert len(calls) == 10
+    assert [r.cell for r in results] == [inp.cell for inp in inputs]
+
+
+def test_failed_batch_is_bisected():
+    calls = []
+    inputs = _inputs(8)
+    chain = _chain(calls, fail_if=lambda cells: "B3" in cells and len(cells) > 1)
+    results = asyncio.run(averify_in_batches(chain, inputs, "doc", config=BatchConfig()))
+    assert all(r.match for r in results)
+    assert ["B3"] in calls
+
+
+def test_missing_results_are_requested_again():
+    calls = []
+    inputs = _inputs(4)
+    results = asyncio.run(averify_in_batches(_chain(calls, drop={"B2"}), inputs, "doc", config=BatchConfig(max_retries=1)))
+    assert calls == [["B1", "B2", "B3", "B4"], ["B2"]]
+    assert results[1].cell == "B2" and not results[1].match
+    assert results[1].reason == "No result was returned for this cell."
+
+
+def test_same_cell_on_two_sheets(tmp_path: Path):
+    source = tmp_path / "a.md"
+    source.write_text("長さは 1001 m とする。", encoding="utf-8")
+    inputs = [
+        ExcelCellInputData(sheet="s1", cell="B2", value=1001, metadata=["m"]),
+        ExcelCellInputData(sheet="s2", cell="B2", value=1999, metadata=["m"]),
+    ]
+    llm = FakeMatchingLLM()
+    results = asyncio.run(amatch(llm, inputs, [source], top_k=None, use_prematch=False))  # type: ignore
+    assert [r.match for r in results] == [True, False]
+    # 結果は番地で返るので、同じ番地は別々のバッチで問い合わせる
+    assert llm.calls == [["B2"], ["B2"]]
+
+
+def test_sources_are_matched_separately_and_stop_when_found(tmp_path: Path):
+    a, b = tmp_path / "a.md", tmp_path / "b.md"
+    a.write_text("長さは 1001 m、幅は 1002 m とする。", encoding="utf-8")
+    b.write_text("高さは 1003 m とする。", encoding="utf-8")
+    inputs = [ExcelCellInputData(sheet="s", cell=f"B{i}", value=1000 + i, metadata=["m"]) for i in range(1, 5)]
+    llm = FakeMatchingLLM()
+    results = asyncio.run(amatch(llm, inputs, [a, b], top_k=None, use_prematch=False))  # type: ignore
+    assert [r.match for r in results] == [True, True, True, False]
+    assert [r.source_path for r in results[:3]] == [str(a), str(a), str(b)]
+    # すべてのセルを a から照合し、a で一致しなかったセルだけを b に送る
+    assert llm.calls == [["B1", "B2", "B3", "B4"], ["B3", "B4"]]
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json
+
+import pytest
+
+from benchmarks.synthetic import make_rows, source_lines, write_excel_pdf, write_source, write_workbook
+from excel_sheet_matching_agent.fakes import FakeAsyncDocumentIntelligenceClient, FakeMatchingLLM
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.pipeline import load_checkpoint, run_pipeline
+
+
+class Crash(BaseException):
+    pass
+
+
+class CrashingLLM(FakeMatchingLLM):
+    """max_calls 回目より後の問い合わせで落ちる"""
+    def __init__(self, max_calls: int):
+        super().__init__()
+        self.max_calls = max_calls
+
+    def _answer(self, prompt):
+        if len(self.calls) >= self.max_calls:
+            raise Crash()
+        return super()._answer(prompt)
+
+
+@pytest.fixture
+def case(tmp_path: Path) -> dict:
+    rows = make_rows(30, formula_ratio=0.2)
+    inputs = [r for r in rows if r.formula is None]
+    write_workbook(tmp_path / "book.xlsx", rows)
+    write_excel_pdf(tmp_path / "book.pdf", rows)
+    # 入力の半分ずつを別の出典に書き、最後の 1 つはどこにも書かない
+    half = len(inputs) // 2
+    layouts = {}
+    for name, part in (("a", inputs[:half]), ("b", inputs[half:-1])):
+        write_source(tmp_path / f"{name}.pdf", tmp_path / "layouts" / f"{name}.json", tmp_path / "layouts" / f"{name}.md", source_lines(part))
+        layouts[name] = tmp_path / "layouts" / f"{name}.json"
+    return {"tmp": tmp_path, "layouts": layouts, "inputs": len(inputs)}
+
+
+def _run(case: dict, llm, client, **kwargs):
+    tmp = case["tmp"]
+    return run_pipeline(
+        llm, tmp / "book.xlsx", tmp / "book.pdf", "シート1", [tmp / "a.pdf", tmp / "b.pdf"], tmp / "checkpoint.json",
+        output_dir=tmp / "out", analysis_output_dir=tmp / "analyzed", layout_cache=LayoutCache(tmp / "cache"),
+        client=client, use_prematch=False, **kwargs,
+    )
+
+
+def test_pipeline_streams_results_and_resumes(case: dict):
+    tmp = case["tmp"]
+    streamed = []
+    client = FakeAsyncDocumentIntelligenceClient(layouts=case["layouts"])
+    results = _run(case, FakeMatchingLLM(), client, on_result=lambda inp, res: streamed.append(inp.cell))
+
+    assert len(results) == case["inputs"]
+    assert sum(r.match for r in results) == case["inputs"] - 1
+    assert sorted(streamed) == sorted(r.cell for r in results)
+    assert len((tmp / "out" / "book_results.jsonl").read_text(encoding="utf-8").splitlines()) == case["inputs"]
+    for name in ("book_matching.csv", "book_markup.pdf", "a_markup.pdf", "b_markup.pdf"):
+        assert (tmp / "out" / name).exists()
+    assert sorted(client.analyzed) == ["a", "b"]
+
+    # 2 回目は解析も照合も呼ばない
+    llm, client = FakeMatchingLLM(), FakeAsyncDocumentIntelligenceClient(layouts=case["layouts"])
+    assert _run(case, llm, client) == results
+    assert llm.calls == [] and client.analyzed == []
+
+
+def test_pipeline_resumes_after_crash(case: dict):
+    tmp = case["tmp"]
+    client = FakeAsyncDocumentIntelligenceClient(layouts=case["layouts"])
+    with pytest.raises(Crash):
+        _run(case, CrashingLLM(max_calls=1), client, chunk_size=4)
+    checkpoint = load_checkpoint(tmp / "checkpoint.json")
+    done = sum(len(source.matched.cells) for source in checkpoint.sources.values())
+    assert done >= 4
+
+    llm = FakeMatchingLLM()
+    results = _run(case, llm, FakeAsyncDocumentIntelligenceClient(layouts=case["layouts"]), chunk_size=4)
+    assert sum(r.match for r in results) == case["inputs"] - 1
+    # 落ちる前に照合したセルは問い合わせない
+    verified_again = sum(len(cells) for cells in llm.calls)
+    assert verified_again <= 2 * case["inputs"] - done
+    assert json.loads((tmp / "checkpoint.json").read_text(encoding="utf-8"))["version"] == 1
+
+
+def test_pipeline_with_text_layer_and_threaded_markup(case: dict):
+    # テキストレイヤーの解析とマークアップは、複数スレッドの executor でも fitz_lock で順に行われる
+    client = FakeAsyncDocumentIntelligenceClient(layouts=case["layouts"])
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = _run(case, FakeMatchingLLM(), client, use_text_layer=True, executor=executor)
+    assert sum(r.match for r in results) == case["inputs"] - 1
+    assert client.analyzed == []
+    assert (case["tmp"] / "out" / "a_markup.pdf").exists()
@@ -0,0 +1,101 @@
+from pathlib import Path
+
+from langchain_core.runnables import RunnableLambda
+
+from excel_sheet_matching_agent.matching import match
+from excel_sheet_matching_agent.models import ExcelCellInputData, MatchingBatchResult, MatchingResult
+from excel_sheet_matching_agent import prematch as prematch_module
+from excel_sheet_matching_agent.prematch import TokenTable, build_token_table, parse_unit, prematch
+
+
+MARKDOWN_PATH = Path("data/document_intelligence/markdown/出典サンプル.md")
+JSON_PATH = Path("data/document_intelligence/json/出典サンプル.json")
+
+INPUTS = [
+    ExcelCellInputData(sheet="シート1", cell="B2", value=100.0, metadata=["放射能濃度", "Bq/cm3"]),
+    ExcelCellInputData(sheet="シート1", cell="B3", value=1000.0, metadata=["体積", "cm3"]),
+    ExcelCellInputData(sheet="シート1", cell="B5", value=4.5e-11, metadata=["実効線量率定数", "Sv/Bq*m2"]),
+    ExcelCellInputData(sheet="シート1", cell="B6", value=5.0, metadata=["距離", "m"]),
+]
+
+
+def test_parse_unit():
+    assert parse_unit("Sv/Bq*m2") == parse_unit("Sv m2/Bq")
+    dim, factor = parse_unit("ml")  # type: ignore
+    assert (dim, factor) == ("m^3", 1e-6)
+    assert parse_unit("pcs") is None
+
+
+def test_token_normalization():
+    table = TokenTable(["doc"])
+    table.add_line(0, 1, "売上は１，２００千円、人口は3万人、1.5 km先")
+    table.freeze()
+    inputs = [
+        ExcelCellInputData(sheet="s", cell="A1", value=1200000, metadata=["売上", "円"]),
+        ExcelCellInputData(sheet="s", cell="A2", value=1.2, metadata=["単位: 百万円"]),
+        ExcelCellInputData(sheet="s", cell="A3", value=30000, metadata=["人口"]),
+        ExcelCellInputData(sheet="s", cell="A4", value=1500, metadata=["距離", "m"]),
+    ]
+    results = table.resolve(inputs)
+    assert [r.matched_text if r else None for r in results] == ["１，２００千円", "１，２００千円", "3万", "1.5 km"]
+
+
+def test_prematch_sample():
+    results = prematch(INPUTS, [MARKDOWN_PATH], [JSON_PATH])
+    assert results[0] is not None and results[0].matched_text == "100Bq/cm3"
+    assert results[1] is None  # 1000cm3 ≠ 100ml は LLM に任せる
+    assert results[2] is not None and results[2].matched_text == "4.5E-11Sv m2/Bq"
+    assert results[3] is not None and results[3].matched_text == "500cm"
+    assert results[3].page == 1
+
+
+def test_layout_store_is_closed(tmp_path: Path, monkeypatch):
+    json_path = tmp_path / JSON_PATH.name
+    json_path.write_bytes(JSON_PATH.read_bytes())
+    opened = []
+    open_layout = prematch_module.open_layout
+    monkeypatch.setattr(prematch_module, "open_layout", lambda path: opened.append(open_layout(path)) or opened[-1])
+    build_token_table([MARKDOWN_PATH], [json_path])
+    assert len(opened) == 1
+    assert opened[0].tables == {} and opened[0].blob._file.closed
+
+
+def test_ambiguous_goes_to_llm():
+    table = TokenTable(["doc"])
+    table.add_line(0, 1, "幅は5m、高さは500cm")
+    table.freeze()
+    inp = ExcelCellInputData(sheet="s", cell="A1", value=5, metadata=["m"])
+    assert table.resolve([inp]) == [None]
+
+
+def test_repeated_or_unsupported_bare_numbers_go_to_llm():
+    table = TokenTable(["doc"])
+    table.add_line(0, 1, "第1条 申請は1日以内に行う。")
+    table.add_line(0, 2, "第1項 担当は1名とする。")
+    table.add_line(0, 2, "期間は 30 とする。")
+    table.freeze()
+    inputs = [
+        ExcelCellInputData(sheet="s", cell="A1", value=1, metadata=["人数"]),
+        ExcelCellInputData(sheet="s", cell="A2", value=30, metadata=["件数"]),
+        ExcelCellInputData(sheet="s", cell="A3", value=30, metadata=["期間"]),
+    ]
+    results = table.resolve(inputs)
+    assert results[0] is None and results[1] is None
+    assert results[2] is not None and results[2].matched_text == "30" and results[2].page == 2
+
+
+def test_match_sends_only_remaining_cells():
+    sent = []
+
+    def fake_chain(prompt) -> MatchingBatchResult:
+        sent.append(prompt.to_string().split("### Excel Inputs")[1])
+        return MatchingBatchResult(results=[MatchingResult(cell="B3", match=False, reason="differs")])
+
+    class FakeLLM:
+        def with_structured_output(self, schema):
+            return RunnableLambda(fake_chain)
+
+    results = match(FakeLLM(), INPUTS, [MARKDOWN_PATH], [JSON_PATH])  # type: ignore
+    assert [r.cell for r in results] == ["B2", "B3", "B5", "B6"]
+    assert [r.match for r in results] == [True, False, True, True]
+    assert len(sent) == 1 and "B3" in sent[0] and "B2" not in sent[0]
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from langchain_core.runnables import RunnableLambda
+
+from excel_sheet_matching_agent.matching import batch_verify_inputs_with_llm
+from excel_sheet_matching_agent.models import ExcelCellInputData, MatchingBatchResult, MatchingResult
+from excel_sheet_matching_agent.retrieval import build_index, label_tokens, number_tokens
+
+
+MARKDOWN_PATH = Path("data/document_intelligence/markdown/出典サンプル.md")
+JSON_PATH = Path("data/document_intelligence/json/出典サンプル.json")
+
+
+def test_tokens():
+    assert number_tokens("１,０００円と4.5E-11Sv") == {"1000", "4.5e-11"}
+    assert {"放射", "射能", "bq", "cm3"} <= label_tokens("放射能 Bq/cm3")
+
+
+def test_search_top_chunk():
+    for index in [build_index([MARKDOWN_PATH], [JSON_PATH]), build_index([MARKDOWN_PATH])]:
+        inp = ExcelCellInputData(sheet="シート1", cell="B5", value=4.5e-11, metadata=["実効線量率定数", "Sv/Bq*m2"])
+        top = index.search(inp, k=2)
+        assert top[0].kind == "paragraph"
+        assert "4.5E-11" in top[0].text
+        assert top[0].page == 1
+
+        # 単位換算 (5m = 500cm) の候補も引ける
+        inp = ExcelCellInputData(sheet="シート1", cell="B6", value=5.0, metadata=["距離", "m"])
+        assert any("500cm" in chunk.text for chunk in index.search(inp, k=2))
+
+
+def test_batch_verify_with_chunks():
+    index = build_index([MARKDOWN_PATH], [JSON_PATH])
+    inputs = [ExcelCellInputData(sheet="シート1", cell="B2", value=100.0, metadata=["放射能濃度", "Bq/cm3"])]
+    contexts = [index.search(inp, k=1) for inp in inputs]
+    prompts = []
+
+    def fake_chain(values: dict) -> MatchingBatchResult:
+        prompts.append(values)
+        return MatchingBatchResult(results=[
+            MatchingResult(cell="B2", match=True, reason="", matched_text="100Bq/cm3")
+        ])
+
+    results = batch_verify_inputs_with_llm(RunnableLambda(fake_chain), inputs, contexts=contexts)
+    assert "Candidates: chunk" in prompts[0]["excel_inputs"]
+    assert "目的" not in prompts[0]["document_text"]
+    assert results[0].source_path == str(MARKDOWN_PATH)
+    assert results[0].page == 1
@@ -0,0 +1,94 @@
+from pathlib import Path
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks.synthetic import SHEET_NAME, make_case
+from excel_sheet_matching_agent.fakes import FakeDocumentIntelligenceClient, FakeMatchingLLM
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.server import Worker, make_server
+
+
+def _post(url: str, body: dict) -> tuple[int, dict]:
+    request = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.fixture
+def served(tmp_path: Path):
+    case = make_case(tmp_path, 1)
+    client = FakeDocumentIntelligenceClient(layouts={case.source_pdf_path.stem: case.json_path})
+    llm = FakeMatchingLLM()
+    worker = Worker(llm, tmp_path / "analyzed", layout_cache=LayoutCache(tmp_path / "cache"), client=client)
+    worker.start()
+    server = make_server(worker, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]  # type: ignore
+    yield {"url": f"http://{host}:{port}", "case": case, "client": client, "llm": llm, "worker": worker, "tmp": tmp_path}
+    server.shutdown()
+    server.server_close()
+    worker.close()
+
+
+def test_repeated_jobs_reuse_warm_state(served: dict):
+    case = served["case"]
+    body = {"excel_path": str(case.excel_path), "sheet_name": SHEET_NAME, "source_pdfs": [str(case.source_pdf_path)]}
+    status, first = _post(f"{served['url']}/match", body)
+    assert status == 200
+    assert len(first["results"]) == len([r for r in case.rows if r.formula is None])
+    status, second = _post(f"{served['url']}/match", body)
+    assert status == 200
+    assert second["results"] == first["results"]
+    assert served["client"].analyzed == [case.source_pdf_path.stem]
+
+    caches = served["worker"].status()["caches"]
+    assert caches["workbooks"]["hits"] == 1
+    assert caches["analyses"]["hits"] == 1
+    assert caches["indexes"]["hits"] >= 1
+
+    status, marked = _post(f"{served['url']}/markup", {
+        **body, "excel_pdf_path": str(case.excel_pdf_path), "output_dir": str(served["tmp"] / "out"),
+    })
+    assert status == 200
+    assert all(Path(path).exists() for path in marked["outputs"])
+
+
+def test_bad_requests(served: dict):
+    assert _post(f"{served['url']}/unknown", {})[0] == 404
+    assert _post(f"{served['url']}/match", {"excel_path": "book.xlsx"})[0] == 400
+    status, body = _post(f"{served['url']}/extract", {"excel_path": str(served["tmp"] / "missing.xlsx"), "sheet_name": SHEET_NAME})
+    assert status == 400 and "missing.xlsx" in body["error"]
+
+
+def test_queue_is_bounded(tmp_path: Path):
+    worker = Worker(FakeMatchingLLM(), queue_size=1)  # 開始していないのでジョブは処理されない
+    body = {"excel_path": str(tmp_path / "book.xlsx"), "sheet_name": SHEET_NAME}
+    worker.submit("extract", body)
+    with pytest.raises(queue.Full):
+        worker.submit("extract", body)
+
+
+def test_parallel_workers_count_every_job(tmp_path: Path):
+    case = make_case(tmp_path, 1)
+    client = FakeDocumentIntelligenceClient(layouts={case.source_pdf_path.stem: case.json_path})
+    worker = Worker(FakeMatchingLLM(), tmp_path / "analyzed", layout_cache=LayoutCache(tmp_path / "cache"),
+                    client=client, workers=4)
+    worker.start()
+    try:
+        body = {
+            "excel_path": str(case.excel_path), "sheet_name": SHEET_NAME, "source_pdfs": [str(case.source_pdf_path)],
+            "excel_pdf_path": str(case.excel_pdf_path), "use_text_layer": True,
+        }
+        futures = [worker.submit("markup", {**body, "output_dir": str(tmp_path / f"out{i}")}) for i in range(8)]
+        assert all(len(future.result()["outputs"]) == 3 for future in futures)
+        assert worker.status()["completed"] == 8
+    finally:
+        worker.close()
@@ -0,0 +1,99 @@
+from pathlib import Path
+import asyncio
+import json
+
+import pytest
+
+from benchmarks.synthetic import LINES_PER_PAGE, write_source
+from excel_sheet_matching_agent.analyze_local_pdf import analyze_local_pdf, analyze_many_async
+from excel_sheet_matching_agent.fakes import FakeAsyncDocumentIntelligenceClient, FakeDocumentIntelligenceClient
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.layout_store import open_layout
+from excel_sheet_matching_agent.sharding import split_pdf
+
+
+LINES = [f"項目{i}は {i * 1000 + 7} m とする。" for i in range(LINES_PER_PAGE * 2 + 10)]  # 3 ページ
+
+
+class FailingClient(FakeDocumentIntelligenceClient):
+    def __init__(self, layouts: dict[str, Path], fail: str):
+        super().__init__(layouts=layouts)
+        self.fail = fail
+
+    def begin_analyze_document(self, model_id, body, **kwargs):
+        if Path(body.name).stem == self.fail:
+            raise RuntimeError("analysis failed")
+        return super().begin_analyze_document(model_id, body, **kwargs)
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> dict:
+    """3 ページの出典と、全体・1 ページずつの解析結果"""
+    write_source(tmp_path / "source.pdf", tmp_path / "full.json", tmp_path / "full.md", LINES)
+    layouts = {}
+    for page in range(3):
+        stem = f"source.p{page + 1:05d}-{page + 1:05d}"
+        lines = LINES[page * LINES_PER_PAGE:(page + 1) * LINES_PER_PAGE]
+        write_source(tmp_path / "unused.pdf", tmp_path / f"{stem}.json", tmp_path / f"{stem}.md", lines)
+        layouts[stem] = tmp_path / f"{stem}.json"
+    return {"tmp": tmp_path, "layouts": layouts, "full": json.loads((tmp_path / "full.json").read_text(encoding="utf-8"))}
+
+
+def test_split_pdf_is_deterministic(source: dict):
+    tmp = source["tmp"]
+    first = split_pdf(tmp / "source.pdf", tmp / "a", shard_pages=2)
+    second = split_pdf(tmp / "source.pdf", tmp / "b", shard_pages=2)
+    assert [(s.first_page, s.page_count) for s in first] == [(1, 2), (3, 1)]
+    assert [s.path.read_bytes() for s in first] == [s.path.read_bytes() for s in second]
+    assert [(s.first_page, s.page_count) for s in split_pdf(tmp / "source.pdf", tmp / "c", 1, pages=(2, 9))] == [(2, 1), (3, 1)]
+
+
+def test_sharded_analysis_matches_whole_document(source: dict):
+    tmp = source["tmp"]
+    client = FakeDocumentIntelligenceClient(layouts=source["layouts"])
+    _, json_path = analyze_local_pdf(tmp / "source.pdf", tmp / "out", cache=LayoutCache(tmp / "cache"), client=client, shard_pages=1)  # type: ignore
+    merged = json.loads(json_path.read_text(encoding="utf-8"))
+    full = source["full"]
+    assert sorted(client.analyzed) == sorted(source["layouts"])
+    assert [p["pageNumber"] for p in merged["pages"]] == [1, 2, 3]
+    assert len(merged["content"]) == len(full["content"])
+    for merged_page, full_page in zip(merged["pages"], full["pages"]):
+        assert [w["span"] for w in merged_page["words"]] == [w["span"] for w in full_page["words"]]
+        assert merged_page["spans"] == full_page["spans"]
+    assert [p["boundingRegions"][0]["pageNumber"] for p in merged["paragraphs"]] == \
+        [p["boundingRegions"][0]["pageNumber"] for p in full["paragraphs"]]
+    store = open_layout(json_path)
+    assert store.page(3).words[0].content == full["pages"][2]["words"][0]["content"]
+    store.close()
+
+
+def test_only_failed_shards_are_retried(source: dict):
+    tmp = source["tmp"]
+    cache = LayoutCache(tmp / "cache")
+    client = FailingClient(source["layouts"], fail="source.p00002-00002")
+    with pytest.raises(RuntimeError):
+        analyze_local_pdf(tmp / "source.pdf", tmp / "out", cache=cache, client=client, shard_pages=1)  # type: ignore
+    client = FakeDocumentIntelligenceClient(layouts=source["layouts"])
+    analyze_local_pdf(tmp / "source.pdf", tmp / "out", cache=cache, client=client, shard_pages=1)  # type: ignore
+    assert client.analyzed == ["source.p00002-00002"]
+
+
+def test_page_range_keeps_page_numbers(source: dict):
+    tmp = source["tmp"]
+    client = FakeDocumentIntelligenceClient(layouts=source["layouts"])
+    _, json_path = analyze_local_pdf(
+        tmp / "source.pdf", tmp / "out", cache=LayoutCache(tmp / "cache"), client=client, shard_pages=1, pages=(2, 3)  # type: ignore
+    )
+    assert sorted(client.analyzed) == ["source.p00002-00002", "source.p00003-00003"]
+    merged = json.loads(json_path.read_text(encoding="utf-8"))
+    assert [p["pageNumber"] for p in merged["pages"]] == [2, 3]
+
+
+def test_async_sharded_analysis(source: dict):
+    tmp = source["tmp"]
+    client = FakeAsyncDocumentIntelligenceClient(layouts=source["layouts"])
+    [(_, json_path)] = asyncio.run(analyze_many_async(
+        [tmp / "source.pdf"], 2, tmp / "out", cache=LayoutCache(tmp / "cache"), client=client, shard_pages=1  # type: ignore
+    ))
+    assert sorted(client.analyzed) == sorted(source["layouts"])
+    assert len(json.loads(json_path.read_text(encoding="utf-8"))["pages"]) == 3
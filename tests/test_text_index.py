@@ -0,0 +1,61 @@
+from pathlib import Path
+
+from excel_sheet_matching_agent.markup import load_prebuild_layout_result
+from excel_sheet_matching_agent.text_index import AhoCorasick, TextIndex
+from azure.ai.documentintelligence.models import AnalyzeResult
+
+
+JSON_PATH = Path("data/document_intelligence/json/出典サンプル.json")
+
+
+def _word(content: str, offset: int, x: float) -> dict:
+    return {
+        "content": content,
+        "polygon": [x, 1, x + 1, 1, x + 1, 2, x, 2],
+        "span": {"offset": offset, "length": len(content)},
+    }
+
+
+def _result() -> AnalyzeResult:
+    content = "線量率 １，２３４ µSv/h\n| 1 | 2 |\n4"
+    words = [
+        _word("線量率", 0, 0),
+        _word("１，２３４", 4, 1),
+        _word("µSv/h", 10, 2),
+        _word("1", 18, 3),
+        _word("2", 22, 4),
+    ]
+    page2 = [_word("4", 26, 0)]
+    return AnalyzeResult({
+        "content": content,
+        "pages": [
+            {"pageNumber": 1, "words": words, "spans": [{"offset": 0, "length": 25}]},
+            {"pageNumber": 2, "words": page2, "spans": [{"offset": 26, "length": 1}]},
+        ],
+    })
+
+
+def test_aho_corasick_overlapping():
+    matcher = AhoCorasick(["he", "she", "his", "hers"])
+    found = {(matcher.patterns[i], end) for i, end in matcher.iter("ushers")}
+    assert found == {("she", 4), ("he", 4), ("hers", 6)}
+
+
+def test_width_spacing_and_commas_are_ignored():
+    index = TextIndex(_result())
+    found = index.find_all(["1234 μSv/h", "量", "h 1", "4"])
+    occ, = found["1234 μSv/h"]
+    assert [w.content for w in index.words(occ)] == ["１，２３４", "µSv/h"]
+    assert index.bbox(occ) == (1, 1, 3, 2)
+    # 1文字のパターンはその文字を含む単語だけ
+    assert [w.content for w in index.words(found["量"][0])] == ["線量率"]
+    # 表の区切りはまたがない
+    assert found["h 1"] == []
+    assert [occ.page_number for occ in found["4"]] == [1, 2]
+
+
+def test_sample_document():
+    index = TextIndex(load_prebuild_layout_result(JSON_PATH))
+    text = "作業時の線量率を算出する"
+    occ, = index.find_all([text])[text]
+    assert "".join(w.content for w in index.words(occ)) == text
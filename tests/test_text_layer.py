@@ -0,0 +1,103 @@
+from azure.ai.documentintelligence.models import AnalyzeResult
+import fitz
+
+from pathlib import Path
+import asyncio
+import json
+import threading
+
+import pytest
+
+from benchmarks.synthetic import LINES_PER_PAGE, write_source
+from excel_sheet_matching_agent.analyze_local_pdf import analyze_local_pdf, analyze_many_async, fitz_lock
+from excel_sheet_matching_agent.fakes import FakeAsyncDocumentIntelligenceClient, FakeDocumentIntelligenceClient
+from excel_sheet_matching_agent.layout_cache import LayoutCache
+from excel_sheet_matching_agent.layout_store import open_layout
+from excel_sheet_matching_agent.text_index import TextIndex
+from excel_sheet_matching_agent.text_layer import extract_layout, text_layer_runs
+
+
+LINES = [f"項目{i}は {i * 1000 + 7} m とする。" for i in range(LINES_PER_PAGE * 2 + 10)]  # 3 ページ
+
+
+def _scan_page(pdf_path: Path, page_number: int):
+    """page_number のページを画像だけのページに置き換える"""
+    with fitz.open(pdf_path) as doc:
+        page = doc[page_number - 1]
+        pixmap = page.get_pixmap(dpi=72)
+        rect = page.rect
+        doc.delete_page(page_number - 1)
+        scanned = doc.new_page(page_number - 1, width=rect.width, height=rect.height)
+        scanned.insert_image(rect, pixmap=pixmap)
+        doc.save(pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> dict:
+    """3 ページの出典（2 ページ目だけスキャン）と、2 ページ目の解析結果"""
+    write_source(tmp_path / "source.pdf", tmp_path / "full.json", tmp_path / "full.md", LINES)
+    stem = "source.p00002-00002"
+    write_source(tmp_path / "unused.pdf", tmp_path / f"{stem}.json", tmp_path / f"{stem}.md", LINES[LINES_PER_PAGE:LINES_PER_PAGE * 2])
+    full = json.loads((tmp_path / "full.json").read_text(encoding="utf-8"))
+    return {"tmp": tmp_path, "layouts": {stem: tmp_path / f"{stem}.json"}, "full": full}
+
+
+def test_extract_layout_matches_prebuilt_layout(source: dict):
+    tmp, full = source["tmp"], source["full"]
+    layout = extract_layout(tmp / "source.pdf")
+    assert [p["pageNumber"] for p in layout["pages"]] == [1, 2, 3]
+    for page, full_page in zip(layout["pages"], full["pages"]):
+        assert [w["content"] for w in page["words"]] == [w["content"] for w in full_page["words"]]
+        assert [line["content"] for line in page["lines"]] == [line["content"] for line in full_page["lines"]]
+        for word, full_word in zip(page["words"], full_page["words"]):
+            assert layout["content"][word["span"]["offset"]:][:word["span"]["length"]] == word["content"]
+            assert word["polygon"][0] == pytest.approx(full_word["polygon"][0], abs=0.05)
+    for paragraph in layout["paragraphs"]:
+        span = paragraph["spans"][0]
+        assert layout["content"][span["offset"]:span["offset"] + span["length"]] == paragraph["content"]
+
+    index = TextIndex(AnalyzeResult(layout))
+    [occurrence] = index.find_all(["41007"])["41007"]
+    assert occurrence.page_number == 2
+    assert [w.content for w in index.words(occurrence)] == ["41007"]
+
+
+def test_only_scanned_pages_are_sent(source: dict):
+    tmp = source["tmp"]
+    _scan_page(tmp / "source.pdf", 2)
+    assert text_layer_runs(tmp / "source.pdf") == [(True, 1, 1), (False, 2, 2), (True, 3, 3)]
+    client = FakeDocumentIntelligenceClient(layouts=source["layouts"])
+    markdown_path, json_path = analyze_local_pdf(
+        tmp / "source.pdf", tmp / "out", cache=LayoutCache(tmp / "cache"), client=client, shard_pages=1, use_text_layer=True  # type: ignore
+    )
+    assert client.analyzed == ["source.p00002-00002"]
+    merged = json.loads(json_path.read_text(encoding="utf-8"))
+    assert [p["pageNumber"] for p in merged["pages"]] == [1, 2, 3]
+    assert markdown_path.read_text(encoding="utf-8") == merged["content"]
+    for page, full_page in zip(merged["pages"], source["full"]["pages"]):
+        assert [w["content"] for w in page["words"]] == [w["content"] for w in full_page["words"]]
+    store = open_layout(json_path)
+    assert store.page(2).words[0].content == "項"
+    store.close()
+
+
+def test_born_digital_pdf_needs_no_client(source: dict):
+    tmp = source["tmp"]
+    client = FakeAsyncDocumentIntelligenceClient(layouts={})
+    [(_, json_path)] = asyncio.run(analyze_many_async(
+        [tmp / "source.pdf"], 2, tmp / "out", cache=LayoutCache(tmp / "cache"), client=client, use_text_layer=True  # type: ignore
+    ))
+    assert client.analyzed == []
+    assert len(json.loads(json_path.read_text(encoding="utf-8"))["pages"]) == 3
+
+
+def test_text_layer_waits_for_fitz_lock(source: dict):
+    tmp = source["tmp"]
+    thread = threading.Thread(target=analyze_local_pdf, args=(tmp / "source.pdf", tmp / "out"),
+                              kwargs={"cache": LayoutCache(tmp / "cache"), "use_text_layer": True})
+    with fitz_lock:  # 別のスレッドで PyMuPDF を使っている間は待つ
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+    thread.join()
+    assert len(list((tmp / "out" / "json").glob("source.*.json"))) == 1
@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from excel_sheet_matching_agent.fakes import FakeMatchingLLM
+from excel_sheet_matching_agent.matching import match
+from excel_sheet_matching_agent.models import ExcelCellInputData, MatchingResult
+from excel_sheet_matching_agent.verdict_cache import VerdictCache, main
+
+
+MARKDOWN_PATH = Path("data/document_intelligence/markdown/出典サンプル.md")
+
+
+def _input(cell: str, value: float, *metadata: str) -> ExcelCellInputData:
+    return ExcelCellInputData(sheet="s", cell=cell, value=value, metadata=list(metadata))
+
+
+def test_only_uncached_cells_are_sent(tmp_path: Path):
+    cache = VerdictCache(tmp_path / "verdicts.sqlite3")
+    llm = FakeMatchingLLM(lambda cell, value, document: False, model_name="fake")
+    inputs = [_input("A1", 1, "x"), _input("A2", 2, "y")]
+    match(llm, inputs, [MARKDOWN_PATH], use_prematch=False, verdict_cache=cache)  # type: ignore
+    assert llm.calls == [["A1", "A2"]]
+
+    # 行を挿入してセル番地が変わっても、値と metadata が同じならヒット
+    inputs = [_input("A2", 1, "x"), _input("A3", 2.0, "ｙ "), _input("A4", 3, "z")]
+    results = match(llm, inputs, [MARKDOWN_PATH], use_prematch=False, verdict_cache=cache)  # type: ignore
+    assert llm.calls[1:] == [["A4"]]
+    assert [r.cell for r in results] == ["A2", "A3", "A4"]
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_key_includes_model(tmp_path: Path):
+    cache = VerdictCache(tmp_path / "verdicts.sqlite3")
+    llm = FakeMatchingLLM(lambda cell, value, document: False, model_name="fake")
+    match(llm, [_input("A1", 1, "x")], [MARKDOWN_PATH], use_prematch=False, verdict_cache=cache)  # type: ignore
+    llm.temperature = 0.7
+    match(llm, [_input("A1", 1, "x")], [MARKDOWN_PATH], use_prematch=False, verdict_cache=cache)  # type: ignore
+    assert len(llm.calls) == 2
+    assert cache.stats()["entries"] == 2
+    assert cache.invalidate(model="fake@0.7") == 1
+
+
+def test_lru_eviction(tmp_path: Path):
+    cache = VerdictCache(tmp_path / "verdicts.sqlite3", max_entries=2)
+    res = MatchingResult(cell="A1", match=True, reason="")
+    for i in range(3):
+        cache.put_many("m", "p", "d", [(_input("A1", i), res)])
+        cache.get_many("m", "p", "d", [_input("A1", 0)])  # 0 は使い続ける
+    assert cache.stats()["entries"] == 2
+    assert set(cache.get_many("m", "p", "d", [_input("A1", 0)])) == {("s", "A1")}
+    assert cache.get_many("m", "p", "d", [_input("A1", 1)]) == {}
+
+
+def test_cli(tmp_path: Path, capsys):
+    db = tmp_path / "verdicts.sqlite3"
+    VerdictCache(db).put_many("m", "p", "d", [(_input("A1", 1), MatchingResult(cell="A1", match=True, reason=""))])
+    main(["--db", str(db), "stats"])
+    assert '"entries": 1' in capsys.readouterr().out
+    main(["--db", str(db), "clear"])
+    assert "deleted: 1" in capsys.readouterr().out